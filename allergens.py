@@ -0,0 +1,229 @@
+# allergens.py
+# Ingredient and allergen features of meals, stored as bitsets so that
+# "which meals are safe for this user" is a bitwise AND over the catalog.
+#
+# Every feature has a permanent bit number in 'ingredient_vocabulary':
+#   - allergen / diet groups ('peanut', 'dairy', 'meat', ...) detected from
+#     keywords in the ingredient list, and
+#   - single ingredient words ('mushroom', 'coriander', ...) so allergies the
+#     groups do not cover still work.
+# Each meal's features are stored in 'meal_features' as little-endian 64-bit
+# words. A user's allergies and dietary preferences compile to a mask over
+# the same bits (see exclusion_bits); a meal is safe if bits & mask == 0.
+# Meals without a 'meal_features' row are treated as unsafe for users with
+# exclusions, since nothing is known about them.
+import re
+
+# Allergen / diet groups and the (singular, lowercase) ingredient words that
+# put a meal in them
+ALLERGEN_KEYWORDS = {
+    'peanut': ['peanut'],
+    'tree_nut': ['almond', 'walnut', 'cashew', 'pecan', 'hazelnut', 'pistachio',
+                 'macadamia', 'brazil', 'nut'],
+    'dairy': ['milk', 'cheese', 'butter', 'yogurt', 'yoghurt', 'cream', 'whey', 'ghee',
+              'feta', 'parmesan', 'mozzarella', 'ricotta', 'cheddar', 'kefir', 'quark'],
+    'egg': ['egg', 'mayonnaise'],
+    'gluten': ['wheat', 'bread', 'pasta', 'flour', 'barley', 'rye', 'couscous', 'bulgur',
+               'seitan', 'noodle', 'tortilla', 'pita', 'breadcrumb', 'spaghetti', 'bagel',
+               'cracker', 'granola', 'wrap'],
+    'soy': ['soy', 'soya', 'tofu', 'tempeh', 'edamame', 'miso'],
+    'fish': ['fish', 'salmon', 'tuna', 'cod', 'anchovy', 'sardine', 'trout', 'mackerel',
+             'tilapia', 'halibut', 'haddock'],
+    'shellfish': ['shellfish', 'shrimp', 'prawn', 'crab', 'lobster', 'scallop', 'mussel',
+                  'clam', 'oyster'],
+    'sesame': ['sesame', 'tahini'],
+    'meat': ['chicken', 'beef', 'pork', 'turkey', 'lamb', 'bacon', 'ham', 'sausage',
+             'prosciutto', 'veal', 'duck', 'steak', 'chorizo', 'salami'],
+    'pork': ['pork', 'bacon', 'ham', 'prosciutto', 'chorizo', 'salami'],
+    'honey': ['honey'],
+}
+# Phrases that mean a keyword does not count for a group (e.g. almond milk is not dairy)
+ALLERGEN_EXCEPTIONS = {
+    'dairy': ['almond milk', 'soy milk', 'oat milk', 'rice milk', 'coconut milk',
+              'plant-based milk', 'plant milk', 'peanut butter', 'almond butter',
+              'nut butter', 'cocoa butter', 'coconut cream', 'cashew cream',
+              'dairy-free', 'vegan'],
+    'gluten': ['gluten-free', 'rice noodle', 'corn tortilla', 'almond flour',
+               'coconut flour', 'rice flour', 'chickpea flour', 'buckwheat', 'lettuce wrap'],
+    'egg': ['eggplant', 'egg-free', 'vegan mayonnaise'],
+}
+
+# What users type, mapped to groups. Diets exclude several groups at once.
+EXCLUSION_ALIASES = {
+    'peanut': ['peanut'], 'nut': ['peanut', 'tree_nut'], 'tree nut': ['tree_nut'],
+    'nut free': ['peanut', 'tree_nut'], 'peanut free': ['peanut'],
+    'dairy': ['dairy'], 'milk': ['dairy'], 'lactose': ['dairy'], 'lactose intolerant': ['dairy'],
+    'dairy free': ['dairy'], 'lactose free': ['dairy'], 'egg': ['egg'], 'egg free': ['egg'],
+    'gluten': ['gluten'], 'wheat': ['gluten'],
+    'celiac': ['gluten'], 'coeliac': ['gluten'], 'gluten free': ['gluten'],
+    'soy': ['soy'], 'soya': ['soy'], 'soy free': ['soy'], 'fish': ['fish'], 'shellfish': ['shellfish'],
+    'seafood': ['fish', 'shellfish'], 'sesame': ['sesame'], 'pork': ['pork'], 'meat': ['meat'],
+    'vegetarian': ['meat', 'fish', 'shellfish'],
+    'pescatarian': ['meat'],
+    'vegan': ['meat', 'fish', 'shellfish', 'dairy', 'egg', 'honey'],
+    'halal': ['pork'], 'kosher': ['pork', 'shellfish'],
+}
+
+# Words in ingredient lists that are not ingredients
+STOP_WORDS = {
+    'and', 'or', 'of', 'for', 'the', 'with', 'to', 'in', 'on', 'a', 'an', 'each', 'total',
+    'optional', 'taste', 'about', 'approx', 'plus', 'extra', 'more', 'few', 'some',
+    'g', 'kg', 'mg', 'ml', 'l', 'tbsp', 'tsp', 'cup', 'oz', 'lb', 'pinch', 'dash', 'slice',
+    'piece', 'clove', 'handful', 'can', 'large', 'medium', 'small', 'whole', 'half',
+    'chopped', 'diced', 'sliced', 'minced', 'grated', 'fresh', 'frozen', 'dried', 'cooked',
+    'raw', 'ripe', 'mixed', 'low', 'fat', 'free', 'unsweetened', 'plain', 'finely',
+    'roughly', 'thinly', 'boneless', 'skinless', 'lean', 'ground', 'crushed', 'rinsed',
+    'drained', 'peeled', 'cubed', 'shredded', 'toasted', 'roasted', 'steamed', 'boiled',
+    'based', 'grain', 'style', 'light', 'heavy', 'serving', 'water',
+}
+
+WORD_RE = re.compile(r'[a-z]+')
+SPLIT_RE = re.compile(r'[;,/]|\band\b')
+
+def normalize_word(word):
+    """Lowercases a word and strips a plural ending ('berries' -> 'berry', 'eggs' -> 'egg')."""
+    word = word.lower()
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('oes', 'ches', 'shes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+def ingredient_items(raw_ingredients):
+    """Splits the ';'-separated ingredients into lowercased items without '(...)' notes."""
+    items = []
+    for item in (raw_ingredients or '').split(';'):
+        item = re.sub(r'\(.*?\)', ' ', item).lower().strip()
+        if item:
+            items.append(item)
+    return items
+
+def extract_features(raw_ingredients):
+    """
+    Returns the set of feature terms of one meal: 'group:<name>' for each
+    allergen group it belongs to, and 'word:<word>' for each ingredient word.
+    """
+    features = set()
+    for item in ingredient_items(raw_ingredients):
+        words = {normalize_word(w) for w in WORD_RE.findall(item)}
+        words = {w for w in words if len(w) > 2 and w not in STOP_WORDS}
+        features.update(f'word:{w}' for w in words)
+        for group, keywords in ALLERGEN_KEYWORDS.items():
+            if not words.intersection(keywords):
+                continue
+            if any(phrase in item for phrase in ALLERGEN_EXCEPTIONS.get(group, ())):
+                continue
+            features.add(f'group:{group}')
+    return features
+
+def _exclusion_phrases(text):
+    """Splits a free-form list into normalized phrases, dropping 'none' and 'no ...'/'... allergy' wording."""
+    for part in SPLIT_RE.split((text or '').lower()):
+        phrase = ' '.join(normalize_word(w) for w in WORD_RE.findall(part.replace('-', ' ')))
+        if not phrase or phrase in ('none', 'no', 'nothing', 'n a'):
+            continue
+        yield phrase.removeprefix('no ').removesuffix(' allergy')
+
+def exclusion_terms(allergies, dietary_preferences=None):
+    """
+    Returns the feature terms a user's allergies / dietary preferences exclude.
+    Both are free-form lists ('peanuts, shellfish', 'vegan'). Known names map to
+    allergen groups; any other allergy maps to its ingredient words, while other
+    diet wording ('high protein', 'low carb') excludes nothing.
+    """
+    terms = set()
+    for phrase in _exclusion_phrases(allergies):
+        if phrase in EXCLUSION_ALIASES:
+            terms.update(f'group:{group}' for group in EXCLUSION_ALIASES[phrase])
+        else:
+            terms.update(f'word:{w}' for w in phrase.split()
+                         if len(w) > 2 and w not in STOP_WORDS)
+    for phrase in _exclusion_phrases(dietary_preferences):
+        terms.update(f'group:{group}' for group in EXCLUSION_ALIASES.get(phrase, ()))
+    return terms
+
+def unmatched_preferences(dietary_preferences):
+    """
+    Returns the phrases of a dietary preference list that are not a known diet
+    or allergen name, and so exclude nothing (e.g. 'high protein'), in order.
+    """
+    return [phrase for phrase in _exclusion_phrases(dietary_preferences)
+            if phrase not in EXCLUSION_ALIASES]
+
+# =============================================================================
+# STORAGE
+# =============================================================================
+
+def create_meal_features(cursor):
+    """
+    Creates 'ingredient_vocabulary' (feature term -> permanent bit number) and
+    'meal_features' (one bitset per meal).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingredient_vocabulary (
+            bit INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_features (
+            meal_id INTEGER PRIMARY KEY,
+            bits BLOB NOT NULL,
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        )
+    ''')
+
+def load_vocabulary(cursor):
+    """Returns {feature term: bit number}."""
+    return {term: bit for bit, term in cursor.execute("SELECT bit, term FROM ingredient_vocabulary")}
+
+def encode_bits(bits):
+    """Packs a set of bit numbers into little-endian 64-bit words (as bytes)."""
+    value = 0
+    for bit in bits:
+        value |= 1 << bit
+    words = max(1, (value.bit_length() + 63) // 64)
+    return value.to_bytes(words * 8, 'little')
+
+def refresh_meal_features(cursor, meal_ids=None):
+    """
+    Recomputes the feature bitsets of the given meals (all meals if None) from
+    their ingredients, adding new terms to the vocabulary. Runs inside the
+    caller's transaction. Returns the number of meals written.
+    """
+    vocabulary = load_vocabulary(cursor)
+    if meal_ids is None:
+        rows = cursor.execute("SELECT id, ingredients FROM meals").fetchall()
+    else:
+        meal_ids = list(meal_ids)
+        rows = []
+        for start in range(0, len(meal_ids), 500):
+            chunk = meal_ids[start:start + 500]
+            rows += cursor.execute(
+                f"SELECT id, ingredients FROM meals WHERE id IN ({', '.join('?' for _ in chunk)})",
+                chunk).fetchall()
+
+    new_terms = []
+    feature_rows = []
+    for meal_id, ingredients in rows:
+        bits = set()
+        for term in sorted(extract_features(ingredients)):
+            if term not in vocabulary:
+                vocabulary[term] = len(vocabulary)
+                new_terms.append((vocabulary[term], term))
+            bits.add(vocabulary[term])
+        feature_rows.append((meal_id, encode_bits(bits)))
+    cursor.executemany("INSERT INTO ingredient_vocabulary (bit, term) VALUES (?, ?)", new_terms)
+    cursor.executemany("INSERT OR REPLACE INTO meal_features (meal_id, bits) VALUES (?, ?)",
+                       feature_rows)
+    return len(feature_rows)
+
+def exclusion_bits(vocabulary, allergies, dietary_preferences=None):
+    """
+    Returns the set of bit numbers a user's allergies / dietary preferences
+    exclude. Terms no meal has (not in the vocabulary) cannot match and are dropped.
+    """
+    return {vocabulary[term] for term in exclusion_terms(allergies, dietary_preferences)
+            if term in vocabulary}
@@ -0,0 +1,355 @@
+# benchmark.py
+# Benchmark suite for FitMate. Builds a synthetic catalog and user base at a
+# configurable scale, times the hot code paths and main routes, and saves the
+# results as JSON so later runs can be compared against a baseline.
+#
+#   python benchmark.py --meals 50000 --users 100000 --save bench_baseline.json
+#   python benchmark.py --meals 50000 --users 100000 --compare bench_baseline.json
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from allergens import refresh_meal_features
+from categories import CATEGORY_MAPPING
+from planner import SLOT_ORDER, SLOT_MEAL_TYPES, STATUS_CODES, slots_for
+from search import search_meal_ids
+from similarity import refresh_meal_neighbors
+
+# Allowed slowdown (as a fraction of the baseline median) before a result counts as a regression
+DEFAULT_THRESHOLD = 0.20
+# Slowdowns smaller than this (in milliseconds) are treated as timer noise
+DEFAULT_MIN_DELTA_MS = 0.05
+
+WORDS = ['chicken', 'rice', 'tofu', 'oats', 'spinach', 'salmon', 'quinoa', 'egg',
+         'avocado', 'beans', 'yogurt', 'almond', 'broccoli', 'pasta', 'lentil', 'berry']
+EQUIPMENT = ['pan', 'pot', 'oven', 'blender', 'bowl', 'knife and cutting board', 'spatula']
+
+# =============================================================================
+# SYNTHETIC DATA
+# =============================================================================
+
+def synthetic_meal(index, rng):
+    """Returns one fake meal row (as a dict of meals columns)."""
+    meal_type = 'breakfast' if rng.random() < 0.35 else 'lunch/dinner'
+    words = rng.sample(WORDS, 3)
+    categories = rng.sample(list(CATEGORY_MAPPING), rng.randint(1, 4))
+    ingredients = '; '.join(f"{rng.randint(5, 300)} g {w} ({rng.randint(1, 4)} portions)"
+                            for w in rng.sample(WORDS, rng.randint(4, 10)))
+    instructions = ' '.join(f"{n}. {rng.choice(['mix', 'cook', 'bake', 'chop', 'serve'])} the "
+                            f"{rng.choice(WORDS)} for {rng.randint(1, 20)} minutes."
+                            for n in range(1, rng.randint(4, 9)))
+    return {
+        'type': meal_type,
+        'name': ' '.join(words) + f' {index}',
+        'identifier': f'syn{index:06d}',
+        'categories': '; '.join(categories),
+        'prep_time': rng.choice([5, 10, 15, 20, 30, 45, 60]),
+        'overnight': 1 if rng.random() < 0.02 else 0,
+        'equipment': ', '.join(rng.sample(EQUIPMENT, 3)),
+        'ingredients': ingredients,
+        'instructions': instructions,
+    }
+
+def generate_synthetic_data(database, meals=1000, users=100, plan_days=30,
+                            meals_per_day='All 3', favorites_per_user=5, seed=0):
+    """
+    Creates the schema in 'database' and fills it with synthetic meals and users.
+    Every user gets an active plan of plan_days days (the first third already done)
+    and a few favorites. Returns the number of rows written per table.
+    """
+    import project
+    from categories import category_keys
+
+    rng = random.Random(seed)
+    project.app.config['DATABASE'] = database
+    project.create_tables()
+    project.close_thread_connections()
+
+    conn = sqlite3.connect(database)
+    with conn:
+        meal_rows = [synthetic_meal(i, rng) for i in range(meals)]
+        conn.executemany('''
+            INSERT INTO meals (type, name, identifier, categories, prep_time, overnight,
+                               equipment, ingredients, instructions)
+            VALUES (:type, :name, :identifier, :categories, :prep_time, :overnight,
+                    :equipment, :ingredients, :instructions)
+        ''', meal_rows)
+        ids_by_type = {}
+        category_rows = []
+        for meal_id, meal_type, cat_str in conn.execute("SELECT id, type, categories FROM meals"):
+            ids_by_type.setdefault(meal_type, []).append(meal_id)
+            category_rows.extend((meal_id, key) for key in category_keys(cat_str))
+        conn.executemany("INSERT OR IGNORE INTO meal_categories (meal_id, category) VALUES (?, ?)",
+                         category_rows)
+        refresh_meal_features(conn)
+        refresh_meal_neighbors(conn.cursor())
+
+        # One shared hash keeps user creation fast; the password is 'benchmark'
+        from werkzeug.security import generate_password_hash
+        password = generate_password_hash('benchmark')
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, ?)",
+                         ((f'bench_user_{i}', password) for i in range(users)))
+        user_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM users WHERE username LIKE 'bench_user_%' ORDER BY id")]
+
+        slots = slots_for(meals_per_day)
+        done_days = plan_days // 3
+
+        def plan_rows():
+            for user_id in user_ids:
+                for day in range(1, plan_days + 1):
+                    for slot in slots:
+                        pool = ids_by_type.get(SLOT_MEAL_TYPES[slot]) or ids_by_type[next(iter(ids_by_type))]
+                        yield (user_id, day, SLOT_ORDER[slot], rng.choice(pool),
+                               STATUS_CODES['done' if day <= done_days else 'pending'])
+
+        conn.executemany('''
+            INSERT OR IGNORE INTO user_meals (user_id, day, slot, meal_id, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', plan_rows())
+        conn.execute('''
+            INSERT OR REPLACE INTO user_day_progress (user_id, day, pending)
+            SELECT user_id, day, SUM(status = 0)
+            FROM user_meals GROUP BY user_id, day
+        ''')
+        conn.execute('''
+            INSERT OR REPLACE INTO user_progress (user_id, current_day)
+            SELECT user_id, MIN(CASE WHEN pending > 0 THEN day END)
+            FROM user_day_progress GROUP BY user_id
+        ''')
+        goals = sorted(CATEGORY_MAPPING)
+        conn.executemany('''
+            INSERT OR REPLACE INTO user_plan_settings (user_id, goals, meals_per_day, duration)
+            VALUES (?, ?, ?, ?)
+        ''', ((user_id, rng.choice(goals), meals_per_day, plan_days) for user_id in user_ids))
+        all_meal_ids = [meal_id for ids in ids_by_type.values() for meal_id in ids]
+        conn.executemany("INSERT OR IGNORE INTO favorites (user_id, meal_id) VALUES (?, ?)",
+                         ((user_id, meal_id) for user_id in user_ids
+                          for meal_id in rng.sample(all_meal_ids, min(favorites_per_user, len(all_meal_ids)))))
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('meals', 'users', 'user_meals', 'favorites')}
+    conn.close()
+    return counts
+
+def write_synthetic_workbook(path, rows, seed=0):
+    """Writes rows synthetic meals to an Excel file in the importer's format."""
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['type', 'meal name', 'identifier', 'categories', 'preptime',
+                  'overnight', 'equipment', 'ingredients', 'instructions'])
+    for i in range(rows):
+        meal = synthetic_meal(i, rng)
+        sheet.append([meal['type'], meal['name'], meal['identifier'], meal['categories'],
+                      meal['prep_time'], bool(meal['overnight']), meal['equipment'],
+                      meal['ingredients'], meal['instructions']])
+    workbook.save(path)
+
+# =============================================================================
+# TIMING
+# =============================================================================
+
+def time_calls(func, repeat):
+    """Calls func() repeat times and returns the durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+def summarize(durations):
+    """Turns a list of durations (seconds) into milliseconds statistics."""
+    ordered = sorted(durations)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        'runs': len(ordered),
+        'median_ms': statistics.median(ordered) * 1000,
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p95_ms': ordered[p95_index] * 1000,
+        'min_ms': ordered[0] * 1000,
+    }
+
+def run_benchmarks(database, repeat=20, import_rows=2000, seed=0, workdir=None):
+    """
+    Times the main code paths against an already populated database.
+    Returns {benchmark name: statistics}.
+    """
+    import project
+    import import_meals
+    from recipes import parse_meal_details
+
+    rng = random.Random(seed)
+    app = project.configure_app({'DATABASE': database, 'TESTING': True})
+    results = {}
+
+    with app.app_context():
+        conn = project.get_db()
+        user_ids = [r[0] for r in conn.execute("SELECT user_id FROM user_progress")]
+        meal_ids = [r[0] for r in conn.execute("SELECT id FROM meals")]
+        meal_rows = [dict(r) for r in conn.execute(
+            "SELECT * FROM meals WHERE id IN (%s)" % ','.join('?' * min(len(meal_ids), 200)),
+            rng.sample(meal_ids, min(len(meal_ids), 200)))]
+        goals = list(CATEGORY_MAPPING)
+        new_user = conn.execute(
+            "INSERT INTO users (username, password) VALUES ('bench_planner', 'x')").lastrowid
+        restricted_user = conn.execute('''
+            INSERT INTO users (username, password, allergies, dietary_preferences)
+            VALUES ('bench_planner_allergies', 'x', 'almond, egg', 'vegetarian')
+        ''').lastrowid
+        conn.commit()
+
+        def pick_user():
+            return rng.choice(user_ids)
+
+        results['generate_meal_plan_30d'] = summarize(time_calls(
+            lambda: project.generate_meal_plan([rng.choice(goals)], 'All 3', 30, new_user), repeat))
+        results['generate_meal_plan_90d'] = summarize(time_calls(
+            lambda: project.generate_meal_plan([rng.choice(goals)], 'All 3', 90, new_user), repeat))
+        results['generate_meal_plan_30d_allergies'] = summarize(time_calls(
+            lambda: project.generate_meal_plan(goals, 'All 3', 30, restricted_user), repeat))
+        results['get_user_meal_plan'] = summarize(time_calls(
+            lambda: project.get_user_meal_plan(pick_user()), repeat))
+        results['get_earliest_incomplete_day_meals'] = summarize(time_calls(
+            lambda: project.get_earliest_incomplete_day_meals(pick_user()), repeat))
+        results['parse_meal_details'] = summarize(time_calls(
+            lambda: parse_meal_details(rng.choice(meal_rows)), repeat * 10))
+        results['get_meal_details_cached'] = summarize(time_calls(
+            lambda: project.get_meal_details(meal_rows[0]['id']), repeat * 10))
+        results['search_meals'] = summarize(time_calls(
+            lambda: search_meal_ids(conn, ' '.join(rng.sample(WORDS, 2))[:rng.randint(3, 12)]),
+            repeat * 5))
+
+    # Routes through the Flask test client, logged in as an existing user
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = user_ids[0]
+        flask_session['username'] = 'bench_user_0'
+    routes = {
+        'route_dashboard': lambda: client.get('/dashboard'),
+        'route_review_meal_plan': lambda: client.get('/review_meal_plan'),
+        'route_meal_details': lambda: client.get(f'/meal_details/{rng.choice(meal_ids)}'),
+        'route_favorites': lambda: client.get('/favorites'),
+        'route_change_meal_pick': lambda: client.post(
+            '/change_meal/1/Lunch', data={'step': 'pick_category', 'chosen_category': rng.choice(goals)}),
+    }
+    for name, call in routes.items():
+        results[name] = summarize(time_calls(call, repeat))
+
+    # Importer: a fresh import, then a re-import where every row is unchanged
+    if import_rows:
+        workdir = workdir or tempfile.mkdtemp(prefix='fitmate_bench_')
+        workbook_path = os.path.join(workdir, 'bench_meals.xlsx')
+        import_db = os.path.join(workdir, 'bench_import.db')
+        write_synthetic_workbook(workbook_path, import_rows, seed=seed)
+        project.app.config['DATABASE'] = import_db
+        project.create_tables()
+        project.close_thread_connections()
+        import_meals.DATABASE = import_db
+        first = import_meals.import_meals_from_excel(workbook_path)
+        second = import_meals.import_meals_from_excel(workbook_path)
+        results['import_meals_fresh'] = summarize([first['seconds']])
+        results['import_meals_unchanged'] = summarize([second['seconds']])
+        project.app.config['DATABASE'] = database
+    return results
+
+# =============================================================================
+# BASELINES
+# =============================================================================
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    Compares current results with a baseline by median time.
+    Returns a list of (name, baseline_ms, current_ms, ratio) for every
+    benchmark that got slower by more than the threshold (and by at least min_delta_ms).
+    """
+    regressions = []
+    for name, stats in current.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['median_ms']
+        after = stats['median_ms']
+        if before > 0 and after > before * (1 + threshold) and after - before >= min_delta_ms:
+            regressions.append((name, before, after, after / before))
+    return regressions
+
+def print_results(results, baseline=None):
+    """Prints one line per benchmark, with the change against the baseline if given."""
+    for name, stats in sorted(results.items()):
+        line = f"{name:36s} median {stats['median_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms"
+        if baseline and name in baseline and baseline[name]['median_ms'] > 0:
+            change = stats['median_ms'] / baseline[name]['median_ms'] - 1
+            line += f"   ({change:+.0%} vs baseline)"
+        print(line)
+
+def main(argv=None):
+    """
+    Command-line entry point. Returns 1 if --compare found regressions, else 0.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark FitMate on synthetic data.")
+    parser.add_argument('--meals', type=int, default=2000, help="synthetic catalog size")
+    parser.add_argument('--users', type=int, default=1000, help="synthetic users with active plans")
+    parser.add_argument('--plan-days', type=int, default=30, help="plan length of each synthetic user")
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per benchmark")
+    parser.add_argument('--import-rows', type=int, default=2000, help="rows in the importer workbook (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help="reuse/create the synthetic database at this path")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="compare against a baseline JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown before flagging a regression (0.2 = 20%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='fitmate_bench_')
+    database = args.db or os.path.join(workdir, 'bench.db')
+    if not os.path.exists(database):
+        started = time.perf_counter()
+        counts = generate_synthetic_data(database, meals=args.meals, users=args.users,
+                                         plan_days=args.plan_days, seed=args.seed)
+        print(f"Generated {counts} in {time.perf_counter() - started:.1f}s")
+
+    results = run_benchmarks(database, repeat=args.repeat, import_rows=args.import_rows,
+                             seed=args.seed, workdir=workdir)
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'meals': args.meals,
+            'users': args.users,
+            'plan_days': args.plan_days,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved results to {args.save}")
+
+    if baseline is not None:
+        regressions = compare_results(baseline, results, args.threshold, args.min_delta_ms)
+        for name, before, after, ratio in regressions:
+            print(f"REGRESSION {name}: {before:.3f} ms -> {after:.3f} ms ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,670 @@
+# catalog.py
+# In-process, read-mostly cache of the meals table. Each worker loads the catalog
+# once and keeps it until the 'catalog_version' counter (bumped by triggers on the
+# meals table) says the table has changed, e.g. after running import_meals.py.
+# Categories are also normalized into the 'meal_categories' join table, so
+# candidate selection can run as an indexed query instead of string matching.
+# Ingredient/allergen feature bitsets (see allergens.py) are held as one NumPy
+# matrix, so filtering the whole catalog for a user's exclusions is a single AND.
+# The compiled catalog is saved as a snapshot file next to the database, which
+# every worker memory-maps instead of building its own copy (see SNAPSHOTS).
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from collections.abc import Mapping, Sequence
+from contextlib import suppress
+
+import numpy as np
+
+from allergens import exclusion_bits
+from categories import category_keys, normalize_category
+from planner import CATEGORY_KEYS, PlanArrays
+
+# Columns kept in memory for each meal. The large text columns (instructions,
+# ingredients, equipment) are only needed on the details page and stay in the DB.
+CATALOG_COLUMNS = ('id', 'type', 'name', 'identifier', 'categories',
+                   'prep_time', 'overnight', 'image')
+
+# =============================================================================
+# VERSIONING
+# =============================================================================
+
+def create_catalog_version(cursor):
+    """
+    Creates the single-row 'catalog_version' table and the triggers that bump it
+    whenever a row of 'meals' is inserted, updated, or deleted.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS meals_{event.lower()}_bump_version
+            AFTER {event} ON meals
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+def get_catalog_version(conn):
+    """
+    Returns the current catalog version, or 0 if the table does not exist yet.
+    """
+    try:
+        row = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+# =============================================================================
+# CATEGORY JOIN TABLE
+# =============================================================================
+
+def create_meal_categories(cursor):
+    """
+    Creates the 'meal_categories' join table (one row per meal and category key).
+    The primary key serves category -> meal lookups; the second index serves
+    meal -> categories lookups. Both are covering for their queries.
+    Requires 'catalog_version' to exist (see create_catalog_version).
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_categories (
+            meal_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            PRIMARY KEY (category, meal_id),
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_meal_categories_meal
+        ON meal_categories (meal_id, category)
+    ''')
+    # Category changes also invalidate cached catalogs
+    for event in ('INSERT', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS meal_categories_{event.lower()}_bump_version
+            AFTER {event} ON meal_categories
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+
+def replace_meal_categories(cursor, meal_id, cat_str):
+    """
+    Rewrites the join-table rows of one meal from its ';'-separated categories string.
+    """
+    cursor.execute("DELETE FROM meal_categories WHERE meal_id = ?", (meal_id,))
+    cursor.executemany("INSERT INTO meal_categories (meal_id, category) VALUES (?, ?)",
+                       [(meal_id, key) for key in sorted(category_keys(cat_str))])
+
+def backfill_meal_categories(cursor):
+    """
+    Fills 'meal_categories' for every meal that has no rows there yet.
+    Safe to run repeatedly. Returns the number of meals backfilled.
+    """
+    cursor.execute('''
+        SELECT id, categories FROM meals
+        WHERE id NOT IN (SELECT meal_id FROM meal_categories)
+    ''')
+    rows = cursor.fetchall()
+    for meal_id, cat_str in rows:
+        replace_meal_categories(cursor, meal_id, cat_str)
+    return len(rows)
+
+def select_candidate_ids(conn, categories, meal_type=None):
+    """
+    Returns the sorted ids of meals in any of the given categories, optionally
+    restricted to one meal type, using a single indexed query.
+    """
+    keys = sorted({normalize_category(c) for c in categories if c})
+    if not keys:
+        return []
+    placeholders = ', '.join('?' for _ in keys)
+    if meal_type is None:
+        cursor = conn.execute(f'''
+            SELECT DISTINCT meal_id FROM meal_categories
+            WHERE category IN ({placeholders})
+            ORDER BY meal_id
+        ''', keys)
+    else:
+        cursor = conn.execute(f'''
+            SELECT DISTINCT mc.meal_id
+            FROM meal_categories mc
+            JOIN meals m ON m.id = mc.meal_id
+            WHERE mc.category IN ({placeholders}) AND lower(m.type) = ?
+            ORDER BY mc.meal_id
+        ''', keys + [meal_type.lower()])
+    return [row[0] for row in cursor.fetchall()]
+
+# =============================================================================
+# FEATURE BITSETS
+# =============================================================================
+
+def feature_matrix(ids, features):
+    """
+    Builds the (len(ids), words) uint64 matrix of feature bitsets, one row per
+    id, from {meal_id: bits blob}. Also returns a bool array telling which ids
+    have a bitset at all.
+    """
+    words = max((len(blob) // 8 for blob in features.values()), default=0)
+    matrix = np.zeros((len(ids), max(words, 1)), dtype=np.uint64)
+    known = np.zeros(len(ids), dtype=bool)
+    for row, meal_id in enumerate(ids):
+        blob = features.get(meal_id)
+        if blob is not None:
+            bits = np.frombuffer(blob, dtype='<u8')
+            matrix[row, :len(bits)] = bits
+            known[row] = True
+    return matrix, known
+
+def safe_flags(matrix, known, excluded_bits):
+    """
+    Returns a bool array, one entry per matrix row, that is True where the row
+    has none of the excluded bits. Rows without a bitset are never safe.
+    """
+    mask = np.zeros(matrix.shape[1], dtype=np.uint64)
+    for bit in excluded_bits:
+        if bit < matrix.shape[1] * 64:
+            mask[bit // 64] |= np.uint64(1 << (bit % 64))
+    return known & ~(matrix & mask).any(axis=1)
+
+
+# =============================================================================
+# CATALOG
+# =============================================================================
+# A catalog is a handful of flat arrays plus a small JSON header, so it can be
+# stored in a snapshot file and memory-mapped by every worker (see SNAPSHOTS).
+# Meals are JSON records in one byte array, decoded when accessed; the id
+# indexes are CSR-style: each key owns a slice of one array of sorted ids.
+
+def _find_row(ids, meal_id):
+    """Returns the row of meal_id in a sorted ids array, or None."""
+    try:
+        row = int(np.searchsorted(ids, meal_id))
+    except (TypeError, ValueError):
+        return None
+    if row < len(ids) and ids[row] == meal_id:
+        return row
+    return None
+
+def _pack_index(index):
+    """Packs {key: meal ids} into (sorted keys, offsets, ids) for _IdIndex."""
+    keys = sorted(index)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(index[key]) for key in keys], dtype=np.int64)
+    ids = np.array([meal_id for key in keys for meal_id in sorted(index[key])], dtype=np.int64)
+    return keys, offsets, ids
+
+def _pack_records(meals):
+    """Packs meal dicts into (offsets, bytes) of their JSON records for _MealRecords."""
+    encoded = []
+    for meal in meals:
+        record = {key: value for key, value in meal.items() if key != 'type_key'}
+        record['category_set'] = sorted(meal['category_set'])
+        encoded.append(json.dumps(record, separators=(',', ':')).encode())
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(record) for record in encoded], dtype=np.int64)
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+class _IdList(Sequence):
+    """A read-only view of sorted meal ids that hands out Python ints."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.array[index].tolist()
+        return int(self.array[index])
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __contains__(self, meal_id):
+        return _find_row(self.array, meal_id) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, (_IdList, list, tuple)):
+            return self.array.tolist() == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.array.tolist())
+
+
+class _IdIndex(Mapping):
+    """Maps index keys to the _IdList of their meals (see _pack_index)."""
+
+    def __init__(self, keys, offsets, ids):
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._offsets = offsets
+        self._ids = ids
+
+    def __getitem__(self, key):
+        row = self._rows[key]
+        return _IdList(self._ids[self._offsets[row]:self._offsets[row + 1]])
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class _MealRecords(Mapping):
+    """
+    Maps meal ids to meal dicts, decoded from their records on first access and
+    then kept, so a worker only holds objects for the meals it actually serves.
+    """
+
+    def __init__(self, ids, offsets, records):
+        self._ids = ids
+        self._offsets = offsets
+        self._records = memoryview(records)
+        self._decoded = {}
+
+    def _keep(self, meal_id, meal):
+        """Finishes a meal dict parsed from its record and memoizes it."""
+        meal['type_key'] = (meal.get('type') or '').strip().lower()
+        meal['category_set'] = frozenset(meal['category_set'])
+        meal['images'] = {fmt: [tuple(derivative) for derivative in derivatives]
+                          for fmt, derivatives in meal['images'].items()}
+        self._decoded[meal_id] = meal
+        return meal
+
+    def __getitem__(self, meal_id):
+        meal = self._decoded.get(meal_id)
+        if meal is not None:
+            return meal
+        row = _find_row(self._ids, meal_id)
+        if row is None:
+            raise KeyError(meal_id)
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        return self._keep(int(self._ids[row]), json.loads(bytes(self._records[start:end])))
+
+    def get(self, meal_id, default=None):
+        meal = self._decoded.get(meal_id)
+        if meal is not None:
+            return meal
+        try:
+            return self[meal_id]
+        except KeyError:
+            return default
+
+    def get_many(self, meal_ids):
+        """Returns the meal dicts of the given ids, in order, skipping unknown ids."""
+        meal_ids = list(meal_ids)
+        decoded = self._decoded
+        missing = [meal_id for meal_id in meal_ids if meal_id not in decoded]
+        if missing and len(self._ids):
+            # One vectorized lookup for every meal not decoded yet
+            wanted = np.asarray(missing, dtype=np.int64)
+            rows = np.minimum(np.searchsorted(self._ids, wanted), len(self._ids) - 1)
+            found = self._ids[rows] == wanted
+            rows = rows[found]
+            records = self._records
+            # Parsing all records as one JSON array costs far less than one loads() each
+            parsed = json.loads(b'[' + b','.join(
+                records[start:end] for start, end in zip(self._offsets[rows].tolist(),
+                                                         self._offsets[rows + 1].tolist())) + b']')
+            for meal_id, meal in zip(wanted[found].tolist(), parsed):
+                self._keep(meal_id, meal)
+        return [decoded[meal_id] for meal_id in meal_ids if meal_id in decoded]
+
+    def __iter__(self):
+        return iter(self._ids.tolist())
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class MealCatalog:
+    """
+    Parsed meals (meals: meal_id -> meal dict, ids: all meal ids) plus inverted indexes:
+      - by_category: category key -> meal ids
+      - by_type: meal type ('breakfast', 'lunch/dinner') -> meal ids
+      - by_category_type: (category key, meal type) -> meal ids
+    All id lists are sorted so lookups are deterministic. Feature bitsets
+    (vocabulary: term -> bit) are held in feature_bits, and the columns plan
+    scoring needs in plan_arrays; the rows of both follow 'ids'. All of it is
+    backed by 'header' and 'arrays', which is what a snapshot file stores.
+    """
+
+    def __init__(self, meals, version=0, database=None, features=None, vocabulary=None,
+                 updated_at=0):
+        records = {}
+        by_category = {}
+        by_type = {}
+        by_category_type = {}
+        for meal in meals:
+            meal = dict(meal)
+            meal['type_key'] = (meal.get('type') or '').strip().lower()
+            if 'category_set' not in meal:
+                meal['category_set'] = category_keys(meal.get('categories'))
+            meal['category_set'] = frozenset(meal['category_set'])
+            meal.setdefault('images', {})
+            records[meal['id']] = meal
+            by_type.setdefault(meal['type_key'], []).append(meal['id'])
+            for category in meal['category_set']:
+                by_category.setdefault(category, []).append(meal['id'])
+                by_category_type.setdefault((category, meal['type_key']), []).append(meal['id'])
+        ordered = [records[meal_id] for meal_id in sorted(records)]
+        plan_arrays = PlanArrays.from_meals(ordered)
+        feature_bits, has_features = feature_matrix(plan_arrays.ids.tolist(), features or {})
+        header = {'version': version, 'updated_at': updated_at,
+                  'meal_types': list(plan_arrays.meal_types),
+                  'plan_category_keys': list(CATEGORY_KEYS),
+                  'vocabulary': dict(vocabulary or {})}
+        arrays = {'ids': plan_arrays.ids, 'type_codes': plan_arrays.type_codes,
+                  'plan_categories': plan_arrays.categories, 'prep_time': plan_arrays.prep_time,
+                  'overnight': plan_arrays.overnight,
+                  'feature_bits': feature_bits, 'has_features': has_features}
+        arrays['record_offsets'], arrays['records'] = _pack_records(ordered)
+        for name, index in (('by_category', by_category), ('by_type', by_type),
+                            ('by_category_type', by_category_type)):
+            header[name], arrays[f'{name}_offsets'], arrays[f'{name}_ids'] = _pack_index(index)
+        self._attach(header, arrays, database)
+
+    def _attach(self, header, arrays, database, snapshot_path=None):
+        """Sets up the catalog's views over its header and arrays."""
+        self.header = header
+        self.arrays = arrays
+        self.version = header['version']
+        self.updated_at = header['updated_at']
+        self.database = database
+        self.snapshot_path = snapshot_path
+        self.ids = _IdList(arrays['ids'])
+        self.meals = _MealRecords(arrays['ids'], arrays['record_offsets'], arrays['records'])
+        self.by_category = _IdIndex(header['by_category'], arrays['by_category_offsets'],
+                                    arrays['by_category_ids'])
+        self.by_type = _IdIndex(header['by_type'], arrays['by_type_offsets'], arrays['by_type_ids'])
+        self.by_category_type = _IdIndex([tuple(key) for key in header['by_category_type']],
+                                         arrays['by_category_type_offsets'],
+                                         arrays['by_category_type_ids'])
+        self.vocabulary = header['vocabulary']
+        self.feature_bits = arrays['feature_bits']
+        self.has_features = arrays['has_features']
+        self.plan_arrays = PlanArrays(arrays['ids'], arrays['type_codes'], tuple(header['meal_types']),
+                                      arrays['plan_categories'], arrays['prep_time'],
+                                      arrays['overnight'])
+        self._safe = {}
+
+    @classmethod
+    def from_arrays(cls, header, arrays, database=None, snapshot_path=None):
+        """Builds a catalog over already packed header and arrays (e.g. a mapped snapshot)."""
+        catalog = cls.__new__(cls)
+        catalog._attach(header, arrays, database, snapshot_path)
+        return catalog
+
+    @classmethod
+    def load(cls, conn, database=None):
+        """
+        Builds a catalog from the 'meals', 'meal_categories', 'meal_images' and
+        'meal_features' tables of the given connection. Each meal's 'images' maps
+        an image format to its (width, path) derivatives.
+        """
+        version, updated_at = get_catalog_stamp(conn)
+        cursor = conn.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM meals")
+        meals = {row[0]: dict(zip(CATALOG_COLUMNS, row), category_set=set(), images={})
+                 for row in cursor.fetchall()}
+        for meal_id, category in conn.execute("SELECT meal_id, category FROM meal_categories"):
+            if meal_id in meals:
+                meals[meal_id]['category_set'].add(category)
+        try:
+            image_rows = conn.execute(
+                "SELECT meal_id, format, width, path FROM meal_images ORDER BY meal_id, format, width"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            image_rows = []  # schema older than the meal_images table
+        for meal_id, fmt, width, path in image_rows:
+            if meal_id in meals:
+                meals[meal_id]['images'].setdefault(fmt, []).append((width, path))
+        try:
+            features = dict(conn.execute("SELECT meal_id, bits FROM meal_features").fetchall())
+            vocabulary = {term: bit for bit, term in
+                          conn.execute("SELECT bit, term FROM ingredient_vocabulary")}
+        except sqlite3.OperationalError:
+            features, vocabulary = {}, {}  # schema older than the meal_features table
+        meals = list(meals.values())
+        return cls(meals, version=version, database=database,
+                   features=features, vocabulary=vocabulary, updated_at=updated_at)
+
+    @property
+    def stamp(self):
+        """(version, updated_at) of the catalog tables this catalog was built from."""
+        return (self.version, self.updated_at)
+
+    def __len__(self):
+        return len(self.meals)
+
+    def get(self, meal_id):
+        """Returns the meal dict for an id, or None."""
+        return self.meals.get(meal_id)
+
+    def get_many(self, meal_ids):
+        """Returns the meal dicts of the given ids, in order, skipping unknown ids."""
+        return self.meals.get_many(meal_ids)
+
+    def candidate_ids(self, categories, meal_type=None):
+        """
+        Returns the sorted ids of meals in any of the given categories,
+        optionally restricted to one meal type.
+        """
+        if meal_type is not None:
+            meal_type = meal_type.lower()
+        found = []
+        for category in categories:
+            if not category:
+                continue
+            category = normalize_category(category)
+            if meal_type is None:
+                ids = self.by_category.get(category)
+            else:
+                ids = self.by_category_type.get((category, meal_type))
+            if ids is not None:
+                found.append(ids.array)
+        if not found:
+            return []
+        return np.unique(np.concatenate(found)).tolist()
+
+    def candidates(self, categories, meal_type=None):
+        """Same as candidate_ids, but returns the meal dicts."""
+        return self.get_many(self.candidate_ids(categories, meal_type))
+
+    def exclusions(self, allergies, dietary_preferences=None):
+        """
+        Compiles a user's free-text allergies and dietary preferences to the
+        frozenset of feature bits their meals must not have.
+        """
+        return frozenset(exclusion_bits(self.vocabulary, allergies, dietary_preferences))
+
+    def safe_rows(self, excluded):
+        """
+        Returns a bool array (rows follow 'ids') of the meals that have none of
+        the excluded feature bits, or None if nothing is excluded.
+        """
+        if not excluded:
+            return None
+        flags = self._safe.get(excluded)
+        if flags is None:
+            flags = safe_flags(self.feature_bits, self.has_features, excluded)
+            if len(self._safe) >= 256:
+                self._safe.clear()
+            self._safe[excluded] = flags
+        return flags
+
+    def safe_ids(self, meal_ids, excluded):
+        """
+        Returns the given meal ids (in order) that have none of the excluded
+        feature bits. With no exclusions the ids are returned unchanged.
+        """
+        flags = self.safe_rows(excluded)
+        meal_ids = list(meal_ids)
+        if flags is None:
+            return meal_ids
+        ids = self.ids.array
+        if not meal_ids or not len(ids):
+            return []
+        wanted = np.asarray(meal_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        keep = (ids[rows] == wanted) & flags[rows]
+        return [meal_id for meal_id, kept in zip(meal_ids, keep.tolist()) if kept]
+
+# =============================================================================
+# SNAPSHOTS
+# =============================================================================
+# A snapshot file holds one compiled catalog: a magic string and the header
+# length, the header as JSON, then every array at a 64-byte aligned offset.
+# Workers map it read-only, so all processes on a host share one copy of its
+# pages instead of each parsing the tables into objects of their own. A new
+# snapshot is written to a temporary file and renamed over the old one, so
+# readers see either the old or the new file, never a partial one; mappings of
+# the old file stay valid until the catalog using them is dropped.
+
+SNAPSHOT_MAGIC = b'FMCATLG\x00'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_ALIGN = 64
+_SNAPSHOT_PREFIX = struct.Struct('<8sQ')   # magic, header length
+
+def _aligned(size):
+    return -(-size // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+
+def get_catalog_stamp(conn):
+    """
+    Returns the catalog's (version, updated_at). Unlike the version alone, this
+    also tells a recreated database apart from the one a snapshot was made of.
+    """
+    try:
+        row = conn.execute("SELECT version, updated_at FROM catalog_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return (get_catalog_version(conn), 0)  # schema older than the updated_at column
+    return tuple(row) if row else (0, 0)
+
+def snapshot_path(database):
+    """
+    Returns the snapshot file of a database file ('fitmate.db' -> 'fitmate.catalog'),
+    or None for in-memory and URI databases.
+    """
+    if not database or database == ':memory:' or database.startswith('file:'):
+        return None
+    return os.path.splitext(database)[0] + '.catalog'
+
+def write_snapshot(catalog, path):
+    """Writes a catalog to a snapshot file, atomically replacing the previous one."""
+    arrays = {name: np.ascontiguousarray(array) for name, array in catalog.arrays.items()}
+    layout = {}
+    size = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': size}
+        size = _aligned(size + array.nbytes)
+    header = json.dumps(dict(catalog.header, format=SNAPSHOT_FORMAT, arrays=layout),
+                        separators=(',', ':')).encode()
+    data_start = _aligned(_SNAPSHOT_PREFIX.size + len(header))
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(_SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+def open_snapshot(path, database=None):
+    """
+    Maps a snapshot file read-only and returns its MealCatalog, or None if the
+    file is missing or is not a snapshot this code can read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None  # missing or empty file
+    try:
+        magic, length = _SNAPSHOT_PREFIX.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC:
+            return None
+        header = json.loads(buffer[_SNAPSHOT_PREFIX.size:_SNAPSHOT_PREFIX.size + length])
+        if header.get('format') != SNAPSHOT_FORMAT or header.get('plan_category_keys') != list(CATEGORY_KEYS):
+            return None  # written by another version of this code
+        data_start = _aligned(_SNAPSHOT_PREFIX.size + length)
+        arrays = {}
+        for name, spec in header.pop('arrays').items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            count = int(np.prod(shape, dtype=np.int64))
+            array = np.frombuffer(buffer, dtype=dtype, count=count,
+                                  offset=data_start + spec['offset']) if count else np.empty(0, dtype)
+            arrays[name] = array.reshape(shape)
+    except (ValueError, KeyError, TypeError, struct.error):
+        return None
+    return MealCatalog.from_arrays(header, arrays, database, snapshot_path=path)
+
+def load_catalog(conn, database=None):
+    """
+    Returns the current catalog of a database: mapped from its snapshot file if
+    that matches the catalog tables, otherwise loaded from the tables and saved
+    as the new snapshot for other workers to map. In-memory databases (and
+    directories that cannot be written to) get a private in-process catalog.
+    """
+    path = snapshot_path(database)
+    if path is None:
+        return MealCatalog.load(conn, database=database)
+    stamp = get_catalog_stamp(conn)
+    mapped = open_snapshot(path, database)
+    if mapped is not None and mapped.stamp == stamp:
+        return mapped
+    catalog = MealCatalog.load(conn, database=database)
+    try:
+        write_snapshot(catalog, path)
+    except OSError:
+        return catalog
+    mapped = open_snapshot(path, database)
+    return mapped if mapped is not None and mapped.stamp == catalog.stamp else catalog
+
+# =============================================================================
+# PER-WORKER CACHE
+# =============================================================================
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog(conn, database=None):
+    """
+    Returns the worker's catalog, switching to the current snapshot first if the
+    DB version changed (or if a different database is being used).
+    """
+    global _catalog
+    version = get_catalog_version(conn)
+    current = _catalog
+    if current is not None and current.version == version and current.database == database:
+        return current
+    with _catalog_lock:
+        current = _catalog
+        if current is None or current.version != version or current.database != database:
+            current = load_catalog(conn, database)
+            _catalog = current
+    return current
+
+def invalidate_catalog():
+    """Drops the cached catalog so the next get_catalog() call reloads it."""
+    global _catalog
+    with _catalog_lock:
+        _catalog = None
@@ -14,4 +14,28 @@ CATEGORY_MAPPING = {
     'vegan': 'vegan',
     'keto': 'keto',
     'save_time': 'save_time'
-}
\ No newline at end of file
+}
+
+def normalize_category(name):
+    """
+    Turns a raw category label (e.g. ' Lose Weight') into its key form ('lose_weight').
+    """
+    return name.strip().lower().replace(' ', '_')
+
+
+def parse_categories(cat_str):
+    """
+    Splits a ';'-separated categories string into a set of normalized keys.
+    Returns an empty set for missing or blank values.
+    """
+    if not cat_str:
+        return set()
+    return {normalize_category(c) for c in cat_str.split(';') if c.strip()}
+
+
+def category_keys(cat_str):
+    """
+    Returns the CATEGORY_MAPPING keys for a ';'-separated categories string,
+    dropping any label that is not a known category.
+    """
+    return {CATEGORY_MAPPING[c] for c in parse_categories(cat_str) if c in CATEGORY_MAPPING}
@@ -0,0 +1,15 @@
+# gunicorn.conf.py
+# Pre-forking server settings. With preload_app the master process imports the
+# app and runs the warm-up once (migrations, catalog, templates); workers are
+# then forked from it and share those pages copy-on-write.
+import os
+
+bind = os.environ.get('FITMATE_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('FITMATE_WORKERS', '4'))
+threads = int(os.environ.get('FITMATE_THREADS', '2'))
+preload_app = True
+
+def post_fork(server, worker):
+    # Time-to-first-request is measured from when each worker starts
+    from project import mark_worker_started
+    mark_worker_started()
@@ -0,0 +1,215 @@
+# images.py
+# Resized, recompressed copies ("derivatives") of the images under static/.
+# Originals are 1500px meal photos and 500px icons, but pages show them at a
+# few hundred pixels at most, so each original gets a WebP copy and a JPEG/PNG
+# fallback per display width. Derivatives live under static/images/derived/ and
+# are only rewritten when missing or older than their original, so running the
+# pipeline again is cheap. Meal derivatives are recorded in 'meal_images'.
+#
+# Pillow is optional: without it nothing is generated and pages keep using the
+# originals. Run 'python images.py' to (re)generate everything.
+import os
+import sqlite3
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+DATABASE = 'database/fitmate.db'
+STATIC_FOLDER = 'static'
+DERIVED_DIR = 'images/derived'
+MEAL_IMAGE_DIR = 'images/meals'
+
+# Display widths (in px) generated for meal photos: review table thumbnails,
+# meal cards, and the details page / high-density screens
+MEAL_IMAGE_WIDTHS = (160, 320, 640)
+# UI images under static/ and the widths they are generated at
+ASSET_IMAGE_WIDTHS = {
+    'images/logo.png': (140, 300, 600),
+    'icons/account.png': (96,),
+    'icons/dashboard.png': (96,),
+    'icons/favorites.png': (96,),
+    'icons/log_out.png': (96,),
+}
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+FORMAT_EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg', 'png': 'png'}
+
+def pillow_available():
+    """Returns True if Pillow is installed, i.e. derivatives can be generated."""
+    return Image is not None
+
+def meal_image_source(identifier):
+    """Returns the static/-relative path of a meal's original photo."""
+    return f"{MEAL_IMAGE_DIR}/{identifier}.png"
+
+def derivative_path(source, width, fmt):
+    """
+    Returns the static/-relative path of one derivative, e.g.
+    'images/meals/aeb.png' at 320px as WebP -> 'images/derived/images/meals/aeb-320.webp'.
+    """
+    stem = os.path.splitext(source)[0]
+    return f"{DERIVED_DIR}/{stem}-{width}.{FORMAT_EXTENSIONS[fmt]}"
+
+def fallback_format(source_path):
+    """
+    Returns the non-WebP format for an original: PNG if it has an alpha channel
+    or a palette (read from the PNG header), otherwise JPEG.
+    """
+    with open(source_path, 'rb') as f:
+        header = f.read(26)
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) == 26:
+        return 'jpeg' if header[25] in (0, 2) else 'png'
+    return 'jpeg'
+
+def existing_derivatives(static_folder, source, widths):
+    """
+    Returns the derivatives of static/<source> that exist on disk and are not
+    older than the original, as (width, format, path) tuples.
+    """
+    source_path = os.path.join(static_folder, source)
+    try:
+        source_mtime = os.path.getmtime(source_path)
+        formats = ('webp', fallback_format(source_path))
+    except OSError:
+        return []
+    found = []
+    for width in widths:
+        for fmt in formats:
+            path = derivative_path(source, width, fmt)
+            try:
+                if os.path.getmtime(os.path.join(static_folder, path)) >= source_mtime:
+                    found.append((width, fmt, path))
+            except OSError:
+                pass
+    return found
+
+def _save(image, target_path, fmt):
+    """Writes one derivative next to its final path and moves it into place."""
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temp_path = f"{target_path}.tmp"
+    if fmt == 'webp':
+        image.save(temp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+    elif fmt == 'jpeg':
+        image.convert('RGB').save(temp_path, 'JPEG', quality=JPEG_QUALITY,
+                                  optimize=True, progressive=True)
+    else:
+        image.save(temp_path, 'PNG', optimize=True)
+    os.replace(temp_path, target_path)
+
+def make_derivatives(static_folder, source, widths):
+    """
+    Generates the derivatives of static/<source> that are missing or stale.
+    Widths larger than the original are skipped (images are never upscaled).
+    Returns (derivatives, written): all current (width, format, path) tuples,
+    and how many files were written. Requires Pillow.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to generate image derivatives")
+    source_path = os.path.join(static_folder, source)
+    if not os.path.exists(source_path):
+        return [], 0
+    current = {(w, fmt): path for w, fmt, path in existing_derivatives(static_folder, source, widths)}
+    formats = ('webp', fallback_format(source_path))
+    derivatives = []
+    written = 0
+    # Image.open only reads the header; pixels are decoded on the first resize
+    with Image.open(source_path) as original:
+        for width in sorted(widths):
+            if width > original.width:
+                continue
+            resized = None
+            for fmt in formats:
+                path = derivative_path(source, width, fmt)
+                if (width, fmt) not in current:
+                    if resized is None:
+                        height = max(1, round(original.height * width / original.width))
+                        resized = original.resize((width, height), Image.Resampling.LANCZOS,
+                                                  reducing_gap=3.0)
+                    _save(resized, os.path.join(static_folder, path), fmt)
+                    written += 1
+                derivatives.append((width, fmt, path))
+    return derivatives, written
+
+# =============================================================================
+# MEAL IMAGES
+# =============================================================================
+
+def create_meal_images(cursor):
+    """
+    Creates the 'meal_images' table: one row per meal derivative, so pages can
+    build srcset attributes without touching the filesystem.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_images (
+            meal_id INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (meal_id, format, width),
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        ) WITHOUT ROWID
+    ''')
+
+def generate_meal_images(conn, static_folder=STATIC_FOLDER, widths=MEAL_IMAGE_WIDTHS):
+    """
+    Brings every meal's derivatives and 'meal_images' rows up to date, and
+    points meals.image at the original photo (NULL if there is none).
+    Only rows that actually change are written. Requires Pillow.
+    Returns a dict of counts.
+    """
+    stats = {'meals': 0, 'missing': 0, 'files_written': 0, 'meals_updated': 0}
+    meals = conn.execute("SELECT id, identifier, image FROM meals").fetchall()
+    recorded = {}
+    for meal_id, width, fmt, path in conn.execute(
+            "SELECT meal_id, width, format, path FROM meal_images"):
+        recorded.setdefault(meal_id, set()).add((width, fmt, path))
+
+    # Files first, so the write transaction below stays short
+    changes = []
+    for meal_id, identifier, image in meals:
+        stats['meals'] += 1
+        source = meal_image_source(identifier)
+        if os.path.exists(os.path.join(static_folder, source)):
+            derivatives, written = make_derivatives(static_folder, source, widths)
+            stats['files_written'] += written
+        else:
+            source, derivatives = None, []
+            stats['missing'] += 1
+        if image != source or set(derivatives) != recorded.get(meal_id, set()):
+            changes.append((meal_id, image, source, derivatives))
+
+    with conn:
+        for meal_id, image, source, derivatives in changes:
+            if image != source:
+                conn.execute("UPDATE meals SET image = ? WHERE id = ?", (source, meal_id))
+            if set(derivatives) != recorded.get(meal_id, set()):
+                conn.execute("DELETE FROM meal_images WHERE meal_id = ?", (meal_id,))
+                conn.executemany(
+                    "INSERT INTO meal_images (meal_id, width, format, path) VALUES (?, ?, ?, ?)",
+                    [(meal_id, w, fmt, path) for w, fmt, path in derivatives])
+            stats['meals_updated'] += 1
+    return stats
+
+def generate_asset_images(static_folder=STATIC_FOLDER, assets=ASSET_IMAGE_WIDTHS):
+    """
+    Generates the derivatives of the UI images (logo, nav icons). Requires Pillow.
+    Returns the number of files written.
+    """
+    return sum(make_derivatives(static_folder, source, widths)[1]
+               for source, widths in assets.items())
+
+if __name__ == "__main__":
+    if not pillow_available():
+        raise SystemExit("Pillow is not installed (pip install Pillow); pages will keep using the originals.")
+    conn = sqlite3.connect(DATABASE, timeout=5)
+    try:
+        stats = generate_meal_images(conn)
+    finally:
+        conn.close()
+    assets_written = generate_asset_images()
+    print(f"Meal images: {stats['meals']} meals, {stats['missing']} without a photo, "
+          f"{stats['files_written']} files written, {stats['meals_updated']} meals updated. "
+          f"UI images: {assets_written} files written.")
@@ -1,48 +1,194 @@
-import pandas as pd
+import hashlib
+import json
 import sqlite3
-import os
+import time
+from openpyxl import load_workbook
+from allergens import refresh_meal_features
+from catalog import load_catalog
+from categories import category_keys
+from images import generate_asset_images, generate_meal_images, pillow_available
+from recipes import refresh_meal_ingredients
+from search import optimize_meal_search
+from similarity import refresh_meal_neighbors
 
 DATABASE = 'database/fitmate.db'
 
-def import_meals_from_excel(file_path):
-    # Read the Excel file into a DataFrame
-    df = pd.read_excel(file_path)
-    
-    # Normalize column names: strip whitespace and convert to lowercase
-    df.columns = df.columns.str.strip().str.lower()
-    
-    # Debug: print the column names so you can verify they match expected names
-    print("Excel columns:", df.columns.tolist())
-    
-    conn = sqlite3.connect(DATABASE)
+# Excel column (lowercased, stripped) -> meals column
+COLUMN_MAP = {
+    'type': 'type',
+    'meal name': 'name',
+    'identifier': 'identifier',
+    'categories': 'categories',
+    'preptime': 'prep_time',
+    'overnight': 'overnight',
+    'equipment': 'equipment',
+    'ingredients': 'ingredients',
+    'instructions': 'instructions',
+}
+MEAL_FIELDS = ['type', 'name', 'identifier', 'categories', 'prep_time',
+               'overnight', 'equipment', 'ingredients', 'instructions']
+
+# Number of rows written per executemany call
+BATCH_SIZE = 500
+
+def read_meal_rows(file_path):
+    """
+    Streams the workbook's first sheet in read-only mode and yields one dict
+    per meal row, keyed by the meals column names.
+    Raises KeyError if an expected column is missing.
+    """
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        # Normalize column names: strip whitespace and convert to lowercase
+        columns = [str(c).strip().lower() if c is not None else '' for c in header]
+        missing = [c for c in COLUMN_MAP if c not in columns]
+        if missing:
+            raise KeyError(', '.join(missing))
+        positions = {COLUMN_MAP[c]: columns.index(c) for c in COLUMN_MAP}
+        for values in rows:
+            meal = {field: values[pos] if pos < len(values) else None
+                    for field, pos in positions.items()}
+            if meal['identifier'] is None:
+                continue  # blank or trailing row
+            yield meal
+    finally:
+        workbook.close()
+
+def clean_meal(meal):
+    """
+    Converts the raw cell values of a row into the values stored in 'meals'.
+    Raises ValueError if prep time is not a number.
+    """
+    meal = dict(meal)
+    meal['identifier'] = str(meal['identifier']).strip()
+    meal['prep_time'] = int(meal['prep_time'])
+    # Accept various forms for overnight (boolean)
+    meal['overnight'] = 1 if meal['overnight'] in [True, 1, 'true', 'TRUE'] else 0
+    return meal
+
+def meal_content_hash(meal):
+    """Returns a stable hash of a meal's imported fields, used to skip unchanged rows."""
+    payload = json.dumps([meal[f] for f in MEAL_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _write_batch(cursor, batch):
+    """
+    Upserts one batch of meals on 'identifier' and rewrites their meal_categories
+    rows, ingredient feature bitsets and parsed ingredient entries.
+    Returns the ids of the meals written.
+    """
+    cursor.executemany(f'''
+        INSERT INTO meals ({', '.join(MEAL_FIELDS)}, content_hash)
+        VALUES ({', '.join('?' for _ in MEAL_FIELDS)}, ?)
+        ON CONFLICT(identifier) DO UPDATE SET
+            {', '.join(f'{f} = excluded.{f}' for f in MEAL_FIELDS if f != 'identifier')},
+            content_hash = excluded.content_hash
+    ''', [[meal[f] for f in MEAL_FIELDS] + [meal['content_hash']] for meal in batch])
+
+    identifiers = [meal['identifier'] for meal in batch]
+    cursor.execute(f'''
+        SELECT identifier, id FROM meals
+        WHERE identifier IN ({', '.join('?' for _ in identifiers)})
+    ''', identifiers)
+    ids = dict(cursor.fetchall())
+    cursor.executemany("DELETE FROM meal_categories WHERE meal_id = ?",
+                       [(ids[meal['identifier']],) for meal in batch])
+    cursor.executemany("INSERT INTO meal_categories (meal_id, category) VALUES (?, ?)",
+                       [(ids[meal['identifier']], key)
+                        for meal in batch for key in sorted(category_keys(meal['categories']))])
+    refresh_meal_features(cursor, ids.values())
+    refresh_meal_ingredients(cursor, ids.values())
+    return list(ids.values())
+
+def import_meals_from_excel(file_path, batch_size=BATCH_SIZE):
+    """
+    Imports (or re-syncs) meals from the Excel file in a single transaction.
+    New meals are inserted and edited meals updated, matched on 'identifier';
+    rows whose content hash is unchanged are not written at all.
+    Resized meal and UI images are then generated if Pillow is installed (see images.py),
+    and the catalog snapshot the app's workers share is rewritten (see catalog.py).
+    Returns a dict of counts and throughput.
+    """
+    started = time.perf_counter()
+    stats = {'read': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'invalid': 0}
+
+    conn = sqlite3.connect(DATABASE, timeout=5)
     cursor = conn.cursor()
-    
-    # Loop through each row and insert data into the meals table
-    for index, row in df.iterrows():
-        try:
-            meal_type = row['type'] 
-            name = row['meal name']  
-            identifier = row['identifier']
-            categories = row['categories']
-            prep_time = int(row['preptime'])
-            # Accept various forms for overnight (boolean)
-            overnight = 1 if row['overnight'] in [True, 1, 'true', 'TRUE'] else 0
-            equipment = row['equipment']
-            ingredients = row['ingredients']
-            instructions = row['instructions']
-        except KeyError as e:
-            print(f"Column not found: {e}")
-            continue
-
-        cursor.execute('''
-            INSERT OR IGNORE INTO meals 
-            (type, name, identifier, categories, prep_time, overnight, equipment, ingredients, instructions)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (meal_type, name, identifier, categories, prep_time, overnight, equipment, ingredients, instructions))
-    
-    conn.commit()
-    conn.close()
-    print("Meals imported successfully.")
+    cursor.execute("SELECT identifier, content_hash FROM meals")
+    existing = dict(cursor.fetchall())
+    seen = set()
+
+    try:
+        cursor.execute("BEGIN")
+        batch = []
+        written = []
+        for raw_meal in read_meal_rows(file_path):
+            stats['read'] += 1
+            try:
+                meal = clean_meal(raw_meal)
+            except (TypeError, ValueError) as e:
+                print(f"Skipping row {raw_meal.get('identifier')!r}: {e}")
+                stats['invalid'] += 1
+                continue
+            if meal['identifier'] in seen:
+                continue  # first occurrence of an identifier wins
+            seen.add(meal['identifier'])
+
+            meal['content_hash'] = meal_content_hash(meal)
+            if meal['identifier'] not in existing:
+                stats['inserted'] += 1
+            elif existing[meal['identifier']] != meal['content_hash']:
+                stats['updated'] += 1
+            else:
+                stats['unchanged'] += 1
+                continue
+            batch.append(meal)
+            if len(batch) >= batch_size:
+                written += _write_batch(cursor, batch)
+                batch = []
+        if batch:
+            written += _write_batch(cursor, batch)
+        # Similar-meal lists of the written meals and of the meals they affect
+        refresh_meal_neighbors(cursor, written)
+        conn.commit()
+        # The search index is updated by triggers; merge its segments after bulk changes
+        if stats['inserted'] or stats['updated']:
+            optimize_meal_search(conn)
+        # Resized photos for new meals and the UI images (existing derivatives are kept if up to date)
+        stats['images'] = None
+        if pillow_available():
+            stats['images'] = generate_meal_images(conn)
+            stats['images']['asset_files_written'] = generate_asset_images()
+        # Compile the new catalog snapshot; running workers map it on their next request
+        load_catalog(conn, DATABASE)
+    except KeyError as e:
+        conn.rollback()
+        print(f"Column not found: {e}")
+        raise
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    stats['not_in_file'] = len({i for i in existing if i is not None} - seen)
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_second'] = stats['read'] / stats['seconds'] if stats['seconds'] else 0.0
+    print("Meals imported successfully: "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, "
+          f"{stats['unchanged']} unchanged, {stats['invalid']} invalid "
+          f"({stats['read']} rows in {stats['seconds']:.2f}s, {stats['rows_per_second']:.0f} rows/s).")
+    if stats['not_in_file']:
+        print(f"{stats['not_in_file']} meals in the database are not in the file (left as they are).")
+    if stats['images'] is None:
+        print("Pillow is not installed: no resized meal images were generated.")
+    else:
+        print(f"Meal images: {stats['images']['files_written']} files written, "
+              f"{stats['images']['missing']} meals without a photo; "
+              f"UI images: {stats['images']['asset_files_written']} files written.")
+    return stats
 
 if __name__ == "__main__":
-    import_meals_from_excel("data/meals.xlsx")
\ No newline at end of file
+    import_meals_from_excel("data/meals.xlsx")
@@ -0,0 +1,159 @@
+# jobs.py
+# Background jobs kept in the 'jobs' table, so a request can hand slow work
+# (e.g. generating a long meal plan) to a worker thread and return at once; the
+# page then polls the job's state and progress. Every process runs at most a
+# few worker threads, started when a job is submitted and stopped once the
+# queue is empty. Claiming a job is a single UPDATE, so several processes
+# sharing one database never run the same job twice. A running job records a
+# heartbeat with each progress update; only a job whose heartbeat stopped (its
+# process died) is handed to another worker.
+import json
+import threading
+import time
+
+JOB_STATES = ('queued', 'running', 'done', 'failed')
+# A 'running' job without a heartbeat for this long (its process died) is queued again
+JOB_STALE_SECONDS = 300
+
+def create_jobs(cursor):
+    """Creates the 'jobs' table and its indexes."""
+    cursor.execute('''
+        CREATE TABLE jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            params TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    # At most one queued job per user and kind: a repeated submission replaces it
+    cursor.execute('''
+        CREATE UNIQUE INDEX idx_jobs_queued_user ON jobs (kind, user_id)
+        WHERE state = 'queued'
+    ''')
+    cursor.execute("CREATE INDEX idx_jobs_state ON jobs (state, id)")
+
+def _job_dict(row):
+    """Turns a jobs row into a dict with params and result decoded."""
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return job
+
+def submit_job(conn, kind, user_id, params):
+    """
+    Queues a job and returns its id. Submissions are deduplicated per user and
+    kind: the same params as a queued or running job return that job, and new
+    params replace those of a job that is still queued.
+    """
+    encoded = json.dumps(params, sort_keys=True)
+    with conn:
+        active = conn.execute('''
+            SELECT id, state, params FROM jobs
+            WHERE kind = ? AND user_id = ? AND state IN ('queued', 'running')
+            ORDER BY id DESC
+        ''', (kind, user_id)).fetchall()
+        for row in active:
+            if row['params'] == encoded:
+                return row['id']
+        for row in active:
+            if row['state'] == 'queued':
+                conn.execute("UPDATE jobs SET params = ?, created_at = ? WHERE id = ?",
+                             (encoded, time.time(), row['id']))
+                return row['id']
+        return conn.execute('''
+            INSERT INTO jobs (kind, user_id, params, created_at) VALUES (?, ?, ?, ?)
+        ''', (kind, user_id, encoded, time.time())).lastrowid
+
+def claim_job(conn, kind):
+    """
+    Marks the oldest queued job of a kind as running and returns it as a dict,
+    or None if there is none. Jobs left running by a dead process (no heartbeat
+    for JOB_STALE_SECONDS) are requeued first.
+    """
+    now = time.time()
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET state = 'queued', progress = 0
+            WHERE kind = ? AND state = 'running' AND COALESCE(heartbeat_at, started_at) < ?
+              AND NOT EXISTS (SELECT 1 FROM jobs q WHERE q.kind = jobs.kind
+                              AND q.user_id = jobs.user_id AND q.state = 'queued')
+        ''', (kind, now - JOB_STALE_SECONDS))
+        row = conn.execute('''
+            UPDATE jobs SET state = 'running', started_at = ?, heartbeat_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE state = 'queued' AND kind = ? ORDER BY id LIMIT 1)
+            RETURNING *
+        ''', (now, now, kind)).fetchone()
+    return _job_dict(row)
+
+def set_job_progress(conn, job_id, progress):
+    """Records how far a running job got (0.0 to 1.0); this is also its heartbeat."""
+    with conn:
+        conn.execute("UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ? AND state = 'running'",
+                     (progress, time.time(), job_id))
+
+def finish_job(conn, job_id, result=None, error=None):
+    """Marks a job 'done' with its result, or 'failed' with an error message."""
+    with conn:
+        conn.execute('''
+            UPDATE jobs SET state = ?, progress = 1, result = ?, error = ?, finished_at = ?
+            WHERE id = ?
+        ''', ('failed' if error is not None else 'done',
+              json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+def add_job_heartbeat(cursor):
+    """Adds the 'heartbeat_at' column (last sign of life of a running job) to 'jobs'."""
+    cursor.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+def get_job(conn, job_id, user_id=None):
+    """Returns a job as a dict (None if missing or, with user_id, someone else's)."""
+    row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None or (user_id is not None and row['user_id'] != user_id):
+        return None
+    return _job_dict(row)
+
+
+class JobWorkers:
+    """
+    A bounded pool of worker threads for this process. Each thread calls
+    run_next() (which claims and runs one job, returning False when none was
+    queued) until the queue is empty, then exits; wake() starts threads again.
+    """
+
+    def __init__(self, run_next):
+        self.run_next = run_next
+        self.lock = threading.Lock()
+        self.active = 0
+        self.wakeups = 0
+
+    def wake(self, max_workers):
+        """Makes sure queued jobs get picked up, starting a thread if below max_workers."""
+        with self.lock:
+            self.wakeups += 1
+            if self.active >= max(max_workers, 1):
+                return
+            self.active += 1
+        threading.Thread(target=self._work, name='fitmate-job-worker', daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                seen = self.wakeups
+            try:
+                ran = self.run_next()
+            except Exception:
+                ran = False
+            if not ran:
+                with self.lock:
+                    # Exit only if nothing was submitted while we looked
+                    if self.wakeups == seen:
+                        self.active -= 1
+                        return
@@ -0,0 +1,272 @@
+# metrics.py
+# Request and SQL instrumentation. Every request records its latency per route,
+# and every statement run through an InstrumentedConnection is counted and timed
+# (per request and in aggregate). Metrics are kept in memory per worker process
+# and rendered in the Prometheus text format by render_prometheus().
+import cProfile
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Latency buckets in seconds (upper bounds), shared by all histograms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Buckets for the number of SQL statements run by one request
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+# =============================================================================
+# METRIC TYPES
+# =============================================================================
+
+class Histogram:
+    """
+    A Prometheus-style histogram with a fixed set of buckets and one series
+    per tuple of label values.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            counts = self.series.get(label_values)
+            if counts is None:
+                counts = self.series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, (bucket_counts, count, total) in sorted(self.series.items()):
+                labels = _format_labels(self.label_names, label_values)
+                le_names = self.label_names + ('le',)
+                bounds = [_format_number(b) for b in self.buckets] + ['+Inf']
+                for bound, bucket_count in zip(bounds, bucket_counts + [count]):
+                    le_labels = _format_labels(le_names, label_values + (bound,))
+                    lines.append(f"{self.name}_bucket{le_labels} {bucket_count}")
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter with one series per tuple of label values."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+
+def _format_number(value):
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+def render_gauges(name, help_text, values):
+    """
+    Renders a gauge family. values maps a tuple of (label name, label value)
+    pairs to a number; None values are skipped.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in values.items():
+        if value is None:
+            continue
+        label_names = tuple(n for n, _ in labels)
+        label_values = tuple(v for _, v in labels)
+        lines.append(f"{name}{_format_labels(label_names, label_values)} {value}")
+    return lines
+
+# =============================================================================
+# REGISTRY
+# =============================================================================
+
+REQUEST_LATENCY = Histogram(
+    'fitmate_request_duration_seconds', 'Request latency by route.',
+    ('endpoint', 'method', 'status'))
+REQUEST_SQL_STATEMENTS = Histogram(
+    'fitmate_request_sql_statements', 'SQL statements run per request.',
+    ('endpoint',), buckets=COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram(
+    'fitmate_request_sql_duration_seconds', 'Total SQL time per request.', ('endpoint',))
+SQL_STATEMENTS = Counter(
+    'fitmate_sql_statements_total', 'SQL statements executed, by operation.', ('operation',))
+SQL_SECONDS = Counter(
+    'fitmate_sql_duration_seconds_total', 'Time spent executing SQL, by operation.', ('operation',))
+SLOW_QUERIES = Counter(
+    'fitmate_sql_slow_queries_total', 'Statements slower than the slow-query threshold.', ())
+
+REGISTRY = [REQUEST_LATENCY, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS,
+            SQL_STATEMENTS, SQL_SECONDS, SLOW_QUERIES]
+
+# Settings, filled in by init_app() from the app config
+settings = {
+    'slow_query_seconds': None,
+    'profile_routes': set(),
+    'profile_sample_rate': 0.0,
+    'profile_dir': None,
+    'logger': None,
+}
+
+# =============================================================================
+# SQL INSTRUMENTATION
+# =============================================================================
+
+def record_sql(sql, seconds):
+    """
+    Records one executed statement: aggregate counters, the current request's
+    totals, and a slow-query log line if it is over the threshold.
+    """
+    operation = (sql.lstrip().split(None, 1) or ['?'])[0].upper()
+    SQL_STATEMENTS.inc(operation)
+    SQL_SECONDS.inc(operation, amount=seconds)
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+    threshold = settings['slow_query_seconds']
+    if threshold is not None and seconds >= threshold:
+        SLOW_QUERIES.inc()
+        if settings['logger'] is not None:
+            endpoint = request.endpoint if has_request_context() else None
+            settings['logger'].warning("Slow query (%.1f ms, endpoint=%s): %s",
+                                       seconds * 1000, endpoint, ' '.join(sql.split()))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """A cursor whose execute/executemany calls are counted and timed."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_sql(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_sql(sql, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection class for sqlite3.connect(factory=...) that hands out
+    InstrumentedCursors, including for the execute() shortcuts.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# =============================================================================
+# REQUEST INSTRUMENTATION
+# =============================================================================
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+    if (request.endpoint in settings['profile_routes']
+            and random.random() < settings['profile_sample_rate']):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def _note_response(response):
+    g.response_status = response.status_code
+    return response
+
+def _finish_request(exc):
+    """
+    Teardown hook: runs even when a view raised, so failed requests are
+    recorded (as 500s) and a sampled profiler is always switched off.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    endpoint = request.endpoint or 'unknown'
+    status = 500 if exc is not None else g.pop('response_status', 500)
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint, request.method, str(status))
+    REQUEST_SQL_STATEMENTS.observe(g.get('sql_statements', 0), endpoint)
+    REQUEST_SQL_SECONDS.observe(g.get('sql_seconds', 0.0), endpoint)
+    if profiler is not None:
+        _save_profile(profiler, endpoint)
+
+def _save_profile(profiler, endpoint):
+    """Writes a sampled request's profile as a .prof file (readable with pstats/snakeviz)."""
+    profile_dir = settings['profile_dir']
+    os.makedirs(profile_dir, exist_ok=True)
+    filename = f"{endpoint}-{int(time.time() * 1000)}-{os.getpid()}.prof"
+    profiler.dump_stats(os.path.join(profile_dir, filename))
+
+def init_app(app):
+    """
+    Registers the request hooks on the app and reads these settings from its config:
+      SLOW_QUERY_MS        log statements slower than this (None disables the log)
+      PROFILE_ROUTES       endpoint names to profile, as a list or comma-separated string
+      PROFILE_SAMPLE_RATE  fraction of requests to those routes that are profiled
+      PROFILE_DIR          where .prof files are written
+    Safe to call again after the config changes.
+    """
+    slow_query_ms = app.config.get('SLOW_QUERY_MS')
+    settings['slow_query_seconds'] = slow_query_ms / 1000 if slow_query_ms is not None else None
+    routes = app.config.get('PROFILE_ROUTES') or ()
+    if isinstance(routes, str):
+        routes = [r.strip() for r in routes.split(',') if r.strip()]
+    settings['profile_routes'] = set(routes)
+    settings['profile_sample_rate'] = float(app.config.get('PROFILE_SAMPLE_RATE', 0.0))
+    settings['profile_dir'] = app.config.get('PROFILE_DIR', 'profiles')
+    settings['logger'] = app.logger
+    if not app.extensions.get('fitmate_metrics'):
+        app.before_request(_start_request)
+        app.after_request(_note_response)
+        app.teardown_request(_finish_request)
+        app.extensions['fitmate_metrics'] = True
+
+def render_prometheus(extra_lines=()):
+    """Returns all metrics (plus any extra pre-rendered lines) in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
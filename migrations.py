@@ -0,0 +1,296 @@
+# migrations.py
+# Versioned schema migrations. The schema version of a database is kept in
+# SQLite's 'PRAGMA user_version'; run_migrations() applies every migration with
+# a higher version, in order, each one inside its own transaction.
+from allergens import create_meal_features, refresh_meal_features
+from catalog import backfill_meal_categories, create_catalog_version, create_meal_categories
+from images import create_meal_images
+from jobs import add_job_heartbeat, create_jobs
+from plan_archive import create_plan_archive
+from recipes import create_meal_ingredients, refresh_meal_ingredients
+from search import create_meal_search
+from similarity import create_meal_neighbors, refresh_meal_neighbors
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """
+    Decorator that registers a migration function under a schema version.
+    The function receives a cursor inside an open transaction.
+    """
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+def get_schema_version(conn):
+    """Returns the schema version stored in the database (0 for a fresh DB)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def latest_schema_version():
+    """Returns the version the newest migration upgrades to."""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def run_migrations(conn):
+    """
+    Upgrades the database in place to the latest schema version.
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    current = get_schema_version(conn)
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            func(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+def create_catalog_bump_trigger(cursor, table, event):
+    """
+    Creates the trigger that bumps catalog_version (and its last-modified time)
+    after an INSERT, UPDATE or DELETE on a table the meal catalog is built from.
+    """
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_{event.lower()}_bump_version
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE catalog_version
+            SET version = version + 1,
+                updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE id = 1;
+        END
+    ''')
+
+def create_user_version_trigger(cursor, table, kind, event, user_column='user_id', columns=None):
+    """
+    Creates the trigger that bumps a user's '<kind>_version' in user_data_versions
+    (and its last-modified time) after an INSERT, UPDATE or DELETE on a table
+    holding per-user data ('plan' for user_meals, 'favorites' for favorites,
+    'profile' for the users row itself). user_column names the user id column;
+    columns limits an UPDATE trigger to changes of those columns.
+    """
+    row = 'OLD' if event == 'DELETE' else 'NEW'
+    of = f" OF {', '.join(columns)}" if columns else ''
+    cursor.execute(f'''
+        CREATE TRIGGER {table}_{event.lower()}_bump_version
+        AFTER {event}{of} ON {table}
+        BEGIN
+            INSERT INTO user_data_versions (user_id, {kind}_version, {kind}_updated_at)
+            VALUES ({row}.{user_column}, 1, CAST(strftime('%s', 'now') AS INTEGER))
+            ON CONFLICT (user_id) DO UPDATE SET
+                {kind}_version = {kind}_version + 1,
+                {kind}_updated_at = excluded.{kind}_updated_at;
+        END
+    ''')
+
+# =============================================================================
+# MIGRATIONS
+# =============================================================================
+
+@migration(1, "catalog_version counter and meal_categories join table")
+def add_catalog_tables(cursor):
+    create_catalog_version(cursor)
+    create_meal_categories(cursor)
+    backfill_meal_categories(cursor)
+
+@migration(2, "user_meals keyed by (user_id, day, slot); supporting indexes")
+def add_user_meals_key(cursor):
+    cursor.execute('''
+        CREATE TABLE user_meals_new (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            meal_type TEXT NOT NULL,
+            meal_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            PRIMARY KEY (user_id, day, slot),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        )
+    ''')
+    # Slot order replaces the CASE expression used to sort plans.
+    # OR REPLACE keeps one row if an old plan had duplicate slots.
+    cursor.execute('''
+        INSERT OR REPLACE INTO user_meals_new (user_id, day, slot, meal_type, meal_id, status)
+        SELECT user_id, day,
+               CASE meal_type
+                   WHEN 'Breakfast' THEN 1
+                   WHEN 'Lunch' THEN 2
+                   WHEN 'Dinner' THEN 3
+                   ELSE 4
+               END,
+               meal_type, meal_id, COALESCE(status, 'pending')
+        FROM user_meals
+        WHERE user_id IS NOT NULL AND day IS NOT NULL AND meal_id IS NOT NULL
+    ''')
+    cursor.execute("DROP TABLE user_meals")
+    cursor.execute("ALTER TABLE user_meals_new RENAME TO user_meals")
+    cursor.execute("CREATE INDEX idx_user_meals_meal ON user_meals (meal_id)")
+    cursor.execute("CREATE INDEX idx_favorites_meal ON favorites (meal_id, user_id)")
+
+@migration(3, "materialized plan progress (current day, pending meals per day)")
+def add_plan_progress(cursor):
+    cursor.execute('''
+        CREATE TABLE user_day_progress (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            pending INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    # Only days with pending meals, so finding the next current day is a single seek
+    cursor.execute('''
+        CREATE INDEX idx_user_day_progress_pending
+        ON user_day_progress (user_id, day) WHERE pending > 0
+    ''')
+    cursor.execute('''
+        CREATE TABLE user_progress (
+            user_id INTEGER PRIMARY KEY,
+            current_day INTEGER
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO user_day_progress (user_id, day, pending)
+        SELECT user_id, day, SUM(status NOT IN ('done', 'skipped'))
+        FROM user_meals
+        GROUP BY user_id, day
+    ''')
+    cursor.execute('''
+        INSERT INTO user_progress (user_id, current_day)
+        SELECT user_id, MIN(CASE WHEN pending > 0 THEN day END)
+        FROM user_day_progress
+        GROUP BY user_id
+    ''')
+
+@migration(4, "meals.content_hash for incremental imports")
+def add_meal_content_hash(cursor):
+    cursor.execute("ALTER TABLE meals ADD COLUMN content_hash TEXT")
+
+@migration(5, "last-modified times for the catalog; per-user plan and favorites versions")
+def add_data_versions(cursor):
+    # Every catalog trigger now also records when the catalog last changed
+    cursor.execute("ALTER TABLE catalog_version ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("UPDATE catalog_version SET updated_at = CAST(strftime('%s', 'now') AS INTEGER)")
+    for table, events in (('meals', ('INSERT', 'UPDATE', 'DELETE')),
+                          ('meal_categories', ('INSERT', 'DELETE'))):
+        for event in events:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_{event.lower()}_bump_version")
+            create_catalog_bump_trigger(cursor, table, event)
+
+    # One row per user, bumped by triggers whenever their plan or favorites change
+    cursor.execute('''
+        CREATE TABLE user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            plan_version INTEGER NOT NULL DEFAULT 0,
+            plan_updated_at INTEGER NOT NULL DEFAULT 0,
+            favorites_version INTEGER NOT NULL DEFAULT 0,
+            favorites_updated_at INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for table, kind, events in (('user_meals', 'plan', ('INSERT', 'UPDATE', 'DELETE')),
+                                ('favorites', 'favorites', ('INSERT', 'DELETE'))):
+        for event in events:
+            create_user_version_trigger(cursor, table, kind, event)
+
+@migration(6, "meal_images: resized WebP/JPEG derivatives of each meal photo")
+def add_meal_images(cursor):
+    create_meal_images(cursor)
+    for event in ('INSERT', 'DELETE'):
+        create_catalog_bump_trigger(cursor, 'meal_images', event)
+
+@migration(7, "stored plan settings per user; checkpoints for bulk plan regeneration")
+def add_plan_settings(cursor):
+    # The choices a plan was generated from, so it can be regenerated later
+    cursor.execute('''
+        CREATE TABLE user_plan_settings (
+            user_id INTEGER PRIMARY KEY,
+            goals TEXT NOT NULL,
+            meals_per_day TEXT NOT NULL,
+            duration INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    # Users already done by a regenerate_plans.py run, written with their plans
+    cursor.execute('''
+        CREATE TABLE plan_regeneration_progress (
+            run_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (run_id, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+@migration(8, "meals_fts full-text index over meal name, ingredients and equipment")
+def add_meal_search(cursor):
+    create_meal_search(cursor)
+
+@migration(9, "ingredient/allergen vocabulary and a feature bitset per meal")
+def add_meal_features(cursor):
+    create_meal_features(cursor)
+    refresh_meal_features(cursor)
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        create_catalog_bump_trigger(cursor, 'meal_features', event)
+
+@migration(10, "meal_ingredients: ingredient entries parsed into name, quantity and unit")
+def add_meal_ingredients(cursor):
+    create_meal_ingredients(cursor)
+    refresh_meal_ingredients(cursor)
+
+@migration(11, "jobs: background jobs (plan generation) with state and progress")
+def add_jobs(cursor):
+    create_jobs(cursor)
+
+@migration(12, "compact user_meals (integer status, no meal_type, WITHOUT ROWID); plan_archive")
+def compact_user_meals(cursor):
+    # Slot names come from the slot number and statuses are small integer codes
+    # (planner.STATUS_CODES); the primary key is the table itself, no rowid.
+    cursor.execute('''
+        CREATE TABLE user_meals_new (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            meal_id INTEGER NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, slot)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO user_meals_new (user_id, day, slot, meal_id, status)
+        SELECT user_id, day, slot, meal_id,
+               CASE status WHEN 'done' THEN 1 WHEN 'skipped' THEN 2 ELSE 0 END
+        FROM user_meals
+    ''')
+    cursor.execute("DROP TABLE user_meals")
+    cursor.execute("ALTER TABLE user_meals_new RENAME TO user_meals")
+    cursor.execute("CREATE INDEX idx_user_meals_meal ON user_meals (meal_id)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        create_user_version_trigger(cursor, 'user_meals', 'plan', event)
+    # Replaced plans move here instead of being deleted (see plan_archive.py)
+    create_plan_archive(cursor)
+
+@migration(13, "meal_neighbors: top-k similar meals per meal (categories and ingredients)")
+def add_meal_neighbors(cursor):
+    create_meal_neighbors(cursor)
+    refresh_meal_neighbors(cursor)
+
+@migration(14, "jobs.heartbeat_at: running jobs are only requeued once their heartbeat stops")
+def add_jobs_heartbeat(cursor):
+    add_job_heartbeat(cursor)
+
+@migration(15, "per-user profile version, bumped when allergies or dietary preferences change")
+def add_profile_version(cursor):
+    # Meal pages depend on what the user must avoid, so they are validated against it
+    cursor.execute("ALTER TABLE user_data_versions ADD COLUMN profile_version INTEGER NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE user_data_versions ADD COLUMN profile_updated_at INTEGER NOT NULL DEFAULT 0")
+    create_user_version_trigger(cursor, 'users', 'profile', 'UPDATE', user_column='id',
+                                columns=('allergies', 'dietary_preferences'))
@@ -0,0 +1,168 @@
+# plan_archive.py
+# Archive of finished meal plans. 'user_meals' only holds active plans; when a
+# plan is replaced, or as soon as its last meal is done or skipped, its rows
+# move here as one zlib-compressed blob per plan, with a few summary counts
+# so history can be listed without decompressing anything. Each blob is a packed
+# array of PLAN_ROW_DTYPE records (day, slot, status code, meal id).
+#
+#   python plan_archive.py --finished                 # archive completed plans left behind
+#   python plan_archive.py --export history.jsonl     # one JSON line per plan
+#   python plan_archive.py --export - --user 42
+import argparse
+import json
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from planner import SLOT_NAMES, STATUS_CODES, STATUS_NAMES
+
+PLAN_ROW_DTYPE = np.dtype([('day', '<u2'), ('slot', 'u1'), ('status', 'u1'), ('meal_id', '<u4')])
+ARCHIVE_BATCH_SIZE = 500   # plans per transaction when archiving finished plans
+
+def create_plan_archive(cursor):
+    """Creates the 'plan_archive' table and its index."""
+    cursor.execute('''
+        CREATE TABLE plan_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            archived_at INTEGER NOT NULL,
+            goals TEXT,
+            meals_per_day TEXT,
+            days INTEGER NOT NULL,
+            meals INTEGER NOT NULL,
+            done INTEGER NOT NULL,
+            skipped INTEGER NOT NULL,
+            plan BLOB NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX idx_plan_archive_user ON plan_archive (user_id, id)")
+
+def pack_plan(rows):
+    """Packs (day, slot, status code, meal_id) rows into a compressed blob."""
+    return zlib.compress(np.array(rows, dtype=PLAN_ROW_DTYPE).tobytes())
+
+def unpack_plan(blob):
+    """Returns the records packed by pack_plan as a NumPy structured array."""
+    return np.frombuffer(zlib.decompress(blob), dtype=PLAN_ROW_DTYPE)
+
+def archive_plan(conn, user_id):
+    """
+    Moves a user's active plan into 'plan_archive' and clears its progress rows.
+    Runs inside the caller's transaction. Returns the archive id, or None if the
+    user had no plan.
+    """
+    rows = [tuple(row) for row in conn.execute('''
+        SELECT day, slot, status, meal_id FROM user_meals
+        WHERE user_id = ?
+        ORDER BY day, slot
+    ''', (user_id,))]
+    if not rows:
+        return None
+    statuses = np.array([row[2] for row in rows])
+    settings = conn.execute("SELECT goals, meals_per_day FROM user_plan_settings WHERE user_id = ?",
+                            (user_id,)).fetchone()
+    archive_id = conn.execute('''
+        INSERT INTO plan_archive (user_id, archived_at, goals, meals_per_day,
+                                  days, meals, done, skipped, plan)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, int(time.time()), settings[0] if settings else None,
+          settings[1] if settings else None, len({row[0] for row in rows}), len(rows),
+          int((statuses == STATUS_CODES['done']).sum()),
+          int((statuses == STATUS_CODES['skipped']).sum()), pack_plan(rows))).lastrowid
+    conn.execute("DELETE FROM user_meals WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM user_day_progress WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM user_progress WHERE user_id = ?", (user_id,))
+    return archive_id
+
+def archive_plan_if_finished(conn, user_id):
+    """
+    Archives a user's plan if none of its meals is pending any more (called
+    whenever statuses change). Runs inside the caller's transaction. Returns the
+    archive id, or None if the plan is not finished.
+    """
+    progress = conn.execute("SELECT current_day FROM user_progress WHERE user_id = ?",
+                            (user_id,)).fetchone()
+    if progress is None or progress[0] is not None:
+        return None
+    return archive_plan(conn, user_id)
+
+def archive_finished_plans(conn, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Archives every plan with no pending meals left, batch_size plans per
+    transaction. Plans are archived as they finish (see archive_plan_if_finished),
+    so this only catches ones finished before that, or written by other tools.
+    Returns the number of plans archived.
+    """
+    user_ids = [row[0] for row in conn.execute('''
+        SELECT user_id FROM user_progress p
+        WHERE current_day IS NULL
+          AND EXISTS (SELECT 1 FROM user_meals um WHERE um.user_id = p.user_id)
+        ORDER BY user_id
+    ''')]
+    for start in range(0, len(user_ids), batch_size):
+        with conn:
+            for user_id in user_ids[start:start + batch_size]:
+                archive_plan(conn, user_id)
+    return len(user_ids)
+
+def iter_archived_plans(conn, user_id=None):
+    """
+    Yields archived plans as dicts, oldest first, decompressing one at a time:
+    id, user_id, archived_at, goals, meals_per_day, days and 'items', a list of
+    {'day', 'type', 'meal', 'status'} dicts. user_id=None reads every user's plans.
+    """
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    cursor = conn.execute(f'''
+        SELECT id, user_id, archived_at, goals, meals_per_day, days, plan
+        FROM plan_archive {where}
+        ORDER BY id
+    ''', params)
+    for archive_id, owner, archived_at, goals, meals_per_day, days, blob in cursor:
+        yield {
+            'id': archive_id, 'user_id': owner, 'archived_at': archived_at,
+            'goals': goals.split(';') if goals else [], 'meals_per_day': meals_per_day,
+            'days': days,
+            'items': [{'day': int(r['day']), 'type': SLOT_NAMES.get(int(r['slot'])),
+                       'meal': int(r['meal_id']), 'status': STATUS_NAMES.get(int(r['status']))}
+                      for r in unpack_plan(blob)],
+        }
+
+def iter_export_lines(conn, user_id=None):
+    """Yields the archived plans as JSON lines (see iter_archived_plans)."""
+    for plan in iter_archived_plans(conn, user_id):
+        yield json.dumps(plan, separators=(',', ':')) + '\n'
+
+def main(argv=None):
+    """Command-line entry point: archive finished plans and/or export the archive."""
+    import project
+    parser = argparse.ArgumentParser(description="Archive finished FitMate meal plans and export them.")
+    parser.add_argument('--finished', action='store_true',
+                        help="archive every plan whose meals are all done or skipped")
+    parser.add_argument('--export', metavar='FILE', help="write archived plans as JSON lines ('-': stdout)")
+    parser.add_argument('--user', type=int, help="only export this user's plans")
+    parser.add_argument('--db', default=project.DATABASE)
+    args = parser.parse_args(argv)
+    if not args.finished and not args.export:
+        parser.error("nothing to do: pass --finished and/or --export")
+
+    project.app.config['DATABASE'] = args.db
+    project.create_tables()
+    conn = project.get_db_connection()
+    try:
+        if args.finished:
+            print(f"Archived {archive_finished_plans(conn)} finished plans.", file=sys.stderr)
+        if args.export:
+            out = sys.stdout if args.export == '-' else open(args.export, 'w', encoding='utf-8')
+            try:
+                out.writelines(iter_export_lines(conn, args.user))
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+    finally:
+        conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,331 @@
+# planner.py
+# Meal plan generation engine. The catalog columns it needs (type, categories,
+# prep time, overnight flag) are held as NumPy arrays (PlanArrays), so selecting
+# candidates is a few vectorized masks over the whole catalog. Each meal type's
+# candidates are then narrowed to a weighted random shortlist, and every slot is
+# filled by weighted sampling from that shortlist, scored against:
+#   - no repeats until the shortlist is used up, and never within a day,
+#   - a daily prep-time budget (soft: meals over the remaining budget are
+#     down-weighted, not excluded),
+#   - no overnight meals on two days in a row,
+#   - category variety within each week,
+#   - the user's favorites and meals similar to them (see similarity.py) are
+#     drawn more often.
+import random
+
+import numpy as np
+
+from categories import CATEGORY_MAPPING, category_keys, normalize_category
+
+# Map user's meals-per-day choice to actual slots
+MEAL_TYPE_MAP = {
+    'Breakfast': ['Breakfast'],
+    'Lunch': ['Lunch'],
+    'Dinner': ['Dinner'],
+    'All 3': ['Breakfast', 'Lunch', 'Dinner'],
+    'Breakfast & Lunch': ['Breakfast', 'Lunch'],
+    'Breakfast & Dinner': ['Breakfast', 'Dinner'],
+    'Lunch & Dinner': ['Lunch', 'Dinner']
+}
+DEFAULT_SLOTS = ['Breakfast', 'Lunch', 'Dinner']
+
+# Which meal type (as stored in meals.type, lowercased) fills each slot
+SLOT_MEAL_TYPES = {
+    'Breakfast': 'breakfast',
+    'Lunch': 'lunch/dinner',
+    'Dinner': 'lunch/dinner'
+}
+
+# Integer order of each slot within a day (stored as user_meals.slot)
+SLOT_ORDER = {
+    'Breakfast': 1,
+    'Lunch': 2,
+    'Dinner': 3
+}
+SLOT_NAMES = {order: slot for slot, order in SLOT_ORDER.items()}
+
+# Integer code of each meal status (stored as user_meals.status)
+STATUS_CODES = {
+    'pending': 0,
+    'done': 1,
+    'skipped': 2
+}
+STATUS_NAMES = {code: status for status, code in STATUS_CODES.items()}
+
+# Column order of PlanArrays.categories
+CATEGORY_KEYS = tuple(CATEGORY_MAPPING)
+
+# Scoring. Weights multiply; a meal's chance in a slot is its weight over the total.
+SAVE_TIME_PREP_BUDGET = 60      # default minutes per day for the 'save_time' goal
+OVER_BUDGET_WEIGHT = 0.1        # meals longer than the remaining budget share
+VARIETY_WEIGHT = 1.0            # per earlier use of a meal's category this week
+VARIETY_DAYS = 7
+FAVORITE_WEIGHT = 2.0           # a favorite is (1 + this) times as likely; similar meals by score
+PROGRESS_STEPS = 20             # progress reports per plan at most
+# Shortlist size per meal type: this many candidates per slot to fill, at least SHORTLIST_MIN
+SHORTLIST_FACTOR = 4
+SHORTLIST_MIN = 64
+
+def slots_for(meals_per_day):
+    """Returns the list of slots for a meals-per-day choice (all 3 if unknown)."""
+    return MEAL_TYPE_MAP.get(meals_per_day, DEFAULT_SLOTS)
+
+def slot_meal_types(slot_types):
+    """Returns the sorted meal types needed to fill the given slots."""
+    return sorted({SLOT_MEAL_TYPES.get(slot, 'lunch/dinner') for slot in slot_types})
+
+def prep_budget_for(goals):
+    """Returns the default daily prep-time budget (minutes) for a set of goals, or None."""
+    keys = {normalize_category(g) for g in goals if g}
+    return SAVE_TIME_PREP_BUDGET if 'save_time' in keys else None
+
+
+class PlanArrays:
+    """
+    The catalog columns plan scoring needs, as NumPy arrays with one row per meal:
+      - ids: meal ids (sorted)
+      - type_codes: index of the meal's type in 'meal_types'
+      - categories: bool matrix, one column per CATEGORY_KEYS entry
+      - prep_time: minutes (0 if unknown)
+      - overnight: bool
+    Instances are plain arrays, so they pickle cheaply to worker processes.
+    """
+
+    def __init__(self, ids, type_codes, meal_types, categories, prep_time, overnight):
+        self.ids = ids
+        self.type_codes = type_codes
+        self.meal_types = meal_types
+        self.categories = categories
+        self.prep_time = prep_time
+        self.overnight = overnight
+
+    @classmethod
+    def from_meals(cls, meals):
+        """
+        Builds the arrays from meal dicts (ordered by id) with 'id', 'type_key' or
+        'type', 'category_set' or 'categories', 'prep_time' and 'overnight'.
+        """
+        meal_types = sorted({m.get('type_key', (m.get('type') or '').strip().lower()) for m in meals})
+        type_index = {meal_type: code for code, meal_type in enumerate(meal_types)}
+        column = {key: col for col, key in enumerate(CATEGORY_KEYS)}
+        categories = np.zeros((len(meals), len(CATEGORY_KEYS)), dtype=bool)
+        for row, meal in enumerate(meals):
+            keys = meal['category_set'] if 'category_set' in meal else category_keys(meal.get('categories'))
+            for key in keys:
+                if key in column:
+                    categories[row, column[key]] = True
+        return cls(
+            ids=np.array([m['id'] for m in meals], dtype=np.int64),
+            type_codes=np.array([type_index[m.get('type_key', (m.get('type') or '').strip().lower())]
+                                 for m in meals], dtype=np.int16),
+            meal_types=tuple(meal_types),
+            categories=categories,
+            prep_time=np.array([m.get('prep_time') or 0 for m in meals], dtype=np.float32),
+            overnight=np.array([bool(m.get('overnight')) for m in meals], dtype=bool))
+
+    @classmethod
+    def from_ids(cls, ids_by_type):
+        """
+        Builds arrays for bare candidate ids (no categories, prep times or
+        overnight meals), e.g. {'breakfast': [1, 2], 'lunch/dinner': [3, 4]}.
+        """
+        meals = sorted(({'id': meal_id, 'type_key': meal_type}
+                        for meal_type, meal_ids in ids_by_type.items() for meal_id in meal_ids),
+                       key=lambda m: m['id'])
+        return cls.from_meals([dict(m, category_set=()) for m in meals])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for_ids(self, meal_ids):
+        """Returns the row numbers of the given meal ids (ids not in the arrays are dropped)."""
+        meal_ids = np.asarray(meal_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, meal_ids)
+        rows = np.minimum(rows, max(len(self.ids) - 1, 0))
+        return rows[self.ids[rows] == meal_ids] if len(self.ids) else rows[:0]
+
+    def affinity_weights(self, affinity):
+        """
+        Returns per-row sampling weights from {meal_id: affinity in 0..1}
+        (see similarity.favorite_affinity), or None if there is no affinity.
+        """
+        if not affinity or not len(self.ids):
+            return None
+        meal_ids = np.fromiter(affinity, dtype=np.int64, count=len(affinity))
+        values = np.fromiter(affinity.values(), dtype=np.float64, count=len(affinity))
+        rows = np.minimum(np.searchsorted(self.ids, meal_ids), len(self.ids) - 1)
+        found = self.ids[rows] == meal_ids
+        weights = np.ones(len(self.ids))
+        weights[rows[found]] += FAVORITE_WEIGHT * values[found]
+        return weights
+
+    def candidate_rows(self, categories, meal_type, safe=None):
+        """
+        Returns the row numbers of meals of one type in any of the categories.
+        'safe' is an optional bool array (one entry per row) of allowed meals.
+        """
+        columns = sorted({CATEGORY_KEYS.index(k) for k in
+                          (normalize_category(c) for c in categories if c) if k in CATEGORY_KEYS})
+        if not columns or meal_type not in self.meal_types:
+            return np.zeros(0, dtype=np.intp)
+        mask = self.type_codes == self.meal_types.index(meal_type)
+        mask &= self.categories[:, columns].any(axis=1)
+        if safe is not None:
+            mask &= safe
+        return np.flatnonzero(mask)
+
+
+def _numpy_rng(seed):
+    """Returns a NumPy generator for any hashable seed (None: unpredictable)."""
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(random.Random(seed).getrandbits(64))
+
+def _sample(weights, rng):
+    """Returns an index drawn with probability proportional to weights, or None if all are 0."""
+    cumulative = np.cumsum(weights)
+    total = cumulative[-1] if len(cumulative) else 0.0
+    if total <= 0:
+        return None
+    index = int(np.searchsorted(cumulative, rng.random() * total, side='right'))
+    return min(index, len(weights) - 1)
+
+
+class _Shortlist:
+    """The candidates of one meal type chosen for a plan, with per-plan usage state."""
+
+    def __init__(self, arrays, rows, slots_to_fill, prep_share, rng, preference=None):
+        weights = np.ones(len(rows)) if preference is None else preference[rows]
+        if prep_share is not None:
+            weights[arrays.prep_time[rows] > prep_share] *= OVER_BUDGET_WEIGHT
+        size = max(slots_to_fill * SHORTLIST_FACTOR, SHORTLIST_MIN)
+        if len(rows) > size:
+            # Weighted sampling without replacement: top-k of log(w) + Gumbel noise
+            keys = np.log(weights) + rng.gumbel(size=len(rows))
+            keep = np.sort(np.argpartition(-keys, size)[:size])
+            rows, weights = rows[keep], weights[keep]
+        self.rows = rows
+        self.weights = weights
+        self.prep_time = arrays.prep_time[rows]
+        self.overnight = arrays.overnight[rows]
+        self.categories = arrays.categories[rows].astype(np.float32)
+        self.category_counts = np.maximum(self.categories.sum(axis=1), 1.0)
+        self.uses = np.zeros(len(rows), dtype=np.int32)
+
+
+def build_scored_plan(arrays, rows_by_type, slot_types, duration, seed=None, prep_budget=None,
+                      preference=None, progress=None, history=None):
+    """
+    Builds a plan of (day, slot, meal_id) rows for days 1..duration from
+    PlanArrays and {meal type: candidate row numbers} (see candidate_rows).
+    No meal repeats within a day, and none repeats overall until every
+    shortlisted meal of its type has been used. prep_budget is the daily
+    prep-time budget in minutes (None for no budget). preference holds optional
+    per-row weights (see PlanArrays.affinity_weights). progress, if given, is
+    called with the fraction of days built, at most PROGRESS_STEPS times.
+    history holds the (day, meal_id) rows of an existing plan the new days
+    follow on from: its meals count as used, its last day's meals are avoided on
+    the first new day, and the variety week continues where it left off. The
+    same seed and candidates always give the same plan. Returns None if some
+    slot cannot be filled.
+    """
+    rng = _numpy_rng(seed)
+    per_day = {}
+    for slot in slot_types:
+        meal_type = SLOT_MEAL_TYPES.get(slot, 'lunch/dinner')
+        per_day[meal_type] = per_day.get(meal_type, 0) + 1
+    prep_share = prep_budget / len(slot_types) if prep_budget and slot_types else None
+    shortlists = {}
+    for meal_type, count in per_day.items():
+        rows = np.asarray(rows_by_type.get(meal_type, ()), dtype=np.intp)
+        if len(rows) < count:
+            return None
+        shortlists[meal_type] = _Shortlist(arrays, rows, count * duration, prep_share, rng, preference)
+
+    plan = []
+    progress_every = max(duration // PROGRESS_STEPS, 1)
+    week_counts = np.zeros(len(CATEGORY_KEYS), dtype=np.float32)
+    overnight_yesterday = False
+    offset = 0
+    repeats = {}
+    if history:
+        offset, week_counts, overnight_yesterday, repeats = _continue_from(arrays, shortlists, history)
+    for day in range(1, duration + 1):
+        if (offset + day - 1) % VARIETY_DAYS == 0:
+            week_counts[:] = 0
+        used_today = {meal_type: [] for meal_type in shortlists}
+        spent_today = 0.0
+        overnight_today = False
+        for position, slot in enumerate(slot_types):
+            shortlist = shortlists[SLOT_MEAL_TYPES.get(slot, 'lunch/dinner')]
+            today = used_today[SLOT_MEAL_TYPES.get(slot, 'lunch/dinner')]
+            # Only the least-used meals are eligible, so nothing repeats early
+            weights = np.where(shortlist.uses == shortlist.uses.min(), shortlist.weights, 0.0)
+            weights[today] = 0.0
+            if day == 1 and repeats:
+                weights[repeats[SLOT_MEAL_TYPES.get(slot, 'lunch/dinner')]] = 0.0
+            if overnight_yesterday or overnight_today:
+                weights[shortlist.overnight] = 0.0
+            if prep_budget:
+                share = (prep_budget - spent_today) / (len(slot_types) - position)
+                weights[shortlist.prep_time > share] *= OVER_BUDGET_WEIGHT
+            penalty = shortlist.categories @ week_counts
+            weights /= 1.0 + VARIETY_WEIGHT * penalty / shortlist.category_counts
+
+            index = _sample(weights, rng)
+            if index is None:
+                # Constraints left nothing: any meal not used today will do
+                weights = shortlist.weights.copy()
+                weights[today] = 0.0
+                index = _sample(weights, rng)
+                if index is None:
+                    return None
+            today.append(index)
+            shortlist.uses[index] += 1
+            spent_today += shortlist.prep_time[index]
+            overnight_today = overnight_today or bool(shortlist.overnight[index])
+            week_counts += shortlist.categories[index]
+            plan.append((day, slot, int(arrays.ids[shortlist.rows[index]])))
+        overnight_yesterday = overnight_today
+        if progress and (day == duration or day % progress_every == 0):
+            progress(day / duration)
+    return plan
+
+
+def _continue_from(arrays, shortlists, history):
+    """
+    Returns (last day, week category counts, overnight yesterday, {meal type:
+    shortlist mask of the last day's meals}) for a plan continuing 'history',
+    and counts its meals as used in the shortlists.
+    """
+    days = np.fromiter((day for day, _ in history), dtype=np.int64, count=len(history))
+    meal_ids = np.fromiter((meal_id for _, meal_id in history), dtype=np.int64, count=len(history))
+    last_day = int(days.max())
+    rows = arrays.rows_for_ids(meal_ids)
+    row_uses = np.bincount(rows, minlength=len(arrays.ids))
+    for shortlist in shortlists.values():
+        shortlist.uses += row_uses[shortlist.rows].astype(np.int32)
+
+    week_start = last_day - last_day % VARIETY_DAYS + 1
+    week_rows = arrays.rows_for_ids(meal_ids[days >= week_start])
+    week_counts = arrays.categories[week_rows].astype(np.float32).sum(axis=0)
+    yesterday_rows = arrays.rows_for_ids(meal_ids[days == last_day])
+    overnight_yesterday = bool(arrays.overnight[yesterday_rows].any())
+    repeats = {meal_type: np.isin(shortlist.rows, yesterday_rows)
+               for meal_type, shortlist in shortlists.items()}
+    return last_day, week_counts, overnight_yesterday, repeats
+
+
+def build_plan(ids_by_type, slot_types, duration, seed=None):
+    """
+    Builds a plan of (day, slot, meal_id) rows for days 1..duration.
+    ids_by_type maps a meal type ('breakfast', 'lunch/dinner') to candidate ids.
+    No meal repeats within a day, and no meal repeats overall until its pool is exhausted.
+    The same seed and candidates always give the same plan.
+    Returns None if some slot cannot be filled.
+    Without catalog columns to score on, meals are drawn uniformly.
+    """
+    arrays = PlanArrays.from_ids(ids_by_type)
+    rows_by_type = {meal_type: arrays.rows_for_ids(sorted(meal_ids))
+                    for meal_type, meal_ids in ids_by_type.items()}
+    return build_scored_plan(arrays, rows_by_type, slot_types, duration, seed=seed)
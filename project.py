@@ -1,10 +1,27 @@
 import os
 import sqlite3
-import random
-import re
-from collections import defaultdict
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, g, has_app_context
+from markupsafe import Markup
+from werkzeug.http import is_resource_modified
 from werkzeug.security import generate_password_hash, check_password_hash
+import metrics
+from allergens import unmatched_preferences
+from catalog import get_catalog, get_catalog_version, select_candidate_ids
+from images import ASSET_IMAGE_WIDTHS, existing_derivatives, meal_image_source
+from jobs import JobWorkers, claim_job, finish_job, get_job, set_job_progress, submit_job
+from migrations import run_migrations
+from plan_archive import archive_plan, archive_plan_if_finished, iter_export_lines
+from planner import (SLOT_NAMES, SLOT_ORDER, STATUS_CODES, STATUS_NAMES, build_scored_plan,
+                     prep_budget_for, slot_meal_types, slots_for)
+from recipes import parse_meal_details
+from search import search_meal_ids
+from shopping import build_shopping_list, format_quantity, iter_csv, iter_text
+from similarity import favorite_affinity, get_neighbors
 
 # =============================================================================
 # APPLICATION & DATABASE SETUP
@@ -13,23 +30,91 @@ from werkzeug.security import generate_password_hash, check_password_hash
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # A secure key for sessions
 DATABASE = 'database/fitmate.db'
+app.config['DATABASE'] = DATABASE  # configure_app() may point this elsewhere
+metrics.init_app(app)  # per-route latency and SQL statement metrics (see /metrics)
+
+# PRAGMAs applied to every connection. WAL lets readers keep going while a writer
+# commits; busy_timeout makes writers wait for the lock instead of failing at once.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,         # milliseconds
+    'synchronous': 'NORMAL',      # safe with WAL, far fewer fsyncs than FULL
+    'cache_size': -32000,         # negative = KiB, so ~32 MB of page cache
+    'mmap_size': 268435456,       # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+}
+
+_db_dirs_ready = set()
+_wal_databases = set()
+_thread_connections = threading.local()
 
 def get_db_connection():
     """
-    Ensures the directory for the database exists, then connects to the SQLite DB.
-    Uses row_factory for named-column access.
+    Opens a new connection to the SQLite DB with the tuned PRAGMAs applied.
+    Statements run on it are counted and timed (see metrics.py).
+    Uses row_factory for named-column access. The caller is responsible for closing it;
+    app code should normally use get_db() instead.
     """
-    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
-    conn = sqlite3.connect(DATABASE)
+    database = app.config['DATABASE']
+    db_dir = os.path.dirname(database)
+    if db_dir and db_dir not in _db_dirs_ready:
+        os.makedirs(db_dir, exist_ok=True)
+        _db_dirs_ready.add(db_dir)
+    conn = sqlite3.connect(database, timeout=SQLITE_PRAGMAS['busy_timeout'] / 1000,
+                           factory=metrics.InstrumentedConnection)
     conn.row_factory = sqlite3.Row
+    # journal_mode is stored in the database file, so it only needs setting once per DB
+    if database not in _wal_databases:
+        conn.execute("PRAGMA journal_mode = WAL")
+        _wal_databases.add(database)
+    for name, value in SQLITE_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
     return conn
 
+def get_db():
+    """
+    Returns the shared connection for the current request (stored on flask.g),
+    opening it on first use. Outside of a request (scripts, tests) each thread
+    reuses one connection per database file instead.
+    """
+    if has_app_context():
+        if 'db' not in g:
+            g.db = get_db_connection()
+        return g.db
+    connections = getattr(_thread_connections, 'connections', None)
+    if connections is None:
+        connections = _thread_connections.connections = {}
+    database = app.config['DATABASE']
+    if database not in connections:
+        connections[database] = get_db_connection()
+    return connections[database]
+
+@app.teardown_appcontext
+def close_db(exception=None):
+    """
+    Closes the request's connection, rolling back anything left uncommitted.
+    """
+    conn = g.pop('db', None)
+    if conn is not None:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+def close_thread_connections():
+    """
+    Closes the connections get_db() opened for this thread outside of a request.
+    """
+    connections = getattr(_thread_connections, 'connections', None) or {}
+    while connections:
+        _, conn = connections.popitem()
+        conn.close()
+
 def create_tables():
     """
     Creates all necessary tables if they do not exist yet.
-    This includes 'users', 'meals', 'favorites', and 'user_meals'.
+    This includes 'users', 'meals', 'favorites', and 'user_meals' in their original form;
+    run_migrations() then upgrades the schema to the latest version (see migrations.py).
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
 
     # Users table to store account credentials and personal info
@@ -92,7 +177,9 @@ def create_tables():
         )
     ''')
     conn.commit()
-    conn.close()
+
+    # Bring older databases (and the tables above) up to the current schema
+    run_migrations(conn)
 
 # =============================================================================
 # USER & FAVORITES MANAGEMENT
@@ -103,7 +190,7 @@ def register_user(username, password):
     Inserts a new user into the 'users' table with a hashed password.
     Returns True if successful, False if username already exists.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     hashed_password = generate_password_hash(password)
     try:
@@ -112,20 +199,18 @@ def register_user(username, password):
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 def verify_user(username, password):
     """
     Checks if the username exists and verifies the hashed password.
     Returns the user row if valid, otherwise None.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
-    conn.close()
     if user and check_password_hash(user['password'], password):
         return user
     return None
@@ -135,27 +220,25 @@ def add_favorite(user_id, meal_id):
     Adds a meal to a user's favorites list in the 'favorites' table.
     Returns True if added, False if duplicate or error.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO favorites (user_id, meal_id) VALUES (?, ?)", (user_id, meal_id))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 def remove_favorite(user_id, meal_id):
     """
     Removes a meal from the user's favorites in the 'favorites' table.
     Returns True after the deletion.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM favorites WHERE user_id = ? AND meal_id = ?", (user_id, meal_id))
     conn.commit()
-    conn.close()
     return True
 
 @app.route('/add_favorite/<int:meal_id>', methods=['POST'])
@@ -176,126 +259,718 @@ def add_favorite_route(meal_id):
 # MEAL PLAN GENERATION
 # =============================================================================
 
-def generate_meal_plan(goals, meals_per_day, duration, user_id):
+# Fractions of the work done after selecting candidates and after building the days
+PLAN_PROGRESS_CANDIDATES = 0.05
+PLAN_PROGRESS_BUILT = 0.9
+
+def generate_meal_plan(goals, meals_per_day, duration, user_id, seed=None, prep_budget=None,
+                       progress=None):
     """
     Generates a meal plan for the user based on:
       - Chosen goals
       - Meals per day
       - Duration
     Ensures no meal is repeated within the same day, and avoids repeats overall unless forced.
+    Meals the user's allergies or diet exclude are never picked. Meals are scored on
+    the daily prep-time budget (by default only set for the 'save_time' goal),
+    overnight meals and category variety, and the user's favorites and meals
+    similar to them are drawn more often (see planner.py).
+    Pass a seed to get a reproducible plan. The old plan is archived (see plan_archive.py)
+    and replaced in a single transaction.
+    progress, if given, is called with the fraction done as the plan's days are
+    built (see run_next_plan_job).
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM meals")
-    all_meals = cursor.fetchall()
-    conn.close()
-
-    def normalize_categories(cat_str):
-        if not cat_str:
-            return set()
-        return {c.strip() for c in cat_str.split(';')}
-
-    goal_set = set(goals)
-    possible_meals = []
-    for meal in all_meals:
-        meal_categories = normalize_categories(meal['categories'])
-        # Keep the meal if it intersects with user goals
-        if meal_categories & goal_set:
-            possible_meals.append(meal)
-
-    # Separate breakfast vs. lunch/dinner
-    breakfasts = [m for m in possible_meals if m['type'].lower() == 'breakfast']
-    lunch_dinners = [m for m in possible_meals if m['type'].lower() == 'lunch/dinner']
-
-    # Map user's meals-per-day choice to actual slots
-    meal_type_map = {
-        'Breakfast': ['Breakfast'],
-        'Lunch': ['Lunch'],
-        'Dinner': ['Dinner'],
-        'All 3': ['Breakfast', 'Lunch', 'Dinner'],
-        'Breakfast & Lunch': ['Breakfast', 'Lunch'],
-        'Breakfast & Dinner': ['Breakfast', 'Dinner'],
-        'Lunch & Dinner': ['Lunch', 'Dinner']
-    }
-    slot_types = meal_type_map.get(meals_per_day, ['Breakfast', 'Lunch', 'Dinner'])
+    conn = get_db()
+    catalog = get_catalog(conn, app.config['DATABASE'])
+    arrays = catalog.plan_arrays
+    safe = catalog.safe_rows(get_user_exclusions(conn, user_id, catalog))
+    slot_types = slots_for(meals_per_day)
 
-    # Clear existing plan for the user
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM user_meals WHERE user_id = ?", (user_id,))
-
-    used_meals_overall = set()
-    for day in range(1, duration + 1):
-        used_meals_this_day = set()
-        for slot in slot_types:
-            subset = breakfasts if slot == 'Breakfast' else lunch_dinners
-            day_filtered = [m for m in subset if m['id'] not in used_meals_this_day]
-            new_meals = [m for m in day_filtered if m['id'] not in used_meals_overall]
-
-            if new_meals:
-                meal = random.choice(new_meals)
-            else:
-                # If no new meals remain, allow repeats from day_filtered
-                if day_filtered:
-                    meal = random.choice(day_filtered)
-                else:
-                    # If no meals are left at all, fail
-                    conn.close()
-                    return False
+    # Candidate meals (in any of the user's goals), split by breakfast vs. lunch/dinner
+    rows_by_type = {meal_type: arrays.candidate_rows(goals, meal_type, safe)
+                    for meal_type in slot_meal_types(slot_types)}
+    if prep_budget is None:
+        prep_budget = prep_budget_for(goals)
+    preference = arrays.affinity_weights(favorite_affinity(conn, user_id))
+    build_progress = None
+    if progress:
+        progress(PLAN_PROGRESS_CANDIDATES)
+        # Building the days is most of the work; writing the plan takes the rest
+        def build_progress(fraction):
+            progress(PLAN_PROGRESS_CANDIDATES
+                     + (PLAN_PROGRESS_BUILT - PLAN_PROGRESS_CANDIDATES) * fraction)
 
-            cursor.execute('''
-                INSERT INTO user_meals (user_id, day, meal_type, meal_id)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, day, slot, meal['id']))
+    plan = build_scored_plan(arrays, rows_by_type, slot_types, duration, seed=seed,
+                             prep_budget=prep_budget, preference=preference,
+                             progress=build_progress)
+    if plan is None:
+        # If no meals are left for some slot, fail (and keep the old plan)
+        return False
+
+    # Archive the old plan and write the new one (and its progress rows) in one transaction
+    with conn:
+        archive_plan(conn, user_id)
+        conn.executemany('''
+            INSERT INTO user_meals (user_id, day, slot, meal_id)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, day, SLOT_ORDER[slot], meal_id) for day, slot, meal_id in plan])
+        reset_plan_progress(conn, user_id)
+        save_plan_settings(conn, user_id, goals, meals_per_day, duration)
+    return True
 
-            used_meals_this_day.add(meal['id'])
-            used_meals_overall.add(meal['id'])
+def get_user_exclusions(conn, user_id, catalog):
+    """
+    Returns the feature bits (see allergens.py) a user's allergies and dietary
+    preferences exclude, as a frozenset usable with catalog.safe_ids.
+    """
+    row = conn.execute("SELECT allergies, dietary_preferences FROM users WHERE id = ?",
+                       (user_id,)).fetchone()
+    if row is None:
+        return frozenset()
+    return catalog.exclusions(row['allergies'], row['dietary_preferences'])
 
-    conn.commit()
-    conn.close()
+def save_plan_settings(conn, user_id, goals, meals_per_day, duration):
+    """
+    Stores the choices a user's plan was generated from, so it can be
+    regenerated later (see regenerate_plans.py). Runs inside the caller's transaction.
+    """
+    conn.execute('''
+        INSERT OR REPLACE INTO user_plan_settings (user_id, goals, meals_per_day, duration)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, ';'.join(goals), meals_per_day, duration))
+
+# =============================================================================
+# PLAN GENERATION JOBS
+# =============================================================================
+# Submitting the meal plan form queues a 'meal_plan' job (see jobs.py) instead
+# of generating the plan inside the request. Up to JOB_WORKERS threads per process
+# run queued jobs; the review page polls /api/jobs/<id> until the plan is ready.
+
+PLAN_JOB = 'meal_plan'
+NOT_ENOUGH_MEALS = 'Not enough meals in the database to satisfy your plan.'
+
+def run_next_plan_job():
+    """
+    Claims and runs one queued plan job. Returns False if none was queued.
+    """
+    with app.app_context():
+        conn = get_db()
+        job = claim_job(conn, PLAN_JOB)
+        if job is None:
+            return False
+        params = job['params']
+        try:
+            success = generate_meal_plan(
+                params['goals'], params['meals_per_day'], params['duration'], job['user_id'],
+                progress=lambda fraction: set_job_progress(conn, job['id'], fraction))
+        except Exception:
+            app.logger.exception("Plan job %s failed", job['id'])
+            finish_job(conn, job['id'], error='Your meal plan could not be generated.')
+            return True
+        if success:
+            finish_job(conn, job['id'], result={'days': params['duration']})
+        else:
+            finish_job(conn, job['id'], error=NOT_ENOUGH_MEALS)
     return True
 
+plan_workers = JobWorkers(run_next_plan_job)
+
+def submit_plan_job(user_id, goals, meals_per_day, duration):
+    """
+    Queues plan generation for a user and returns the job id. Submitting the same
+    choices again while the job is pending returns the same job.
+    """
+    job_id = submit_job(get_db(), PLAN_JOB, user_id,
+                        {'goals': goals, 'meals_per_day': meals_per_day, 'duration': duration})
+    plan_workers.wake(app.config.get('JOB_WORKERS', 2))
+    return job_id
+
+# =============================================================================
+# PLAN PROGRESS
+# =============================================================================
+# 'user_day_progress' holds the number of pending meals for each day of a plan and
+# 'user_progress' the earliest day that still has one (NULL once everything is
+# done or skipped). Both are kept in sync by the same transactions that write
+# 'user_meals', so the dashboard never has to scan the whole plan.
+
+def reset_plan_progress(conn, user_id):
+    """
+    Rebuilds the progress rows of one user from their 'user_meals' rows.
+    Runs inside the caller's transaction.
+    """
+    conn.execute("DELETE FROM user_day_progress WHERE user_id = ?", (user_id,))
+    conn.execute('''
+        INSERT INTO user_day_progress (user_id, day, pending)
+        SELECT user_id, day, SUM(status = 0)
+        FROM user_meals
+        WHERE user_id = ?
+        GROUP BY day
+    ''', (user_id,))
+    conn.execute('''
+        INSERT OR REPLACE INTO user_progress (user_id, current_day)
+        VALUES (?, (SELECT MIN(day) FROM user_day_progress WHERE user_id = ? AND pending > 0))
+    ''', (user_id, user_id))
+
+STATUSES = tuple(STATUS_CODES)
+
+def apply_status_updates(conn, updates):
+    """
+    Applies (user_id, day, meal_type, meal_id, status) updates and the matching
+    progress changes. meal_id may be None to update whatever meal is planned in
+    that slot. A plan left with no pending meals is archived (see plan_archive.py).
+    Runs inside the caller's transaction, with one statement per table for the
+    whole batch. Returns one bool per update: whether that planned meal was found.
+    """
+    by_user = {}
+    for index, (user_id, day, meal_type, meal_id, status) in enumerate(updates):
+        by_user.setdefault(user_id, []).append((index, day, SLOT_ORDER.get(meal_type), meal_id, status))
+
+    found = [False] * len(updates)
+    for user_id, user_updates in by_user.items():
+        days = sorted({day for _, day, _, _, _ in user_updates})
+        current = {(row['day'], row['slot']): (row['meal_id'], row['status']) for row in conn.execute(f'''
+            SELECT day, slot, meal_id, status FROM user_meals
+            WHERE user_id = ? AND day IN ({', '.join('?' for _ in days)})
+        ''', [user_id] + days)}
+        writes, pending_delta = [], {}
+        for index, day, slot, meal_id, status in user_updates:
+            status = STATUS_CODES[status]
+            planned = current.get((day, slot))
+            if planned is None or (meal_id is not None and planned[0] != meal_id):
+                continue
+            found[index] = True
+            old_status = planned[1]
+            current[(day, slot)] = (planned[0], status)
+            if old_status == status:
+                continue
+            writes.append((status, user_id, day, slot))
+            delta = (status == STATUS_CODES['pending']) - (old_status == STATUS_CODES['pending'])
+            pending_delta[day] = pending_delta.get(day, 0) + delta
+        if not writes:
+            continue
+        conn.executemany("UPDATE user_meals SET status = ? WHERE user_id = ? AND day = ? AND slot = ?",
+                         writes)
+        conn.executemany("UPDATE user_day_progress SET pending = pending + ? WHERE user_id = ? AND day = ?",
+                         [(delta, user_id, day) for day, delta in pending_delta.items() if delta])
+        if any(pending_delta.values()):
+            conn.execute('''
+                UPDATE user_progress
+                SET current_day = (SELECT MIN(day) FROM user_day_progress
+                                   WHERE user_id = ? AND pending > 0)
+                WHERE user_id = ?
+            ''', (user_id, user_id))
+            archive_plan_if_finished(conn, user_id)
+    return found
+
+def set_meal_statuses(user_id, updates):
+    """
+    Sets the status of many planned meals of one user in a single transaction.
+    updates are (day, meal_type, status) or (day, meal_type, meal_id, status)
+    tuples. Returns one bool per update: whether the meal was found in the plan.
+    """
+    rows = [(user_id, u[0], u[1], None, u[2]) if len(u) == 3 else (user_id,) + tuple(u)
+            for u in updates]
+    conn = get_db()
+    with conn:
+        return apply_status_updates(conn, rows)
+
+class StatusWriteBatcher:
+    """
+    Group commit for single status clicks, a tuning knob for deployments with
+    many concurrent writers (off unless STATUS_BATCH_MS is set). A click that
+    finds no write in progress is written at once, so a lone writer never
+    waits. Clicks arriving while a write is in progress queue up; the first of
+    them waits for that write to finish (at most 'window' seconds) and then
+    writes the whole queue in one transaction on a connection of its own.
+    Every caller gets its own result, and an update that fails raises only in
+    the request that made it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writing = {}   # database -> Event set when its write in progress finishes
+        self.queues = {}    # database -> list of entries waiting for that write
+        self.batches = 0
+        self.updates = 0
+
+    def submit(self, database, update, window):
+        entry = {'update': update, 'done': threading.Event(), 'found': False, 'error': None}
+        with self.lock:
+            in_progress = self.writing.get(database)
+            if in_progress is None:
+                finished = self.writing[database] = threading.Event()
+                leader = None
+            else:
+                queue = self.queues.get(database)
+                leader = queue is None
+                if leader:
+                    queue = self.queues[database] = []
+                queue.append(entry)
+        if leader is None:
+            # Nothing else is being written: write on the request's own connection
+            try:
+                conn = get_db()
+                with conn:
+                    return apply_status_updates(conn, [update])[0]
+            finally:
+                self._finished(database, finished)
+        if leader:
+            in_progress.wait(window)
+            with self.lock:
+                batch = self.queues.pop(database)
+                finished = self.writing[database] = threading.Event()
+            try:
+                self._write_batch(batch)
+            finally:
+                self._finished(database, finished)
+                for batch_entry in batch:
+                    batch_entry['done'].set()
+        entry['done'].wait()
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['found']
+
+    def _finished(self, database, finished):
+        with self.lock:
+            if self.writing.get(database) is finished:
+                del self.writing[database]
+        finished.set()
+
+    def _write_batch(self, batch):
+        """
+        Writes the batch in one transaction. If applying it fails, the updates
+        are applied again one at a time (each in its own savepoint) so only the
+        failing ones get the error; a failed commit is every entry's error.
+        """
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("SAVEPOINT status_batch")
+                try:
+                    found = apply_status_updates(conn, [e['update'] for e in batch])
+                except Exception:
+                    conn.execute("ROLLBACK TO status_batch")
+                    found = []
+                    for batch_entry in batch:
+                        conn.execute("SAVEPOINT status_update")
+                        try:
+                            found.append(apply_status_updates(conn, [batch_entry['update']])[0])
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO status_update")
+                            batch_entry['error'] = e
+                            found.append(False)
+                        conn.execute("RELEASE status_update")
+                conn.execute("RELEASE status_batch")
+            for batch_entry, batch_found in zip(batch, found):
+                batch_entry['found'] = batch_found
+            with self.lock:
+                self.batches += 1
+                self.updates += len(batch)
+        except Exception as e:
+            for batch_entry in batch:
+                if batch_entry['error'] is None:
+                    batch_entry['error'] = e
+        finally:
+            conn.close()
+
+status_batcher = StatusWriteBatcher()
+
+def set_meal_status(user_id, day, meal_type, meal_id, status):
+    """
+    Sets the status ('done' or 'skipped') of one planned meal and updates the
+    user's progress rows in the same transaction. With STATUS_BATCH_MS set,
+    clicks arriving while another one is being written are batched (waiting at
+    most that many ms). Returns True if the meal was found in the plan.
+    """
+    update = (user_id, day, meal_type, meal_id, status)
+    window = app.config.get('STATUS_BATCH_MS') or 0
+    if window > 0:
+        return status_batcher.submit(app.config['DATABASE'], update, window / 1000)
+    conn = get_db()
+    with conn:
+        return apply_status_updates(conn, [update])[0]
+
 # =============================================================================
 # RETRIEVING MEAL PLANS
 # =============================================================================
 
+def plan_row(row):
+    """
+    Returns a user_meals row (joined with meal columns) as a dict with the slot
+    and status codes spelled out as 'meal_type' and 'status'.
+    """
+    return dict(row, meal_type=SLOT_NAMES.get(row['slot']), status=STATUS_NAMES.get(row['status']))
+
 def get_user_meal_plan(user_id):
     """
     Retrieves all user meals joined with meal details, sorted by day and meal type.
     """
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
-        SELECT um.day, um.meal_type, um.status, m.*
+        SELECT m.*, um.day, um.slot, um.status
         FROM user_meals um
         JOIN meals m ON um.meal_id = m.id
         WHERE um.user_id = ?
-        ORDER BY 
-            um.day,
-            CASE
-                WHEN um.meal_type = 'Breakfast' THEN 1
-                WHEN um.meal_type = 'Lunch' THEN 2
-                WHEN um.meal_type = 'Dinner' THEN 3
-                ELSE 4
-            END
+        ORDER BY um.day, um.slot
     ''', (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return [plan_row(row) for row in cursor.fetchall()]
 
 def get_earliest_incomplete_day_meals(user_id):
     """
     Finds the earliest day in the plan that still has a meal 'pending'.
     Returns (day, [meals]) or (None, None) if all are done/skipped.
+    Reads the day from 'user_progress' and then only that day's rows.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT current_day FROM user_progress WHERE user_id = ?", (user_id,))
+    progress = cursor.fetchone()
+    if progress is None or progress['current_day'] is None:
+        return None, None
+    day = progress['current_day']
+    cursor.execute('''
+        SELECT um.day, um.slot, um.status,
+               m.id, m.name, m.identifier, m.prep_time, m.image
+        FROM user_meals um
+        JOIN meals m ON um.meal_id = m.id
+        WHERE um.user_id = ? AND um.day = ?
+        ORDER BY um.slot
+    ''', (user_id, day))
+    return day, [plan_row(row) for row in cursor.fetchall()]
+
+# =============================================================================
+# PLAN REVIEW WEEKS
+# =============================================================================
+# The review page shows one week of the plan at a time, addressed by its first
+# day; the previous/next links point at the nearest planned days outside the
+# window (keyset navigation, no OFFSET). A week's table is rendered once and
+# cached by its view model (what the page shows, with its URLs), so a swap in
+# change_meal re-renders only the week it touched, and status clicks (not
+# shown on the page) re-render nothing.
+
+REVIEW_WEEK_DAYS = 7
+REVIEW_WEEK_CACHE_SIZE = 1024
+
+def get_plan_week(user_id, first_day, days=REVIEW_WEEK_DAYS):
+    """
+    Returns (rows, prev_first_day, next_first_day) for days first_day..first_day+days-1
+    of a user's plan. rows are (day, meal_type, meal_id) tuples ordered by day and
+    slot; prev/next are the first days of the neighbouring weeks, or None.
+    """
+    last_day = first_day + days - 1
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT day, slot, meal_id
+        FROM user_meals
+        WHERE user_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day, slot
+    ''', (user_id, first_day, last_day))
+    rows = tuple((day, SLOT_NAMES.get(slot), meal_id) for day, slot, meal_id in cursor.fetchall())
+    cursor.execute('''
+        SELECT (SELECT MAX(day) FROM user_meals WHERE user_id = ? AND day < ?),
+               (SELECT MIN(day) FROM user_meals WHERE user_id = ? AND day > ?)
+    ''', (user_id, first_day, user_id, last_day))
+    before, after = cursor.fetchone()
+    prev_first_day = max(before - days + 1, 1) if before is not None else None
+    return rows, prev_first_day, after
+
+def review_week_view(rows):
+    """
+    Returns the view model of one review week: a tuple of (day, meals) pairs,
+    each meal a (name, prep_time, change_url, image) tuple with image the
+    image_sources() items. It holds everything _review_week.html shows, and is
+    hashable, so renders can be cached by it.
+    """
+    catalog = request_catalog()
+    days = {}
+    for day, meal_type, meal_id in rows:
+        meal = catalog.get(meal_id)
+        if meal is not None:
+            days.setdefault(day, []).append((
+                meal['name'], meal['prep_time'],
+                url_for('change_meal', day=day, meal_type=meal_type),
+                tuple(meal_image(meal).items())))
+    return tuple((day, tuple(meals)) for day, meals in sorted(days.items()))
+
+@lru_cache(maxsize=REVIEW_WEEK_CACHE_SIZE)
+def _cached_review_week(assets, view):
+    return Markup(render_template('_review_week.html', days=view))
+
+def render_review_week(rows):
+    """Returns the HTML tables of one review week (see _review_week.html), cached by its view model."""
+    return _cached_review_week(asset_version(), review_week_view(rows))
+
+# =============================================================================
+# MEAL DETAILS CACHE
+# =============================================================================
+# Parsed instructions/ingredients/equipment only change when meals are imported,
+# so they are cached per meal id and catalog version; a new import bumps the
+# version and old entries simply stop being hit and age out of the LRU.
+
+MEAL_DETAILS_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=MEAL_DETAILS_CACHE_SIZE)
+def _cached_meal_details(database, catalog_version, meal_id):
+    cursor = get_db().cursor()
+    cursor.execute("SELECT * FROM meals WHERE id = ?", (meal_id,))
+    meal_row = cursor.fetchone()
+    return parse_meal_details(meal_row) if meal_row else None
+
+def get_meal_details(meal_id):
+    """
+    Returns the meal as a dict with 'instructions_list', 'ingredients_list' and
+    'equipment_list', or None if it does not exist. Treat the result as read-only.
+    """
+    return _cached_meal_details(app.config['DATABASE'], get_catalog_version(get_db()), meal_id)
+
+SIMILAR_MEALS_SHOWN = 4
+
+def get_similar_meals(meal_id, excluded=frozenset(), limit=SIMILAR_MEALS_SHOWN):
+    """
+    Returns catalog dicts of the meals most similar to a meal (see similarity.py),
+    leaving out meals with any of the excluded feature bits (see get_user_exclusions).
+    """
+    catalog = request_catalog()
+    neighbor_ids = catalog.safe_ids([neighbor_id for neighbor_id, _ in get_neighbors(get_db(), meal_id)],
+                                    excluded)
+    return catalog.get_many(neighbor_ids)[:limit]
+
+def meal_details_cache_stats():
+    """Returns hit/miss/size counts of the meal details cache."""
+    info = _cached_meal_details.cache_info()
+    return {'hits': info.hits, 'misses': info.misses,
+            'size': info.currsize, 'max_size': info.maxsize}
+
+# =============================================================================
+# SHOPPING LIST
+# =============================================================================
+# A shopping list only changes when the user's plan does (swaps, skips) or on
+# import, so lists are cached per user, day range and plan/catalog version.
+
+SHOPPING_LIST_CACHE_SIZE = 256
+SHOPPING_LIST_DAYS = 7          # default range: a week from the current day
+SHOPPING_LIST_MAX_DAYS = 366
+
+@lru_cache(maxsize=SHOPPING_LIST_CACHE_SIZE)
+def _cached_shopping_list(database, user_id, plan_version, catalog_version, first_day, last_day):
+    return tuple(build_shopping_list(get_db(), user_id, first_day, last_day))
+
+def get_shopping_list(user_id, first_day, last_day):
+    """
+    Returns the user's shopping list for days first_day..last_day as a tuple of
+    (ingredient, quantity, unit, meals) rows (see shopping.py).
+    """
+    versions = get_data_versions(user_id) or {}
+    return _cached_shopping_list(app.config['DATABASE'], user_id, versions.get('plan_version'),
+                                 versions.get('catalog_version'), first_day, last_day)
+
+def shopping_list_range(user_id):
+    """
+    Reads the 'first' / 'last' day query arguments of a shopping list request,
+    defaulting to a week from the user's current day. Raises ValueError.
+    """
+    first_day = _int_arg('first', get_current_day(user_id) or 1, minimum=1)
+    last_day = _int_arg('last', first_day + SHOPPING_LIST_DAYS - 1, minimum=first_day,
+                        maximum=first_day + SHOPPING_LIST_MAX_DAYS - 1)
+    return first_day, last_day
+
+# =============================================================================
+# CONDITIONAL GET & STATIC CACHING
+# =============================================================================
+# Meal pages only change on import, and a user's plan and favorites pages only
+# when that user writes to them. Triggers keep a version and a last-modified time
+# for each (see migration 5), so those pages get an ETag built from the versions
+# and a 304 is answered after one primary-key lookup, before any page query or
+# template rendering. Static URLs carry the file's mtime ('?v=...'), so static
+# files can be cached for a long time and still change on deploy; files fetched
+# without a version (e.g. from url() in CSS) only get a short max-age.
+
+def get_data_versions(user_id=None):
+    """
+    Returns the catalog version and, for a user, their plan, favorites and
+    profile (allergies and diet) versions, each with its last-modified time
+    (Unix seconds, 0 if unknown).
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT cv.version AS catalog_version, cv.updated_at AS catalog_updated_at,
+               COALESCE(udv.plan_version, 0) AS plan_version,
+               COALESCE(udv.plan_updated_at, 0) AS plan_updated_at,
+               COALESCE(udv.favorites_version, 0) AS favorites_version,
+               COALESCE(udv.favorites_updated_at, 0) AS favorites_updated_at,
+               COALESCE(udv.profile_version, 0) AS profile_version,
+               COALESCE(udv.profile_updated_at, 0) AS profile_updated_at
+        FROM catalog_version cv
+        LEFT JOIN user_data_versions udv ON udv.user_id = ?
+        WHERE cv.id = 1
+    ''', (user_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def page_validators(name, user_id=None, data=None):
+    """
+    Returns (etag, last_modified) for a cacheable page, or (None, None) if the
+    page should not be validated, e.g. because it will show flashed messages.
+    Meal pages are named 'meal-<id>'. For a page that depends on a user's data
+    pass user_id and data, the data version it depends on ('plan', 'favorites'
+    or 'profile'); data defaults to the page name.
+    """
+    if session.get('_flashes'):
+        return None, None
+    versions = get_data_versions(user_id)
+    if versions is None:
+        return None, None
+    assets = asset_version()
+    parts = [name, f"c{versions['catalog_version']}", f"a{assets}"]
+    timestamps = [versions['catalog_updated_at'], assets]
+    if user_id is not None:
+        data = data or name
+        parts += [f"u{user_id}", f"v{versions[data + '_version']}"]
+        timestamps.append(versions[data + '_updated_at'])
+    last_modified = max(timestamps)
+    return '-'.join(parts), (datetime.fromtimestamp(last_modified, timezone.utc)
+                             if last_modified else None)
+
+def not_modified(etag, last_modified):
+    """
+    Returns a 304 response if the request's If-None-Match / If-Modified-Since
+    headers match the validators, otherwise None.
+    """
+    if etag is None:
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+def with_validators(response, etag, last_modified):
+    """
+    Adds ETag / Last-Modified to a page response. 'private, no-cache' lets the
+    browser keep the page but makes it revalidate on every visit.
+    """
+    response = app.make_response(response)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+def _file_mtime(path):
+    try:
+        return int(os.path.getmtime(path))
+    except OSError:
+        return None
+
+@lru_cache(maxsize=4096)
+def _cached_static_version(static_folder, filename):
+    return _file_mtime(os.path.join(static_folder, filename))
+
+def static_file_version(filename):
+    """
+    Returns the mtime of a file under static/ (cached unless in debug mode),
+    or None if it does not exist.
+    """
+    if app.debug:
+        return _file_mtime(os.path.join(app.static_folder, filename))
+    return _cached_static_version(app.static_folder, filename)
+
+@lru_cache(maxsize=1)
+def _cached_asset_version(*folders):
+    newest = 0
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for name in files:
+                newest = max(newest, _file_mtime(os.path.join(root, name)) or 0)
+    return newest
+
+def asset_version():
+    """
+    Returns the newest mtime among templates and static files, so page ETags
+    change when a deploy changes the markup or the assets it links to.
+    """
+    if app.debug:
+        _cached_asset_version.cache_clear()
+    return _cached_asset_version(os.path.join(app.root_path, app.template_folder),
+                                 app.static_folder)
+
+@app.url_defaults
+def add_static_version(endpoint, values):
+    """Adds '?v=<mtime>' to url_for('static', ...) URLs for cache busting."""
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        version = static_file_version(values['filename'])
+        if version is not None:
+            values['v'] = version
+
+@app.after_request
+def limit_unversioned_static_caching(response):
+    """
+    Static files fetched without '?v=' (e.g. the icons style.css refers to) are
+    only cached for STATIC_UNVERSIONED_MAX_AGE, so an updated file still reaches
+    browsers; versioned URLs keep the long SEND_FILE_MAX_AGE_DEFAULT.
+    """
+    if request.endpoint == 'static' and 'v' not in request.args:
+        response.cache_control.max_age = app.config.get('STATIC_UNVERSIONED_MAX_AGE', 3600)
+    return response
+
+# =============================================================================
+# RESPONSIVE IMAGES
+# =============================================================================
+# Templates build <picture>/srcset markup (see templates/_images.html) from the
+# resized derivatives made by images.py: meal derivatives come from the catalog
+# ('meal_images' table), UI images (logo, icons) from the files on disk. Without
+# derivatives, e.g. when Pillow is not installed, the originals are used.
+
+def request_catalog():
+    """Returns the meal catalog, looked up once per request."""
+    if 'catalog' not in g:
+        g.catalog = get_catalog(get_db(), app.config['DATABASE'])
+    return g.catalog
+
+def image_sources(original, derivatives):
     """
-    user_meals = get_user_meal_plan(user_id)
-    days_dict = defaultdict(list)
-    for row in user_meals:
-        days_dict[row['day']].append(row)
-    for day in sorted(days_dict.keys()):
-        if any(meal_row['status'] not in ['done', 'skipped'] for meal_row in days_dict[day]):
-            return day, days_dict[day]
-    return None, None
+    Returns the URLs templates need for one image: 'src' (the largest non-WebP
+    derivative, or the original), 'srcset', 'webp_src' and 'webp_srcset'.
+    derivatives maps a format to its (width, path) pairs, sorted by width.
+    """
+    def srcset(items):
+        return ', '.join(f"{url_for('static', filename=path)} {width}w" for width, path in items)
+    webp = derivatives.get('webp', [])
+    fallback = next((items for fmt, items in derivatives.items() if fmt != 'webp'), [])
+    return {
+        'src': url_for('static', filename=fallback[-1][1] if fallback else original),
+        'srcset': srcset(fallback),
+        'webp_src': url_for('static', filename=webp[-1][1]) if webp else None,
+        'webp_srcset': srcset(webp),
+    }
+
+@app.template_global()
+def meal_image(meal):
+    """Returns image_sources() for a meal row or dict (needs 'id' and 'identifier')."""
+    catalog_meal = request_catalog().get(meal['id']) or {}
+    original = catalog_meal.get('image') or meal_image_source(meal['identifier'])
+    return image_sources(original, catalog_meal.get('images', {}))
+
+@lru_cache(maxsize=64)
+def _cached_asset_derivatives(static_folder, filename):
+    derivatives = {}
+    for width, fmt, path in existing_derivatives(static_folder, filename,
+                                                 ASSET_IMAGE_WIDTHS.get(filename, ())):
+        derivatives.setdefault(fmt, []).append((width, path))
+    return derivatives
+
+@app.template_global()
+def static_image(filename):
+    """
+    Returns image_sources() for a UI image under static/. Derivatives on disk
+    are looked up once per process (every time in debug mode).
+    """
+    if app.debug:
+        _cached_asset_derivatives.cache_clear()
+    return image_sources(filename, _cached_asset_derivatives(app.static_folder, filename))
 
 # =============================================================================
 # FLASK ROUTES
@@ -350,6 +1025,17 @@ def login():
             return redirect(url_for('login'))
     return render_template('login.html')
 
+def flash_unmatched_preferences(dietary_preferences):
+    """
+    Tells the user which of their dietary preferences do not filter any meals,
+    so a restriction is never dropped without them knowing.
+    """
+    unmatched = unmatched_preferences(dietary_preferences)
+    if unmatched:
+        app.logger.info("Unrecognized dietary preferences for user %s: %s", session.get('user_id'), unmatched)
+        flash(f"We don't recognize {', '.join(repr(p) for p in unmatched)} as a diet, so it does not "
+              "filter your meals. List anything you must avoid under allergies instead.")
+
 @app.route('/personal_info', methods=['GET', 'POST'])
 def personal_info():
     """
@@ -368,7 +1054,7 @@ def personal_info():
         weight_unit = request.form['weight_unit']
         dietary_preferences = request.form.get('dietary_preferences', '')
         allergies = request.form.get('allergies', '')
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute('''
             UPDATE users
@@ -378,8 +1064,8 @@ def personal_info():
         ''', (name, lastname, age, gender, height, height_unit,
               weight, weight_unit, dietary_preferences, allergies, session['user_id']))
         conn.commit()
-        conn.close()
         flash('Personal information updated!')
+        flash_unmatched_preferences(dietary_preferences)
         return redirect(url_for('dashboard'))
     return render_template('personal_info.html')
 
@@ -390,7 +1076,7 @@ def my_account():
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     if request.method == 'POST':
         name = request.form['name']
@@ -412,18 +1098,18 @@ def my_account():
               weight, weight_unit, dietary_preferences, allergies, session['user_id']))
         conn.commit()
         flash('Changes saved!')
+        flash_unmatched_preferences(dietary_preferences)
         return redirect(url_for('my_account'))
     else:
         cursor.execute("SELECT * FROM users WHERE id = ?", (session['user_id'],))
         user = cursor.fetchone()
-        conn.close()
         return render_template('my_account.html', user=user)
 
 @app.route('/meal_plan', methods=['GET', 'POST'])
 def meal_plan():
     """
     Page where user selects a goal, number of meals per day, and plan duration.
-    Generates a new meal plan on submission.
+    Queues generation of a new meal plan on submission (see submit_plan_job).
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -435,30 +1121,44 @@ def meal_plan():
         goals = [goal]
         meals_per_day = request.form.get('meals_per_day')
         duration = int(request.form.get('duration', 1))
-        success = generate_meal_plan(goals, meals_per_day, duration, session['user_id'])
-        if not success:
-            flash('Not enough meals in the database to satisfy your plan.')
-            return redirect(url_for('meal_plan'))
-        return redirect(url_for('review_meal_plan'))
+        job_id = submit_plan_job(session['user_id'], goals, meals_per_day, duration)
+        return redirect(url_for('review_meal_plan', job=job_id))
     return render_template('meal_plan.html')
 
 @app.route('/review_meal_plan', methods=['GET', 'POST'])
 def review_meal_plan():
     """
-    Shows the newly generated meal plan in a table for final review.
-    Users can confirm or return to change meals.
+    Shows the newly generated meal plan for final review, one week at a time
+    (?from=<first day>, see get_plan_week). Users can confirm or return to change
+    meals. With ?job=<id> it shows the job's progress until the plan is ready.
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
     if request.method == 'POST':
         flash('Meal plan confirmed!')
         return redirect(url_for('dashboard'))
-    user_meals = get_user_meal_plan(session['user_id'])
-    days_map = defaultdict(list)
-    for row in user_meals:
-        days_map[row['day']].append(row)
-    days_map = dict(days_map)
-    return render_template('review_meal_plan.html', days_map=days_map)
+    job_id = request.args.get('job', type=int)
+    if job_id is not None:
+        job = get_job(get_db(), job_id, session['user_id'])
+        if job is not None and job['state'] in ('queued', 'running'):
+            return render_template('plan_job.html', job=job)
+        if job is not None and job['state'] == 'failed':
+            flash(job['error'])
+            return redirect(url_for('meal_plan'))
+    etag, last_modified = page_validators('plan', session['user_id'])
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    try:
+        first_day = _int_arg('from', 1, minimum=1)
+    except ValueError:
+        first_day = 1
+    rows, prev_first_day, next_first_day = get_plan_week(session['user_id'], first_day)
+    return with_validators(render_template('review_meal_plan.html',
+                                           week=render_review_week(rows),
+                                           prev_first_day=prev_first_day,
+                                           next_first_day=next_first_day),
+                           etag, last_modified)
 
 @app.route('/dashboard')
 def dashboard():
@@ -476,58 +1176,26 @@ def dashboard():
 @app.route('/meal_details/<int:meal_id>')
 def meal_details(meal_id):
     """
-    Provides detailed instructions, ingredients, and equipment for a specific meal.
+    Provides detailed instructions, ingredients, and equipment for a specific meal,
+    plus a few similar meals.
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM meals WHERE id = ?", (meal_id,))
-    meal_row = cursor.fetchone()
-    conn.close()
-    if not meal_row:
+    # The similar meals shown depend on the user's exclusions, so the page is
+    # validated against their profile version; the exclusions are only loaded
+    # when the page is actually rendered
+    etag, last_modified = page_validators(f'meal-{meal_id}', session['user_id'], 'profile')
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    excluded = get_user_exclusions(get_db(), session['user_id'], request_catalog())
+    meal = get_meal_details(meal_id)
+    if not meal:
         flash("Meal not found.")
         return redirect(url_for('dashboard'))
-    meal = dict(meal_row)
-
-    # Clean up instructions
-    raw_instructions = meal.get('instructions', '') or ''
-    raw_instructions = raw_instructions.replace('\n', '. ')
-    steps_raw = [s.strip() for s in raw_instructions.split('.') if s.strip()]
-    cleaned_steps = []
-    for step in steps_raw:
-        step = re.sub(r'^[\d\(\)]+\.?\s*', '', step)
-        if not step or re.match(r'^\d+$', step):
-            continue
-        step = step[0].upper() + step[1:] if len(step) > 1 else step.upper()
-        cleaned_steps.append(step)
-    meal['instructions_list'] = cleaned_steps
-
-    # Clean up ingredients
-    raw_ingredients = meal.get('ingredients', '') or ''
-    ingredients_raw = [i.strip() for i in raw_ingredients.split(';') if i.strip()]
-    cleaned_ingredients = []
-    for ing in ingredients_raw:
-        ing = re.sub(r'\(.*?\)', '', ing)
-        ing = ing.strip()
-        if ing:
-            ing = ing[0].upper() + ing[1:]
-            cleaned_ingredients.append(ing)
-    meal['ingredients_list'] = cleaned_ingredients
-
-    # Clean up equipment
-    raw_equipment = meal.get('equipment', '') or ''
-    equipment_raw = [e.strip() for e in raw_equipment.split(',') if e.strip()]
-    cleaned_equipment = []
-    for eq in equipment_raw:
-        eq = re.sub(r'\(.*?\)', '', eq)
-        eq = eq.strip()
-        if eq:
-            eq = eq[0].upper() + eq[1:]
-            cleaned_equipment.append(eq)
-    meal['equipment_list'] = cleaned_equipment
-
-    return render_template('meal_details.html', meal=meal)
+    similar_meals = get_similar_meals(meal_id, excluded)
+    return with_validators(render_template('meal_details.html', meal=meal, similar_meals=similar_meals),
+                           etag, last_modified)
 
 @app.route('/skip_meal/<int:meal_id>/<int:day>/<string:meal_type>', methods=['POST'])
 def skip_meal(meal_id, day, meal_type):
@@ -536,15 +1204,7 @@ def skip_meal(meal_id, day, meal_type):
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE user_meals
-        SET status = 'skipped'
-        WHERE meal_id = ? AND user_id = ? AND day = ? AND meal_type = ?
-    ''', (meal_id, session['user_id'], day, meal_type))
-    conn.commit()
-    conn.close()
+    set_meal_status(session['user_id'], day, meal_type, meal_id, 'skipped')
     return redirect(url_for('dashboard'))
 
 @app.route('/done_meal/<int:meal_id>/<int:day>/<string:meal_type>', methods=['POST'])
@@ -554,15 +1214,30 @@ def done_meal(meal_id, day, meal_type):
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE user_meals
-        SET status = 'done'
-        WHERE meal_id = ? AND user_id = ? AND day = ? AND meal_type = ?
-    ''', (meal_id, session['user_id'], day, meal_type))
-    conn.commit()
-    conn.close()
+    set_meal_status(session['user_id'], day, meal_type, meal_id, 'done')
+    return redirect(url_for('dashboard'))
+
+@app.route('/plan_status', methods=['POST'])
+def plan_status():
+    """
+    Sets one status for several planned meals in a single write, e.g. a whole
+    day from the dashboard. Form: 'status' plus one 'meal' field per planned
+    meal, formatted '<day>:<meal_type>:<meal_id>'.
+    """
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    status = request.form.get('status')
+    updates = []
+    for value in request.form.getlist('meal'):
+        try:
+            day, meal_type, meal_id = value.split(':')
+            updates.append((int(day), meal_type, int(meal_id), status))
+        except ValueError:
+            continue
+    if status not in ('done', 'skipped') or not updates:
+        flash("Nothing to update.")
+    else:
+        set_meal_statuses(session['user_id'], updates)
     return redirect(url_for('dashboard'))
 
 @app.route('/change_meal/<int:day>/<string:meal_type>', methods=['GET', 'POST'])
@@ -575,16 +1250,15 @@ def change_meal(day, meal_type):
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT um.*, m.name AS old_meal_name
         FROM user_meals um
         JOIN meals m ON um.meal_id = m.id
-        WHERE um.user_id = ? AND um.day = ? AND um.meal_type = ?
-    ''', (user_id, day, meal_type))
+        WHERE um.user_id = ? AND um.day = ? AND um.slot = ?
+    ''', (user_id, day, SLOT_ORDER.get(meal_type)))
     current_record = cursor.fetchone()
-    conn.close()
 
     if not current_record:
         flash("No meal found for that day/slot.")
@@ -594,22 +1268,10 @@ def change_meal(day, meal_type):
         step = request.form.get('step')
         if step == 'pick_category':
             chosen_category = request.form.get('chosen_category')
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM meals")
-            all_meals = cursor.fetchall()
-            conn.close()
-
-            def normalize_cat_str(cat_str):
-                if not cat_str:
-                    return set()
-                return {c.strip().lower().replace(' ', '_') for c in cat_str.split(';') if c.strip()}
-
-            possible_meals = []
-            for m in all_meals:
-                cat_set = normalize_cat_str(m['categories'])
-                if chosen_category in cat_set:
-                    possible_meals.append(m)
+            catalog = get_catalog(conn, app.config['DATABASE'])
+            candidate_ids = catalog.safe_ids(select_candidate_ids(conn, [chosen_category]),
+                                             get_user_exclusions(conn, user_id, catalog))
+            possible_meals = catalog.get_many(candidate_ids)
 
             return render_template('change_meal_pick_meal.html',
                                    day=day,
@@ -617,22 +1279,33 @@ def change_meal(day, meal_type):
                                    current_record=current_record,
                                    chosen_category=chosen_category,
                                    possible_meals=possible_meals)
+        elif step == 'search':
+            search_query = request.form.get('query', '').strip()
+            catalog = get_catalog(conn, app.config['DATABASE'])
+            found_ids = catalog.safe_ids(search_meal_ids(conn, search_query, limit=100),
+                                         get_user_exclusions(conn, user_id, catalog))
+            possible_meals = catalog.get_many(found_ids)
+            return render_template('change_meal_pick_meal.html',
+                                   day=day,
+                                   meal_type=meal_type,
+                                   current_record=current_record,
+                                   search_query=search_query,
+                                   possible_meals=possible_meals)
         elif step == 'update_meal':
             new_meal_id = request.form.get('new_meal_id')
             if not new_meal_id:
                 flash("Please select a meal.")
                 return redirect(url_for('change_meal', day=day, meal_type=meal_type))
-            conn = get_db_connection()
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE user_meals
                 SET meal_id = ?
-                WHERE user_id = ? AND day = ? AND meal_type = ?
-            ''', (new_meal_id, user_id, day, meal_type))
+                WHERE user_id = ? AND day = ? AND slot = ?
+            ''', (new_meal_id, user_id, day, SLOT_ORDER.get(meal_type)))
             conn.commit()
-            conn.close()
             flash("Meal updated successfully!")
-            return redirect(url_for('review_meal_plan'))
+            week_start = day - (day - 1) % REVIEW_WEEK_DAYS
+            return redirect(url_for('review_meal_plan', **{'from': week_start}))
 
     return render_template('change_meal_pick_category.html',
                            day=day,
@@ -646,7 +1319,11 @@ def favorites():
     """
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    conn = get_db_connection()
+    etag, last_modified = page_validators('favorites', session['user_id'])
+    cached = not_modified(etag, last_modified)
+    if cached is not None:
+        return cached
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT m.* FROM meals m
@@ -654,8 +1331,52 @@ def favorites():
         WHERE f.user_id = ?
     ''', (session['user_id'],))
     fav_meals = cursor.fetchall()
-    conn.close()
-    return render_template('favorites.html', meals=fav_meals)
+    return with_validators(render_template('favorites.html', meals=fav_meals), etag, last_modified)
+
+@app.route('/shopping_list')
+def shopping_list():
+    """
+    Shows the ingredients needed for a day range of the user's plan, summed
+    over its meals, with links to download the list as CSV or text.
+    """
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    try:
+        first_day, last_day = shopping_list_range(session['user_id'])
+    except ValueError:
+        flash("Please enter valid days.")
+        return redirect(url_for('shopping_list'))
+    items = get_shopping_list(session['user_id'], first_day, last_day)
+    return render_template('shopping_list.html', items=items, first_day=first_day,
+                           last_day=last_day, format_quantity=format_quantity)
+
+@app.route('/shopping_list.<any(csv, txt):fmt>')
+def download_shopping_list(fmt):
+    """
+    Streams the shopping list for a day range as a CSV or plain-text download.
+    """
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    try:
+        first_day, last_day = shopping_list_range(session['user_id'])
+    except ValueError:
+        return api_error("first and last must be integers", 400)
+    items = get_shopping_list(session['user_id'], first_day, last_day)
+    if fmt == 'csv':
+        body, mimetype = iter_csv(items), 'text/csv'
+    else:
+        body, mimetype = iter_text(items, f"FitMate shopping list, days {first_day}-{last_day}"), 'text/plain'
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="shopping-list-days-{first_day}-{last_day}.{fmt}"')
+    return response
+
+@app.route('/cache_stats')
+def cache_stats():
+    """
+    Returns cache hit/miss counts as JSON, for monitoring.
+    """
+    return {'meal_details': meal_details_cache_stats()}
 
 @app.route('/logout')
 def logout():
@@ -666,15 +1387,398 @@ def logout():
     flash('Logged out successfully!')
     return redirect(url_for('index'))
 
+# =============================================================================
+# JSON API
+# =============================================================================
+# A JSON counterpart of the plan, dashboard, favorites and catalog pages for
+# clients that update their own UI (one small request instead of a POST,
+# redirect and full page render). It uses the same session login as the HTML
+# routes. Plan items only carry meal ids; the meals they reference are sent
+# once per response in a 'meals' map, built from the in-memory catalog.
+
+API_PLAN_DAYS = 7           # default number of days returned by /api/plan
+API_MAX_PLAN_DAYS = 31
+API_PAGE_SIZE = 50          # default page size of /api/meals
+API_MAX_PAGE_SIZE = 200
+API_MAX_SEARCH_OFFSET = 1000  # search results are for browsing, not for dumping the catalog
+API_IMAGE_WIDTH = 320       # preferred width of the meal image URL
+
+def api_error(message, status):
+    """Returns a JSON error response."""
+    return {'error': message}, status
+
+def _int_arg(name, default, minimum=None, maximum=None):
+    """
+    Reads an integer query argument, clamped to [minimum, maximum].
+    Raises ValueError if it is not an integer.
+    """
+    value = request.args.get(name)
+    value = default if value in (None, '') else int(value)
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+def api_image_url(meal):
+    """
+    Returns the URL of a catalog meal's image: the smallest WebP (or fallback)
+    derivative at least API_IMAGE_WIDTH wide, or the original.
+    """
+    for fmt in ('webp', 'jpeg', 'png'):
+        derivatives = meal['images'].get(fmt)
+        if derivatives:
+            path = next((p for w, p in derivatives if w >= API_IMAGE_WIDTH), derivatives[-1][1])
+            return url_for('static', filename=path)
+    return url_for('static', filename=meal['image'] or meal_image_source(meal['identifier']))
+
+def api_meal(meal):
+    """The fields of a catalog meal that the API exposes."""
+    return {'name': meal['name'], 'type': meal['type_key'],
+            'prep_time': meal['prep_time'], 'image': api_image_url(meal)}
+
+def api_meals_map(meal_ids):
+    """Returns {meal id: api_meal()} for the given ids (as JSON object keys)."""
+    catalog = request_catalog()
+    meals = {}
+    for meal_id in meal_ids:
+        meal = catalog.get(meal_id)
+        if meal is not None and str(meal_id) not in meals:
+            meals[str(meal_id)] = api_meal(meal)
+    return meals
+
+def get_plan_items(user_id, first_day, last_day):
+    """
+    Returns the plan rows of a day range (day, slot, meal_id, status code),
+    ordered by day and slot. A range scan of the user_meals primary key; meal
+    details come from the catalog instead of a join.
+    """
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT day, slot, meal_id, status
+        FROM user_meals
+        WHERE user_id = ? AND day BETWEEN ? AND ?
+        ORDER BY day, slot
+    ''', (user_id, first_day, last_day))
+    return cursor.fetchall()
+
+def get_current_day(user_id):
+    """Returns the user's earliest day with pending meals, or None."""
+    row = get_db().execute("SELECT current_day FROM user_progress WHERE user_id = ?",
+                           (user_id,)).fetchone()
+    return row['current_day'] if row else None
+
+def api_plan_items(rows):
+    return [{'slot': r['slot'], 'type': SLOT_NAMES.get(r['slot']), 'meal': r['meal_id'],
+             'status': STATUS_NAMES.get(r['status'])} for r in rows]
+
+@app.route('/api/plan')
+def api_plan():
+    """
+    Returns the user's plan for days 'from'..'to' (default: a week from day 1):
+    {"days": [{"day": 1, "items": [...]}, ...], "meals": {id: {...}}}
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    try:
+        first_day = _int_arg('from', 1, minimum=1)
+        last_day = _int_arg('to', first_day + API_PLAN_DAYS - 1, minimum=first_day,
+                            maximum=first_day + API_MAX_PLAN_DAYS - 1)
+    except ValueError:
+        return api_error("'from' and 'to' must be integers", 400)
+    rows = get_plan_items(session['user_id'], first_day, last_day)
+    days = {}
+    for row in rows:
+        days.setdefault(row['day'], []).append(row)
+    return {'from': first_day, 'to': last_day,
+            'days': [{'day': day, 'items': api_plan_items(day_rows)} for day, day_rows in days.items()],
+            'meals': api_meals_map(row['meal_id'] for row in rows)}
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    """
+    Returns the current (earliest incomplete) day: {"day": 3, "items": [...], "meals": {...}}.
+    "day" is null once the whole plan is done.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    day = get_current_day(session['user_id'])
+    rows = get_plan_items(session['user_id'], day, day) if day is not None else []
+    return {'day': day, 'items': api_plan_items(rows),
+            'meals': api_meals_map(row['meal_id'] for row in rows)}
+
+@app.route('/api/plan/<int:day>/<string:meal_type>/status', methods=['POST'])
+def api_set_status(day, meal_type):
+    """
+    Marks a planned meal done or skipped. Body: {"meal": <id>, "status": "done"|"skipped"}.
+    Returns the new status and the user's current day, so the client does not
+    need to reload the dashboard.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    payload = request.get_json(silent=True) or {}
+    status = payload.get('status')
+    if status not in ('done', 'skipped') or not isinstance(payload.get('meal'), int):
+        return api_error("expected {\"meal\": <id>, \"status\": \"done\" or \"skipped\"}", 400)
+    if not set_meal_status(session['user_id'], day, meal_type, payload['meal'], status):
+        return api_error('meal not found in plan', 404)
+    return {'day': day, 'type': meal_type, 'meal': payload['meal'], 'status': status,
+            'current_day': get_current_day(session['user_id'])}
+
+API_MAX_STATUS_UPDATES = 500
+
+@app.route('/api/plan/status', methods=['POST'])
+def api_set_statuses():
+    """
+    Sets the status of many planned meals in one transaction.
+    Body: {"updates": [{"day": 1, "type": "Lunch", "status": "done"|"skipped"|"pending",
+    "meal": <id, optional>}, ...]}. Returns {"found": [true, ...], "current_day": ...},
+    one entry per update telling whether that meal was in the plan.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('updates')
+    if not isinstance(items, list) or not 0 < len(items) <= API_MAX_STATUS_UPDATES:
+        return api_error(f"expected {{\"updates\": [...]}} with 1 to {API_MAX_STATUS_UPDATES} items", 400)
+    updates = []
+    for item in items:
+        if (not isinstance(item, dict) or not isinstance(item.get('day'), int)
+                or item.get('type') not in SLOT_ORDER or item.get('status') not in STATUSES
+                or not isinstance(item.get('meal', 0), int)):
+            return api_error('each update needs an integer "day", a "type" (Breakfast, Lunch or Dinner) '
+                             'and a "status" (pending, done or skipped)', 400)
+        updates.append((item['day'], item['type'], item.get('meal'), item['status']))
+    found = set_meal_statuses(session['user_id'], updates)
+    return {'found': found, 'current_day': get_current_day(session['user_id'])}
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    """
+    Returns the state ('queued', 'running', 'done' or 'failed') and progress
+    (0.0 to 1.0) of one of the user's background jobs.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    job = get_job(get_db(), job_id, session['user_id'])
+    if job is None:
+        return api_error('job not found', 404)
+    return {'id': job['id'], 'kind': job['kind'], 'state': job['state'],
+            'progress': job['progress'], 'error': job['error']}
+
+@app.route('/api/plan/history')
+def api_plan_history():
+    """
+    Streams the user's archived (replaced or finished) plans as JSON lines,
+    oldest first, one plan per line (see plan_archive.iter_archived_plans).
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    user_id = session['user_id']
+
+    def lines():
+        # Its own connection: the stream outlives the request's connection
+        conn = get_db_connection()
+        try:
+            yield from iter_export_lines(conn, user_id)
+        finally:
+            conn.close()
+    return Response(lines(), mimetype='application/x-ndjson')
+
+@app.route('/api/favorites')
+def api_favorites():
+    """Returns the user's favorite meal ids and their details: {"favorites": [...], "meals": {...}}."""
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    cursor = get_db().cursor()
+    cursor.execute("SELECT meal_id FROM favorites WHERE user_id = ? ORDER BY meal_id",
+                   (session['user_id'],))
+    meal_ids = [row['meal_id'] for row in cursor.fetchall()]
+    return {'favorites': meal_ids, 'meals': api_meals_map(meal_ids)}
+
+@app.route('/api/favorites/<int:meal_id>', methods=['PUT', 'DELETE'])
+def api_favorite(meal_id):
+    """Adds (PUT) or removes (DELETE) a favorite. Both are idempotent."""
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    if request.method == 'PUT':
+        if request_catalog().get(meal_id) is None:
+            return api_error('meal not found', 404)
+        add_favorite(session['user_id'], meal_id)
+    else:
+        remove_favorite(session['user_id'], meal_id)
+    return {'meal': meal_id, 'favorite': request.method == 'PUT'}
+
+@app.route('/api/search')
+def api_search():
+    """
+    Ranked full-text search over meal names, ingredients and equipment, every
+    word matching as a prefix: ?q=chick ric, optionally with 'type' and
+    'category'. Pass the returned 'next' as 'offset' to get the next page.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    try:
+        offset = _int_arg('offset', 0, minimum=0, maximum=API_MAX_SEARCH_OFFSET)
+        limit = _int_arg('limit', API_PAGE_SIZE, minimum=1, maximum=API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("'offset' and 'limit' must be integers", 400)
+    meal_ids = search_meal_ids(get_db(), request.args.get('q', ''),
+                               meal_type=request.args.get('type') or None,
+                               category=request.args.get('category') or None,
+                               limit=limit + 1, offset=offset)
+    catalog = request_catalog()
+    meals = [dict(api_meal(meal), id=meal['id']) for meal in catalog.get_many(meal_ids[:limit])]
+    return {'meals': meals, 'next': offset + limit if len(meal_ids) > limit else None}
+
+@app.route('/api/meals')
+def api_meals():
+    """
+    Browses the catalog by id with keyset pagination, optionally filtered by
+    'category' and 'type'. Pass the returned 'next' as 'after' to get the next
+    page; it is null on the last page. Served from the in-memory catalog.
+    """
+    if 'user_id' not in session:
+        return api_error('login required', 401)
+    try:
+        after = _int_arg('after', 0)
+        limit = _int_arg('limit', API_PAGE_SIZE, minimum=1, maximum=API_MAX_PAGE_SIZE)
+    except ValueError:
+        return api_error("'after' and 'limit' must be integers", 400)
+    catalog = request_catalog()
+    category = request.args.get('category')
+    meal_type = (request.args.get('type') or '').strip().lower() or None
+    if category:
+        ids = catalog.candidate_ids([category], meal_type)
+    elif meal_type:
+        ids = catalog.by_type.get(meal_type, [])
+    else:
+        ids = catalog.ids
+    start = bisect_right(ids, after)
+    page = ids[start:start + limit]
+    has_more = start + limit < len(ids)
+    return {'meals': [dict(api_meal(catalog.get(i)), id=i) for i in page],
+            'next': page[-1] if page and has_more else None}
+
+# =============================================================================
+# APP CONFIGURATION & WARM-UP
+# =============================================================================
+# Routes are registered on the module-level 'app', so there is one app per
+# process; configure_app() configures it from environment variables and warms it
+# up, so both the development server and a pre-forking WSGI server (see wsgi.py)
+# start from the same place. It is not a factory: calling it again reconfigures
+# the same app, with settings from earlier calls left in place unless overridden.
+
+# Defaults for every setting configure_app() understands. Each one can be overridden
+# with an environment variable of the same name prefixed by 'FITMATE_'
+# (e.g. FITMATE_DATABASE=/var/lib/fitmate/fitmate.db, FITMATE_WARM_UP=false).
+DEFAULT_CONFIG = {
+    'DATABASE': DATABASE,
+    'SECRET_KEY': app.secret_key,
+    'WARM_UP': True,
+    'TEMPLATES_AUTO_RELOAD': False,
+    'SLOW_QUERY_MS': None,           # e.g. 50 to log statements slower than 50 ms
+    'PROFILE_ROUTES': [],            # endpoint names, e.g. ["dashboard", "meal_plan"]
+    'PROFILE_SAMPLE_RATE': 0.0,      # fraction of requests to PROFILE_ROUTES to profile
+    'PROFILE_DIR': 'profiles',
+    'SEND_FILE_MAX_AGE_DEFAULT': 365 * 24 * 3600,  # static/ URLs are versioned, see add_static_version
+    'STATIC_UNVERSIONED_MAX_AGE': 3600,  # static files referenced without '?v=', e.g. from CSS
+    'STATUS_BATCH_MS': 0,            # for many concurrent writers: max ms a click waits to share a write (0: off)
+    'JOB_WORKERS': 2,                # background plan generation threads per process
+}
+
+# Timestamps (time.time()) and durations in seconds, per worker process
+startup_timings = {
+    'worker_started_at': time.time(),
+    'warm_up_seconds': None,
+    'ready_at': None,
+    'first_request_at': None,
+    'time_to_first_request_seconds': None,
+}
+
+def mark_worker_started():
+    """
+    Resets the worker start time. Call it right after a pre-forking server forks
+    a worker, so time-to-first-request is measured per worker.
+    """
+    startup_timings['worker_started_at'] = time.time()
+    startup_timings['first_request_at'] = None
+    startup_timings['time_to_first_request_seconds'] = None
+
+@app.before_request
+def record_first_request():
+    """Records when this worker served its first request."""
+    if startup_timings['first_request_at'] is None:
+        now = time.time()
+        startup_timings['first_request_at'] = now
+        startup_timings['time_to_first_request_seconds'] = now - startup_timings['worker_started_at']
+
+def warm_up(flask_app):
+    """
+    Prepares a worker before its first request: runs migrations, loads the meal
+    catalog, opens (and tunes) a DB connection, and compiles every template.
+    Connections are closed again afterwards so none are shared across a fork.
+    """
+    started = time.perf_counter()
+    with flask_app.app_context():
+        create_tables()
+        get_catalog(get_db(), flask_app.config['DATABASE'])
+        for name in flask_app.jinja_env.list_templates():
+            flask_app.jinja_env.get_template(name)
+    close_thread_connections()
+    startup_timings['warm_up_seconds'] = time.perf_counter() - started
+    flask_app.logger.info("FitMate warm-up took %.3fs", startup_timings['warm_up_seconds'])
+
+def configure_app(test_config=None):
+    """
+    Configures and returns the module-level Flask app (not a new one).
+    Settings come from DEFAULT_CONFIG, then FITMATE_* environment variables,
+    then the optional test_config mapping.
+    """
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_prefixed_env('FITMATE')
+    if test_config:
+        app.config.from_mapping(test_config)
+    app.jinja_env.auto_reload = app.config['TEMPLATES_AUTO_RELOAD']
+    metrics.init_app(app)
+    if app.config['WARM_UP']:
+        warm_up(app)
+    startup_timings['ready_at'] = time.time()
+    return app
+
+@app.route('/server_stats')
+def server_stats():
+    """
+    Returns startup timings of this worker as JSON, for monitoring.
+    """
+    return {'startup': startup_timings}
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Exposes request, SQL, cache and startup metrics in the Prometheus text format.
+    """
+    cache = meal_details_cache_stats()
+    extra = metrics.render_gauges(
+        'fitmate_cache_events', 'Cache hits and misses since the worker started.',
+        {(('cache', 'meal_details'), ('result', 'hit')): cache['hits'],
+         (('cache', 'meal_details'), ('result', 'miss')): cache['misses']})
+    extra += metrics.render_gauges(
+        'fitmate_startup_seconds', 'Worker warm-up time and time to its first request.',
+        {(('phase', 'warm_up'),): startup_timings['warm_up_seconds'],
+         (('phase', 'first_request'),): startup_timings['time_to_first_request_seconds']})
+    return Response(metrics.render_prometheus(extra), mimetype='text/plain; version=0.0.4')
+
 # =============================================================================
 # APPLICATION ENTRY POINT
 # =============================================================================
 def main():
     """
     Main entry point to create tables and run the Flask development server.
+    The development server runs in debug mode unless FITMATE_DEBUG says otherwise.
     """
-    create_tables()
-    app.run(debug=True)
+    flask_app = configure_app()
+    flask_app.run(debug=flask_app.config['DEBUG'] if 'FITMATE_DEBUG' in os.environ else True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
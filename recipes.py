@@ -0,0 +1,192 @@
+# recipes.py
+# Parsing of the free-text recipe columns of 'meals' (instructions, ingredients,
+# equipment) into the cleaned lists shown on the meal details page.
+import re
+
+from allergens import normalize_word
+
+# Patterns are compiled once at import time
+STEP_NUMBER_RE = re.compile(r'^[\d\(\)]+\.?\s*')
+DIGITS_ONLY_RE = re.compile(r'^\d+$')
+PARENTHESES_RE = re.compile(r'\(.*?\)')
+
+def _capitalize(text):
+    """Uppercases the first character only."""
+    return text[0].upper() + text[1:] if len(text) > 1 else text.upper()
+
+def parse_instructions(raw_instructions):
+    """
+    Splits instructions into sentences, drops step numbers like '1.' or '(2)',
+    and capitalizes each step.
+    """
+    raw_instructions = (raw_instructions or '').replace('\n', '. ')
+    steps_raw = [s.strip() for s in raw_instructions.split('.') if s.strip()]
+    cleaned_steps = []
+    for step in steps_raw:
+        step = STEP_NUMBER_RE.sub('', step)
+        if not step or DIGITS_ONLY_RE.match(step):
+            continue
+        cleaned_steps.append(_capitalize(step))
+    return cleaned_steps
+
+def _parse_list(raw_text, separator):
+    """Splits on a separator, removes '(...)' notes, and capitalizes each item."""
+    cleaned = []
+    for item in (raw_text or '').split(separator):
+        item = PARENTHESES_RE.sub('', item.strip()).strip()
+        if item:
+            cleaned.append(_capitalize(item))
+    return cleaned
+
+def parse_ingredients(raw_ingredients):
+    """Returns the ';'-separated ingredients as a cleaned list."""
+    return _parse_list(raw_ingredients, ';')
+
+def parse_equipment(raw_equipment):
+    """Returns the ','-separated equipment as a cleaned list."""
+    return _parse_list(raw_equipment, ',')
+
+def parse_meal_details(meal):
+    """
+    Returns a copy of a meal row/dict with 'instructions_list',
+    'ingredients_list' and 'equipment_list' added.
+    """
+    meal = dict(meal)
+    meal['instructions_list'] = parse_instructions(meal.get('instructions'))
+    meal['ingredients_list'] = parse_ingredients(meal.get('ingredients'))
+    meal['equipment_list'] = parse_equipment(meal.get('equipment'))
+    return meal
+
+# =============================================================================
+# INGREDIENT ENTRIES
+# =============================================================================
+# Ingredients like '2 garlic cloves (minced)' or '150 g diced cucumber' are
+# parsed once, at import, into (name, quantity, unit) rows of 'meal_ingredients',
+# so shopping lists can be summed in SQL instead of re-parsing text per request.
+
+QUANTITY_RE = re.compile(
+    r'^(?P<quantity>\d+\s+\d+/\d+|\d+/\d+|\d+(?:[.,]\d+)?|[½¼¾⅓⅔])'
+    r'(?:\s*[-–]\s*(?P<upper>\d+(?:[.,]\d+)?))?\s*(?P<rest>.*)$')
+UNIT_RE = re.compile(r'^(?P<unit>[a-z]+)\.?(?:\s+of)?\b\s*(?P<rest>.*)$')
+FRACTIONS = {'½': 0.5, '¼': 0.25, '¾': 0.75, '⅓': 1 / 3, '⅔': 2 / 3}
+# Unit spellings -> (unit, factor to that unit)
+UNITS = {
+    'g': ('g', 1), 'gram': ('g', 1), 'grams': ('g', 1), 'kg': ('g', 1000),
+    'ml': ('ml', 1), 'l': ('ml', 1000), 'liter': ('ml', 1000), 'litre': ('ml', 1000),
+    'tbsp': ('tbsp', 1), 'tablespoon': ('tbsp', 1), 'tablespoons': ('tbsp', 1),
+    'tsp': ('tsp', 1), 'teaspoon': ('tsp', 1), 'teaspoons': ('tsp', 1),
+    'cup': ('cup', 1), 'cups': ('cup', 1), 'oz': ('oz', 1), 'lb': ('lb', 1),
+    'slice': ('slice', 1), 'slices': ('slice', 1), 'clove': ('clove', 1), 'cloves': ('clove', 1),
+    'can': ('can', 1), 'cans': ('can', 1), 'pinch': ('pinch', 1), 'scoop': ('scoop', 1),
+    'scoops': ('scoop', 1), 'handful': ('handful', 1),
+}
+# Count nouns written after the ingredient ('2 garlic cloves')
+TRAILING_UNITS = {'clove': 'clove', 'cloves': 'clove', 'slice': 'slice', 'slices': 'slice'}
+# Preparation and size words that do not change what to buy
+PREPARATION_WORDS = {
+    'diced', 'sliced', 'chopped', 'minced', 'grated', 'crumbled', 'shredded', 'cubed',
+    'fresh', 'large', 'small', 'medium', 'ripe', 'finely', 'thinly', 'roughly', 'halved',
+    'whole',
+}
+# 'toppings: 20 g fruit, 10 g granola' lists several entries under a label
+LABEL_RE = re.compile(r'^[a-z ]+:\s*')
+SPACES_RE = re.compile(r'\s+')  # includes narrow no-break spaces
+
+def _number(text):
+    if text in FRACTIONS:
+        return FRACTIONS[text]
+    if ' ' in text:
+        whole, fraction = text.split()
+        return int(whole) + _number(fraction)
+    if '/' in text:
+        numerator, denominator = text.split('/')
+        return int(numerator) / int(denominator) if int(denominator) else None
+    return float(text.replace(',', '.'))
+
+def parse_ingredient_entry(item):
+    """
+    Splits one ingredient entry into (name, quantity, unit): '2 garlic cloves
+    (minced)' -> ('garlic', 2.0, 'clove'); '1 kg potatoes' -> ('potato', 1000.0, 'g').
+    quantity is None for entries without an amount ('salt and pepper'); unit is
+    '' for plain counts ('1 banana'). Returns None for an empty entry.
+    """
+    text = SPACES_RE.sub(' ', PARENTHESES_RE.sub('', item or '')).strip().lower()
+    if not text:
+        return None
+    quantity, unit = None, ''
+    match = QUANTITY_RE.match(text)
+    if match:
+        quantity = _number(match.group('upper') or match.group('quantity'))
+        text = match.group('rest')
+    match = UNIT_RE.match(text)
+    if match and match.group('unit') in UNITS and match.group('rest'):
+        unit, factor = UNITS[match.group('unit')]
+        text = match.group('rest')
+        quantity = (quantity if quantity is not None else 1) * factor
+    text = text.split(',')[0].removeprefix('of ').strip()
+    words = [w for w in text.split() if w not in PREPARATION_WORDS]
+    if not unit and len(words) > 1 and words[-1] in TRAILING_UNITS:
+        unit = TRAILING_UNITS[words.pop()]
+    if words:
+        words[-1] = normalize_word(words[-1])
+    name = ' '.join(words) or text
+    return name, quantity, unit
+
+def parse_ingredient_entries(raw_ingredients):
+    """
+    Parses the ';'-separated ingredients of a meal into (name, quantity, unit)
+    entries. Entries joined with '+' and labelled lists ('toppings: a, b') are
+    split into their parts.
+    """
+    entries = []
+    for item in (raw_ingredients or '').split(';'):
+        item = SPACES_RE.sub(' ', PARENTHESES_RE.sub('', item)).strip().lower()
+        labelled = LABEL_RE.match(item)
+        if labelled:
+            parts = item[labelled.end():].replace('+', ',').split(',')
+        else:
+            parts = item.split('+')
+        entries.extend(entry for entry in map(parse_ingredient_entry, parts) if entry)
+    return entries
+
+def create_meal_ingredients(cursor):
+    """Creates 'meal_ingredients': the parsed ingredient entries of each meal, in order."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meal_ingredients (
+            meal_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            quantity REAL,
+            unit TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (meal_id, position),
+            FOREIGN KEY (meal_id) REFERENCES meals(id)
+        ) WITHOUT ROWID
+    ''')
+
+def refresh_meal_ingredients(cursor, meal_ids=None):
+    """
+    Re-parses the ingredients of the given meals (all meals if None) into
+    'meal_ingredients'. Runs inside the caller's transaction. Returns the
+    number of meals written.
+    """
+    if meal_ids is None:
+        rows = cursor.execute("SELECT id, ingredients FROM meals").fetchall()
+    else:
+        meal_ids = list(meal_ids)
+        rows = []
+        for start in range(0, len(meal_ids), 500):
+            chunk = meal_ids[start:start + 500]
+            rows += cursor.execute(
+                f"SELECT id, ingredients FROM meals WHERE id IN ({', '.join('?' for _ in chunk)})",
+                chunk).fetchall()
+    cursor.executemany("DELETE FROM meal_ingredients WHERE meal_id = ?",
+                       [(meal_id,) for meal_id, _ in rows])
+    entries = []
+    for meal_id, ingredients in rows:
+        entries.extend((meal_id, position, *entry)
+                       for position, entry in enumerate(parse_ingredient_entries(ingredients)))
+    cursor.executemany('''
+        INSERT INTO meal_ingredients (meal_id, position, name, quantity, unit)
+        VALUES (?, ?, ?, ?, ?)
+    ''', entries)
+    return len(rows)
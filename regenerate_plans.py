@@ -0,0 +1,294 @@
+# regenerate_plans.py
+# Batch tool that regenerates (or extends) the meal plans of many users, e.g.
+# after the catalog changed. Plans are built in a pool of worker processes from
+# one catalog snapshot taken at start-up; the main process is the only writer
+# and commits one chunk of users per transaction. Each chunk also records its
+# users under a run id, so an interrupted run continues where it stopped:
+#
+#   python regenerate_plans.py --all
+#   python regenerate_plans.py --all --run-id 20250301-101500     # resume
+#   python regenerate_plans.py --users 1-500,812 --extend 7
+#   python regenerate_plans.py --all --dry-run --workers 8          # throughput only
+#
+# A user's plan is rebuilt from the goals, meals per day and duration saved when
+# it was last generated (user_plan_settings); --goals, --meals-per-day and
+# --duration override them. Plans respect each user's allergies and diet and
+# lean towards their favorites, as plans generated on the site do.
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+import project
+from catalog import MealCatalog, get_catalog, safe_flags
+from migrations import get_schema_version, latest_schema_version
+from plan_archive import archive_plan
+from planner import (SLOT_MEAL_TYPES, SLOT_ORDER, build_scored_plan, prep_budget_for,
+                     slots_for)
+from similarity import favorite_affinities
+
+CHUNK_SIZE = 500   # users per worker task and per write transaction
+
+# =============================================================================
+# SELECTION
+# =============================================================================
+
+def parse_user_ids(spec):
+    """Parses a user id list like '1-500,812,900-910' into a sorted list of ids."""
+    user_ids = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = (int(x) for x in part.split('-', 1))
+            user_ids.update(range(first, last + 1))
+        else:
+            user_ids.add(int(part))
+    return sorted(user_ids)
+
+def load_tasks(conn, user_ids=None, goals=None, meals_per_day=None, duration=None,
+               extend=None, seed=None, skip=(), catalog=None):
+    """
+    Returns (tasks, skipped): one task tuple per user to plan, and the ids of users
+    without enough settings to plan for. user_ids=None selects every user with
+    saved settings. Users in 'skip' (already done by this run) are left out.
+    A task is (user_id, goals, meals_per_day, days, first_day, seed, excluded,
+    affinity, history), where 'excluded' holds the feature bits the user's allergies
+    and diet rule out (compiled against 'catalog'; empty without one), 'affinity'
+    the user's (meal_id, affinity) pairs from favorites (see favorite_affinity) and
+    'history' the (day, meal_id) rows of the plan being extended (empty otherwise).
+    """
+    settings = {row['user_id']: row for row in conn.execute(
+        "SELECT user_id, goals, meals_per_day, duration FROM user_plan_settings")}
+    restrictions = {}
+    if catalog is not None:
+        restrictions = {row['id']: (row['allergies'], row['dietary_preferences']) for row in conn.execute(
+            "SELECT id, allergies, dietary_preferences FROM users "
+            "WHERE allergies <> '' OR dietary_preferences <> ''")}
+    affinities = favorite_affinities(conn)
+    if user_ids is None:
+        user_ids = sorted(settings)
+    histories = {}
+    if extend:
+        for user_id, day, meal_id in conn.execute(
+                "SELECT user_id, day, meal_id FROM user_meals ORDER BY user_id, day, slot"):
+            histories.setdefault(user_id, []).append((day, meal_id))
+
+    tasks, skipped = [], []
+    skip = set(skip)
+    for user_id in user_ids:
+        if user_id in skip:
+            continue
+        saved = settings.get(user_id)
+        user_goals = goals or (saved['goals'].split(';') if saved else None)
+        user_meals_per_day = meals_per_day or (saved['meals_per_day'] if saved else None)
+        user_duration = duration or (saved['duration'] if saved else None)
+        if not user_goals or not user_meals_per_day or not user_duration:
+            skipped.append(user_id)
+            continue
+        user_seed = f"{seed}:{user_id}" if seed is not None else None
+        excluded = catalog.exclusions(*restrictions[user_id]) if user_id in restrictions else frozenset()
+        affinity = tuple(sorted(affinities.get(user_id, {}).items()))
+        if extend:
+            history = tuple(histories.get(user_id, ()))
+            first_day = (history[-1][0] if history else 0) + 1
+            tasks.append((user_id, tuple(user_goals), user_meals_per_day, extend, first_day,
+                          user_seed, excluded, affinity, history))
+        else:
+            tasks.append((user_id, tuple(user_goals), user_meals_per_day, user_duration, 1,
+                          user_seed, excluded, affinity, ()))
+    return tasks, skipped
+
+# =============================================================================
+# PLANNING (worker processes)
+# =============================================================================
+
+# The catalog snapshot, set in each worker by _init_worker
+_snapshot = {}
+
+def _init_worker(plan_arrays, feature_bits, has_features):
+    _snapshot['plan_arrays'] = plan_arrays
+    _snapshot['feature_bits'] = feature_bits
+    _snapshot['has_features'] = has_features
+    _snapshot['candidates'] = {}
+
+def _candidate_rows(goals, excluded):
+    """Returns {meal type: candidate rows} for a goal combination and exclusions."""
+    arrays = _snapshot['plan_arrays']
+    safe = None
+    if excluded:
+        safe = safe_flags(_snapshot['feature_bits'], _snapshot['has_features'], excluded)
+    return {meal_type: arrays.candidate_rows(goals, meal_type, safe)
+            for meal_type in set(SLOT_MEAL_TYPES.values())}
+
+def plan_chunk(tasks):
+    """
+    Builds the plans of one chunk of tasks from the worker's catalog snapshot.
+    Returns a list of (task, plan rows or None if the plan cannot be filled).
+    Plan rows are (day, slot name, meal_id), already shifted to the task's first day;
+    an extension continues from the task's history (see build_scored_plan).
+    """
+    results = []
+    for task in tasks:
+        user_id, goals, meals_per_day, days, first_day, seed, excluded, affinity, history = task
+        # Users mostly share a handful of goal and restriction combinations,
+        # so cache their candidates
+        rows_by_type = _snapshot['candidates'].get((goals, excluded))
+        if rows_by_type is None:
+            rows_by_type = _candidate_rows(goals, excluded)
+            _snapshot['candidates'][(goals, excluded)] = rows_by_type
+        arrays = _snapshot['plan_arrays']
+        plan = build_scored_plan(arrays, rows_by_type, slots_for(meals_per_day), days, seed=seed,
+                                 prep_budget=prep_budget_for(goals),
+                                 preference=arrays.affinity_weights(dict(affinity)),
+                                 history=history)
+        if plan is not None and first_day != 1:
+            plan = [(day + first_day - 1, slot, meal_id) for day, slot, meal_id in plan]
+        results.append((task, plan))
+    return results
+
+# =============================================================================
+# WRITING (main process)
+# =============================================================================
+
+def write_chunk(conn, results, run_id, extend=False):
+    """
+    Writes one chunk of plans in a single transaction: archives and replaces
+    (or, when extending, appends to) each plan, rebuilds its progress rows, saves its
+    settings, and records the users as done for run_id. Returns the plan rows written.
+    """
+    rows_written = 0
+    with conn:
+        for (user_id, goals, meals_per_day, days, first_day, *_), plan in results:
+            if plan is None:
+                continue
+            if not extend:
+                archive_plan(conn, user_id)
+            conn.executemany('''
+                INSERT INTO user_meals (user_id, day, slot, meal_id)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, day, SLOT_ORDER[slot], meal_id) for day, slot, meal_id in plan])
+            project.reset_plan_progress(conn, user_id)
+            project.save_plan_settings(conn, user_id, goals, meals_per_day, first_day + days - 1)
+            rows_written += len(plan)
+        conn.executemany("INSERT OR IGNORE INTO plan_regeneration_progress (run_id, user_id) VALUES (?, ?)",
+                         [(run_id, task[0]) for task, _ in results])
+    return rows_written
+
+def regenerate_plans(database, user_ids=None, goals=None, meals_per_day=None, duration=None,
+                     extend=None, seed=None, run_id=None, workers=1, chunk_size=CHUNK_SIZE,
+                     dry_run=False, progress=print):
+    """
+    Regenerates (or extends by 'extend' days) the plans of the selected users.
+    Users a previous run with the same run_id already finished are skipped, and a
+    completed run's checkpoints are removed. With dry_run nothing is written, and
+    a database whose schema is not up to date raises RuntimeError.
+    Returns a dict of counts and throughput.
+    """
+    started = time.perf_counter()
+    project.app.config['DATABASE'] = database
+    if dry_run:
+        # A dry run does not even upgrade the schema, so it must already be current
+        conn = project.get_db_connection()
+        version = get_schema_version(conn)
+        if version != latest_schema_version():
+            conn.close()
+            raise RuntimeError(f"database schema is at version {version}, not "
+                               f"{latest_schema_version()}; run without --dry-run to upgrade it")
+    else:
+        project.create_tables()
+        conn = project.get_db_connection()
+
+    run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+    done = [row[0] for row in conn.execute(
+        "SELECT user_id FROM plan_regeneration_progress WHERE run_id = ?", (run_id,))]
+    # The shared catalog may write a new snapshot file; a dry run reads the tables
+    catalog = MealCatalog.load(conn, database) if dry_run else get_catalog(conn, database)
+    tasks, skipped = load_tasks(conn, user_ids, goals, meals_per_day, duration,
+                                extend, seed, skip=done, catalog=catalog)
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    stats = {'run_id': run_id, 'users': len(tasks), 'already_done': len(done),
+             'no_settings': len(skipped), 'planned': 0, 'unfillable': 0, 'rows': 0,
+             'catalog_version': catalog.version, 'dry_run': dry_run}
+    progress(f"Run {run_id}: {len(tasks)} users to plan ({len(done)} already done, "
+             f"{len(skipped)} without plan settings), catalog version {catalog.version}.")
+
+    snapshot = (catalog.plan_arrays, catalog.feature_bits, catalog.has_features)
+    if workers == 1:
+        _init_worker(*snapshot)
+        results_iter = map(plan_chunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=snapshot)
+        results_iter = pool.imap(plan_chunk, chunks)
+    try:
+        for number, results in enumerate(results_iter, 1):
+            planned = sum(1 for _, plan in results if plan is not None)
+            stats['planned'] += planned
+            stats['unfillable'] += len(results) - planned
+            if dry_run:
+                stats['rows'] += sum(len(plan) for _, plan in results if plan is not None)
+            else:
+                stats['rows'] += write_chunk(conn, results, run_id, extend=bool(extend))
+            elapsed = time.perf_counter() - started
+            users_done = stats['planned'] + stats['unfillable']
+            progress(f"[{number}/{len(chunks)}] {users_done}/{len(tasks)} users, "
+                     f"{users_done / elapsed:.0f} users/s, {stats['rows'] / elapsed:.0f} rows/s")
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if not dry_run:
+        # Checkpoints only matter for resuming; a finished run drops its own
+        with conn:
+            conn.execute("DELETE FROM plan_regeneration_progress WHERE run_id = ?", (run_id,))
+    project.close_thread_connections()
+    conn.close()
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['users_per_second'] = (stats['planned'] + stats['unfillable']) / stats['seconds']
+    stats['rows_per_second'] = stats['rows'] / stats['seconds']
+    return stats
+
+def main(argv=None):
+    """Command-line entry point. Returns 1 if some plans could not be filled, else 0."""
+    parser = argparse.ArgumentParser(description="Regenerate or extend FitMate meal plans in bulk.")
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--users', help="user ids, e.g. '1-500,812'")
+    selection.add_argument('--all', action='store_true', help="every user with saved plan settings")
+    parser.add_argument('--goals', help="';'-separated goals to use instead of the saved ones")
+    parser.add_argument('--meals-per-day', help="e.g. 'All 3' or 'Lunch & Dinner' (overrides saved)")
+    parser.add_argument('--duration', type=int, help="plan length in days (overrides saved)")
+    parser.add_argument('--extend', type=int, metavar='DAYS',
+                        help="append DAYS days to each plan instead of replacing it")
+    parser.add_argument('--seed', type=int, help="base seed for reproducible plans")
+    parser.add_argument('--run-id', help="resume the run with this id")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="planning processes (default: one per CPU)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="users per task and per write transaction")
+    parser.add_argument('--dry-run', action='store_true', help="build plans but write nothing")
+    parser.add_argument('--db', default=project.DATABASE)
+    args = parser.parse_args(argv)
+
+    try:
+        stats = regenerate_plans(
+            args.db,
+            user_ids=parse_user_ids(args.users) if args.users else None,
+            goals=[g.strip() for g in (args.goals or '').split(';') if g.strip()] or None,
+            meals_per_day=args.meals_per_day, duration=args.duration, extend=args.extend,
+            seed=args.seed, run_id=args.run_id, workers=max(1, args.workers),
+            chunk_size=max(1, args.chunk_size), dry_run=args.dry_run)
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(f"{'Dry run' if stats['dry_run'] else 'Run'} {stats['run_id']}: "
+          f"{stats['planned']} plans ({stats['rows']} rows) in {stats['seconds']:.2f}s, "
+          f"{stats['users_per_second']:.0f} users/s, {stats['rows_per_second']:.0f} rows/s. "
+          f"{stats['unfillable']} could not be filled, {stats['no_settings']} had no settings.")
+    return 1 if stats['unfillable'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
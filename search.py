@@ -0,0 +1,105 @@
+# search.py
+# Full-text meal search. 'meals_fts' is an FTS5 index over the name, ingredients
+# and equipment of every meal. It is an external-content table: it stores only
+# the index and reads the text from 'meals', and triggers on 'meals' keep it in
+# sync with every write (the importer's upserts included). Results are ranked
+# with BM25, name matches weighing most.
+import re
+
+from categories import normalize_category
+
+# BM25 weights of the indexed columns: name, ingredients, equipment
+RANK_WEIGHTS = (10.0, 3.0, 1.0)
+
+# Words of a search box query; everything else (FTS5 operators, quotes) is dropped
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_QUERY_WORDS = 8
+
+def create_meal_search(cursor):
+    """
+    Creates the 'meals_fts' index and its sync triggers, and indexes every
+    existing meal. Prefix indexes for 2 and 3 characters keep short
+    search-as-you-type prefixes fast.
+    """
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS meals_fts USING fts5(
+            name, ingredients, equipment,
+            content='meals', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        INSERT INTO meals_fts (meals_fts, rank)
+        VALUES ('rank', 'bm25({", ".join(str(w) for w in RANK_WEIGHTS)})')
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_insert AFTER INSERT ON meals
+        BEGIN
+            INSERT INTO meals_fts (rowid, name, ingredients, equipment)
+            VALUES (NEW.id, NEW.name, NEW.ingredients, NEW.equipment);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_delete AFTER DELETE ON meals
+        BEGIN
+            INSERT INTO meals_fts (meals_fts, rowid, name, ingredients, equipment)
+            VALUES ('delete', OLD.id, OLD.name, OLD.ingredients, OLD.equipment);
+        END
+    ''')
+    # Only the indexed columns, so e.g. setting meals.image does not reindex
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS meals_fts_update
+        AFTER UPDATE OF name, ingredients, equipment ON meals
+        BEGIN
+            INSERT INTO meals_fts (meals_fts, rowid, name, ingredients, equipment)
+            VALUES ('delete', OLD.id, OLD.name, OLD.ingredients, OLD.equipment);
+            INSERT INTO meals_fts (rowid, name, ingredients, equipment)
+            VALUES (NEW.id, NEW.name, NEW.ingredients, NEW.equipment);
+        END
+    ''')
+    cursor.execute("INSERT INTO meals_fts (meals_fts) VALUES ('rebuild')")
+
+def optimize_meal_search(conn):
+    """
+    Merges the index's segments into one. Worth running after bulk writes
+    such as an import; the triggers leave one small segment per transaction.
+    """
+    with conn:
+        conn.execute("INSERT INTO meals_fts (meals_fts) VALUES ('optimize')")
+
+def build_match_query(text):
+    """
+    Turns search box text into an FTS5 query in which every word must match
+    as a prefix ('chick ric' finds 'chicken rice'). Returns None if the text
+    has no words.
+    """
+    words = WORD_RE.findall(text or '')[:MAX_QUERY_WORDS]
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_meal_ids(conn, text, meal_type=None, category=None, limit=20, offset=0):
+    """
+    Returns the ids of meals matching the search text, best match first,
+    optionally restricted to a meal type and a category key.
+    """
+    query = build_match_query(text)
+    if query is None:
+        return []
+    joins, conditions, params = '', ['meals_fts MATCH ?'], [query]
+    if meal_type is not None:
+        joins = 'JOIN meals m ON m.id = meals_fts.rowid'
+        conditions.append('lower(m.type) = ?')
+        params.append(meal_type.strip().lower())
+    if category is not None:
+        conditions.append('''EXISTS (SELECT 1 FROM meal_categories mc
+                                     WHERE mc.meal_id = meals_fts.rowid AND mc.category = ?)''')
+        params.append(normalize_category(category))
+    cursor = conn.execute(f'''
+        SELECT meals_fts.rowid FROM meals_fts {joins}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank, meals_fts.rowid
+        LIMIT ? OFFSET ?
+    ''', params + [limit, offset])
+    return [row[0] for row in cursor.fetchall()]
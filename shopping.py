@@ -0,0 +1,54 @@
+# shopping.py
+# Shopping lists for a day range of a user's plan. The ingredient entries of
+# every meal are parsed once at import (see recipes.parse_ingredient_entries and
+# 'meal_ingredients'), so a list is one aggregate query: quantities are summed
+# per ingredient name and unit over the planned (not skipped) meals.
+import csv
+import io
+
+from planner import STATUS_CODES
+
+SHOPPING_LIST_COLUMNS = ('ingredient', 'quantity', 'unit', 'meals')
+
+def build_shopping_list(conn, user_id, first_day, last_day):
+    """
+    Returns the shopping list for days first_day..last_day of a user's plan as a
+    list of (ingredient, quantity, unit, meals) tuples sorted by ingredient.
+    quantity is None for ingredients without an amount ('salt and pepper');
+    meals is the number of planned meals that use the ingredient.
+    """
+    cursor = conn.execute('''
+        SELECT mi.name, SUM(mi.quantity), mi.unit, COUNT(*)
+        FROM user_meals um
+        JOIN meal_ingredients mi ON mi.meal_id = um.meal_id
+        WHERE um.user_id = ? AND um.day BETWEEN ? AND ? AND um.status <> ?
+        GROUP BY mi.name, mi.unit
+        ORDER BY mi.name, mi.unit
+    ''', (user_id, first_day, last_day, STATUS_CODES['skipped']))
+    return [tuple(row) for row in cursor.fetchall()]
+
+def format_quantity(quantity):
+    """Formats a summed quantity without needless decimals ('150', '1.5', '' for None)."""
+    if quantity is None:
+        return ''
+    return f"{quantity:.2f}".rstrip('0').rstrip('.')
+
+def iter_csv(items):
+    """Yields the shopping list as CSV, one line per chunk (header first)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SHOPPING_LIST_COLUMNS)
+    for name, quantity, unit, meals in items:
+        writer.writerow((name, format_quantity(quantity), unit, meals))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()  # header of an empty list
+
+def iter_text(items, title):
+    """Yields the shopping list as plain text: a title line, then one line per ingredient."""
+    yield f"{title}\n\n"
+    for name, quantity, unit, _ in items:
+        amount = ' '.join(part for part in (format_quantity(quantity), unit) if part)
+        yield f"- {name}{f' ({amount})' if amount else ''}\n"
@@ -0,0 +1,240 @@
+# similarity.py
+# Item-to-item meal similarity. Every meal keeps its NEIGHBORS_K most similar
+# meals of the same type in 'meal_neighbors' (a sparse top-k table, one row per
+# meal and rank), so a request reads a meal's neighbours with one primary-key
+# range seek. Similarity is a weighted Jaccard index over the meal's categories
+# and its ingredient features (see allergens.py), computed blockwise with NumPy
+# on the packed bitsets, so memory stays bounded by the block size.
+# The table is built by a migration and updated incrementally by the importer:
+# only changed meals, and the meals whose lists they enter or leave, are recomputed.
+import numpy as np
+
+from catalog import feature_matrix
+
+NEIGHBORS_K = 12
+MIN_SCORE = 0.05            # pairs less similar than this are not stored
+CATEGORY_SHARE = 0.4        # weight of category overlap; ingredients get the rest
+BLOCK_ROWS = 256            # meals scored per NumPy block...
+BLOCK_COLUMNS = 2048        # ...against this many meals at a time (a block's
+                            # temporaries take about 40 bytes per pair, 20 MB)
+# Above this share of changed meals a full rebuild of the type is cheaper
+FULL_REBUILD_SHARE = 0.25
+
+def create_meal_neighbors(cursor):
+    """Creates the 'meal_neighbors' table and its reverse-lookup index."""
+    cursor.execute('''
+        CREATE TABLE meal_neighbors (
+            meal_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (meal_id, rank)
+        ) WITHOUT ROWID
+    ''')
+    # Which lists a meal appears in, for incremental updates
+    cursor.execute("CREATE INDEX idx_meal_neighbors_neighbor ON meal_neighbors (neighbor_id)")
+
+# =============================================================================
+# SCORING
+# =============================================================================
+
+# Set bits per byte value, for NumPy versions without np.bitwise_count
+_BYTE_BITS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+def _popcount(words):
+    """Returns the number of set bits of each uint64 in 'words'."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return _BYTE_BITS[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+class _TypeVectors:
+    """Category and ingredient sets of every meal of one type, as packed uint64 bitsets."""
+
+    def __init__(self, ids, categories, features):
+        self.ids = np.array(ids, dtype=np.int64)
+        self.positions = {meal_id: row for row, meal_id in enumerate(ids)}
+        cats = sorted({c for keys in categories.values() for c in keys})
+        column = {c: col for col, c in enumerate(cats)}
+        self.categories = np.zeros((len(ids), max((len(cats) + 63) // 64, 1)), dtype=np.uint64)
+        for row, meal_id in enumerate(ids):
+            for c in categories.get(meal_id, ()):
+                self.categories[row, column[c] // 64] |= np.uint64(1 << (column[c] % 64))
+        self.ingredients, _ = feature_matrix(ids, features)
+        self.category_sizes = _popcount(self.categories).sum(axis=1, dtype=np.float32)
+        self.ingredient_sizes = _popcount(self.ingredients).sum(axis=1, dtype=np.float32)
+
+    def score_blocks(self, rows):
+        """
+        Yields (first column, block) pairs covering the similarity matrix of the
+        given rows to every meal, BLOCK_COLUMNS meals per block.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        for start in range(0, len(self.ids), BLOCK_COLUMNS):
+            stop = min(start + BLOCK_COLUMNS, len(self.ids))
+            total = np.zeros((len(rows), stop - start), dtype=np.float32)
+            for words, sizes, share in ((self.categories, self.category_sizes, CATEGORY_SHARE),
+                                        (self.ingredients, self.ingredient_sizes, 1 - CATEGORY_SHARE)):
+                # Jaccard index |a & b| / |a | b| one word at a time (empty sets score 0)
+                counts = np.zeros(total.shape, dtype=np.uint16)
+                for word in range(words.shape[1]):
+                    counts += _popcount(words[rows, word, None] & words[None, start:stop, word])
+                overlap = counts.astype(np.float32)
+                union = sizes[rows, None] + sizes[None, start:stop]
+                union -= overlap
+                np.maximum(union, 1.0, out=union)
+                overlap *= share
+                overlap /= union
+                total += overlap
+            # A meal is not its own neighbour
+            own = np.flatnonzero((rows >= start) & (rows < stop))
+            total[own, rows[own] - start] = 0.0
+            yield start, total
+
+    def top_neighbors(self, rows, k=NEIGHBORS_K):
+        """Yields (meal_id, [(neighbor_id, score), ...]) for the given rows, best first."""
+        rows = np.asarray(rows, dtype=np.intp)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            # The k best so far of each row, merged with every block of columns
+            best = np.full((len(block), k), -1.0, dtype=np.float32)
+            best_columns = np.full((len(block), k), -1, dtype=np.intp)
+            for first, scores in self.score_blocks(block):
+                scores = np.concatenate([best, scores], axis=1)
+                columns = np.concatenate(
+                    [best_columns, np.broadcast_to(np.arange(first, first + scores.shape[1] - k),
+                                                   (len(block), scores.shape[1] - k))], axis=1)
+                top = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+                best = np.take_along_axis(scores, top, axis=1)
+                best_columns = np.take_along_axis(columns, top, axis=1)
+            for i, row in enumerate(block):
+                ranked = sorted(((float(best[i, c]), int(best_columns[i, c])) for c in range(k)),
+                                key=lambda pair: (-pair[0], pair[1]))
+                yield int(self.ids[row]), [(int(self.ids[c]), score) for score, c in ranked
+                                           if score >= MIN_SCORE]
+
+def _load_vectors(cursor, meal_type):
+    """Loads the _TypeVectors of one meal type from meals, meal_categories and meal_features."""
+    ids = [row[0] for row in cursor.execute(
+        "SELECT id FROM meals WHERE LOWER(TRIM(type)) = ? ORDER BY id", (meal_type,))]
+    categories = {}
+    features = {}
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        marks = ', '.join('?' for _ in chunk)
+        for meal_id, category in cursor.execute(
+                f"SELECT meal_id, category FROM meal_categories WHERE meal_id IN ({marks})", chunk):
+            categories.setdefault(meal_id, set()).add(category)
+        features.update(cursor.execute(
+            f"SELECT meal_id, bits FROM meal_features WHERE meal_id IN ({marks})", chunk).fetchall())
+    return _TypeVectors(ids, categories, features)
+
+def _write_neighbors(cursor, lists):
+    """Replaces the stored neighbour lists of the meals in {meal_id: [(neighbor_id, score)]}."""
+    cursor.executemany("DELETE FROM meal_neighbors WHERE meal_id = ?", [(m,) for m in lists])
+    cursor.executemany(
+        "INSERT INTO meal_neighbors (meal_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?)",
+        [(meal_id, rank, neighbor_id, score)
+         for meal_id, neighbors in lists.items()
+         for rank, (neighbor_id, score) in enumerate(neighbors)])
+
+# =============================================================================
+# BUILDING
+# =============================================================================
+
+def refresh_meal_neighbors(cursor, meal_ids=None):
+    """
+    Rebuilds neighbour lists after the given meals were added, edited or deleted
+    (all meals if None). Runs inside the caller's transaction. Besides the changed
+    meals, only the lists a changed meal drops out of or now belongs in are
+    recomputed. Returns the number of lists written.
+    """
+    meal_types = [row[0] for row in cursor.execute(
+        "SELECT DISTINCT LOWER(TRIM(type)) FROM meals WHERE type IS NOT NULL")]
+    if meal_ids is None:
+        cursor.execute("DELETE FROM meal_neighbors")
+        written = 0
+        for meal_type in meal_types:
+            vectors = _load_vectors(cursor, meal_type)
+            lists = dict(vectors.top_neighbors(np.arange(len(vectors.ids))))
+            _write_neighbors(cursor, lists)
+            written += len(lists)
+        return written
+
+    changed = sorted(set(meal_ids))
+    if not changed:
+        return 0
+    # Lists that contain a changed meal must be recomputed whatever its new scores
+    stale = set()
+    for start in range(0, len(changed), 500):
+        chunk = changed[start:start + 500]
+        marks = ', '.join('?' for _ in chunk)
+        stale.update(row[0] for row in cursor.execute(
+            f"SELECT meal_id FROM meal_neighbors WHERE neighbor_id IN ({marks})", chunk))
+        cursor.execute(f"DELETE FROM meal_neighbors WHERE meal_id IN ({marks})", chunk)
+    written = 0
+    for meal_type in meal_types:
+        vectors = _load_vectors(cursor, meal_type)
+        changed_rows = [vectors.positions[m] for m in changed if m in vectors.positions]
+        if len(changed_rows) > FULL_REBUILD_SHARE * len(vectors.ids):
+            rows = np.arange(len(vectors.ids))
+        else:
+            redo = {vectors.positions[m] for m in stale if m in vectors.positions}
+            if changed_rows:
+                # A changed meal enters a list if it beats that list's weakest entry
+                weakest = np.zeros(len(vectors.ids), dtype=np.float32)
+                for meal_id, count, low in cursor.execute('''
+                    SELECT meal_id, COUNT(*), MIN(score) FROM meal_neighbors GROUP BY meal_id
+                '''):
+                    row = vectors.positions.get(meal_id)
+                    if row is not None and count >= NEIGHBORS_K:
+                        weakest[row] = low
+                threshold = np.maximum(weakest, MIN_SCORE)
+                for start in range(0, len(changed_rows), BLOCK_ROWS):
+                    block = changed_rows[start:start + BLOCK_ROWS]
+                    for first, scores in vectors.score_blocks(block):
+                        entering = (scores >= threshold[first:first + scores.shape[1]]).any(axis=0)
+                        redo.update((first + np.flatnonzero(entering)).tolist())
+                redo.update(changed_rows)
+            rows = np.array(sorted(redo), dtype=np.intp)
+        lists = dict(vectors.top_neighbors(rows))
+        _write_neighbors(cursor, lists)
+        written += len(lists)
+    return written
+
+# =============================================================================
+# READING
+# =============================================================================
+
+def get_neighbors(conn, meal_id, limit=NEIGHBORS_K):
+    """Returns [(neighbor_id, score), ...] of a meal, most similar first."""
+    return [tuple(row) for row in conn.execute('''
+        SELECT neighbor_id, score FROM meal_neighbors
+        WHERE meal_id = ? AND rank < ?
+        ORDER BY rank
+    ''', (meal_id, limit))]
+
+def favorite_affinity(conn, user_id):
+    """
+    Returns {meal_id: affinity} for a user: 1.0 for favorites, and for meals
+    similar to a favorite their best similarity score to one.
+    """
+    return favorite_affinities(conn, user_id).get(user_id, {})
+
+def favorite_affinities(conn, user_id=None):
+    """
+    Returns {user_id: {meal_id: affinity}} (see favorite_affinity) for every
+    user with favorites, or for one user, in a single query.
+    """
+    where, params = ('WHERE f.user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    affinities = {}
+    for owner, meal_id, score in conn.execute(f'''
+        SELECT f.user_id, f.meal_id, 1.0 FROM favorites f {where}
+        UNION ALL
+        SELECT f.user_id, n.neighbor_id, n.score
+        FROM favorites f
+        JOIN meal_neighbors n ON n.meal_id = f.meal_id
+        {where}
+    ''', params * 2):
+        affinity = affinities.setdefault(owner, {})
+        affinity[meal_id] = max(affinity.get(meal_id, 0.0), score)
+    return affinities
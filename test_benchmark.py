@@ -0,0 +1,37 @@
+"""
+test_benchmark.py
+Uses pytest to test the benchmark helpers in benchmark.py:
+- generate_synthetic_data builds plans the app can read
+- compare_results flags only real slowdowns
+"""
+
+import sqlite3
+from benchmark import compare_results, generate_synthetic_data, summarize
+
+def test_generate_synthetic_data(tmp_path):
+    """
+    Synthetic users get full plans, progress rows and favorites.
+    """
+    import project
+    saved_database = project.app.config['DATABASE']
+    try:
+        counts = generate_synthetic_data(str(tmp_path / "bench.db"), meals=60, users=5, plan_days=6)
+    finally:
+        project.app.config['DATABASE'] = saved_database
+    assert counts == {'meals': 60, 'users': 5, 'user_meals': 5 * 6 * 3, 'favorites': 25}
+
+    conn = sqlite3.connect(str(tmp_path / "bench.db"))
+    current_days = {r[0] for r in conn.execute("SELECT current_day FROM user_progress")}
+    conn.close()
+    assert current_days == {3}  # first third of the plan is already done
+
+def test_compare_results_flags_regressions():
+    """
+    Only benchmarks slower than the threshold (and above the noise floor) are reported.
+    """
+    baseline = {'a': summarize([0.010]), 'b': summarize([0.010]), 'c': summarize([0.00001])}
+    current = {'a': summarize([0.011]), 'b': summarize([0.020]), 'c': summarize([0.00003]),
+               'new': summarize([1.0])}
+    regressions = compare_results(baseline, current, threshold=0.2)
+    assert [r[0] for r in regressions] == ['b']
+    assert round(regressions[0][3], 1) == 2.0
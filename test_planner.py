@@ -0,0 +1,111 @@
+"""
+test_planner.py
+Uses pytest to test the meal plan engine in planner.py:
+- build_plan keeps the no-repeat guarantees
+- build_plan is reproducible with a seed
+- build_plan fails when a slot cannot be filled
+- build_scored_plan respects overnight, prep-time and variety scoring
+- favorites (and meals similar to them) are drawn more often
+- a plan continuing an existing one counts its meals as used
+"""
+
+from planner import PlanArrays, build_plan, build_scored_plan, slot_meal_types, slots_for
+
+def test_build_plan_no_repeats_until_pool_exhausted():
+    """
+    With 10 lunch/dinner meals and 2 such slots per day, the first 5 days
+    use every meal once; after that meals repeat, but never within a day.
+    """
+    ids_by_type = {'breakfast': list(range(100, 110)), 'lunch/dinner': list(range(10))}
+    plan = build_plan(ids_by_type, slots_for('All 3'), 20, seed=1)
+    assert len(plan) == 60
+
+    mains = [meal_id for day, slot, meal_id in plan if slot != 'Breakfast']
+    assert sorted(mains[:10]) == list(range(10))
+    for day in range(1, 21):
+        day_ids = [meal_id for d, _, meal_id in plan if d == day]
+        assert len(day_ids) == len(set(day_ids))
+    assert all(meal_id >= 100 for _, slot, meal_id in plan if slot == 'Breakfast')
+
+def test_build_plan_is_reproducible_with_seed():
+    """
+    The same seed gives the same plan; a different seed (almost surely) does not.
+    """
+    ids_by_type = {'breakfast': list(range(50)), 'lunch/dinner': list(range(50, 150))}
+    first = build_plan(ids_by_type, slots_for('All 3'), 90, seed=42)
+    second = build_plan(ids_by_type, slots_for('All 3'), 90, seed=42)
+    other = build_plan(ids_by_type, slots_for('All 3'), 90, seed=7)
+    assert first == second
+    assert first != other
+
+def test_build_plan_fails_when_slot_cannot_be_filled():
+    """
+    Two lunch/dinner slots per day need at least two distinct meals.
+    """
+    assert build_plan({'lunch/dinner': [1]}, slots_for('Lunch & Dinner'), 1) is None
+    assert build_plan({'lunch/dinner': [1, 2]}, slots_for('Breakfast'), 1) is None
+    assert build_plan({'lunch/dinner': [1, 2]}, slots_for('Lunch & Dinner'), 3) is not None
+
+def test_build_scored_plan_constraints():
+    """
+    Overnight meals never land on consecutive days, a prep-time budget favors
+    quick meals, and candidates come from the vectorized category/type masks.
+    """
+    meals = []
+    for i in range(60):
+        meals.append({'id': i, 'type_key': 'breakfast', 'category_set': {'keto'},
+                      'prep_time': 5 if i % 2 else 40, 'overnight': i < 30})
+        meals.append({'id': 100 + i, 'type_key': 'lunch/dinner',
+                      'category_set': {'keto', 'vegan' if i % 3 else 'low_fat'},
+                      'prep_time': 10 if i % 2 else 50, 'overnight': False})
+    meals.append({'id': 500, 'type_key': 'lunch/dinner', 'category_set': {'gain_weight'},
+                  'prep_time': 5, 'overnight': False})
+    arrays = PlanArrays.from_meals(sorted(meals, key=lambda m: m['id']))
+    slots = slots_for('All 3')
+    rows_by_type = {t: arrays.candidate_rows(['Keto'], t) for t in slot_meal_types(slots)}
+    assert len(rows_by_type['breakfast']) == 60 and len(rows_by_type['lunch/dinner']) == 60
+
+    plan = build_scored_plan(arrays, rows_by_type, slots, 28, seed=5, prep_budget=30)
+    assert plan == build_scored_plan(arrays, rows_by_type, slots, 28, seed=5, prep_budget=30)
+    by_id = {m['id']: m for m in meals}
+    assert 500 not in {meal_id for _, _, meal_id in plan}
+    overnight_days = sorted({day for day, _, meal_id in plan if by_id[meal_id]['overnight']})
+    assert all(b - a > 1 for a, b in zip(overnight_days, overnight_days[1:]))
+
+    # Two weeks fit in the 30 quick meals of each type before anything repeats
+    budgeted = build_scored_plan(arrays, rows_by_type, slots, 14, seed=5, prep_budget=30)
+    unbudgeted = build_scored_plan(arrays, rows_by_type, slots, 14, seed=5)
+    quick = sum(1 for _, _, meal_id in budgeted if by_id[meal_id]['prep_time'] <= 10)
+    assert quick > len(budgeted) * 0.8
+    assert sum(1 for _, _, meal_id in unbudgeted if by_id[meal_id]['prep_time'] <= 10) < quick
+
+def test_affinity_weights_bias_plans_toward_favorites():
+    """
+    A favorite (affinity 1.0) is drawn about three times as often as other
+    meals; ids missing from the arrays are ignored.
+    """
+    arrays = PlanArrays.from_ids({'lunch/dinner': list(range(1, 21))})
+    weights = arrays.affinity_weights({5: 1.0, 7: 0.5, 999: 1.0})
+    assert weights[arrays.rows_for_ids([5, 7, 6])].tolist() == [3.0, 2.0, 1.0]
+    assert arrays.affinity_weights({}) is None
+
+    rows = {'lunch/dinner': arrays.rows_for_ids(list(range(1, 21)))}
+    picks = [build_scored_plan(arrays, rows, ['Lunch'], 1, seed=seed, preference=weights)[0][2]
+             for seed in range(400)]
+    assert picks.count(5) > 2 * 400 / 20
+    assert picks.count(5) > picks.count(7) > picks.count(6)
+
+def test_build_scored_plan_continues_a_history():
+    """
+    Meals of the plan being extended count as used, and when every meal has
+    been used the previous day's meals are still avoided on the first new day.
+    """
+    arrays = PlanArrays.from_ids({'lunch/dinner': list(range(1, 7))})
+    rows = {'lunch/dinner': arrays.rows_for_ids(list(range(1, 7)))}
+    slots = slots_for('Lunch & Dinner')
+    history = [(1, 1), (1, 2), (2, 3), (2, 4)]
+    for seed in range(50):
+        plan = build_scored_plan(arrays, rows, slots, 1, seed=seed, history=history)
+        assert {meal_id for _, _, meal_id in plan} == {5, 6}
+        plan = build_scored_plan(arrays, rows, slots, 1, seed=seed, history=history + [(3, 5), (3, 6)])
+        assert not {meal_id for _, _, meal_id in plan} & {5, 6}
@@ -9,8 +9,11 @@ These tests assume you have a valid database setup. In a real-world
 scenario, you might use a separate test database or mock your DB calls.
 """
 
+import os
 import pytest
+import re
 import sqlite3
+import sys
 from project import (
     register_user,
     verify_user,
@@ -95,4 +98,1050 @@ def test_add_favorite(setup_db):
 
     # Attempting to add the same favorite again should fail
     second_fav_result = add_favorite(user_id, meal_id)
-    assert second_fav_result is False, "Expected add_favorite to fail for duplicate entry"
\ No newline at end of file
+    assert second_fav_result is False, "Expected add_favorite to fail for duplicate entry"
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """
+    Fixture that points project.py at a fresh, empty database file
+    so tests can insert meals and plans without touching the real DB.
+    """
+    import project
+    monkeypatch.setitem(project.app.config, "DATABASE", str(tmp_path / "fitmate_test.db"))
+    create_tables()
+    yield project
+    project.close_thread_connections()
+
+def insert_meal(conn, meal_type, name, identifier, categories, prep_time=10, ingredients=None):
+    """Helper to insert one meal (with its category, feature and ingredient rows) and return its id."""
+    from allergens import refresh_meal_features
+    from catalog import replace_meal_categories
+    from recipes import refresh_meal_ingredients
+    cursor = conn.execute('''
+        INSERT INTO meals (type, name, identifier, categories, prep_time, overnight, ingredients)
+        VALUES (?, ?, ?, ?, ?, 0, ?)
+    ''', (meal_type, name, identifier, categories, prep_time, ingredients))
+    meal_id = cursor.lastrowid
+    replace_meal_categories(cursor, meal_id, categories)
+    refresh_meal_features(cursor, [meal_id])
+    refresh_meal_ingredients(cursor, [meal_id])
+    conn.commit()
+    return meal_id
+
+def test_catalog_indexes(temp_db):
+    """
+    The catalog indexes meals by normalized category, type, and category x type.
+    """
+    from catalog import get_catalog
+    conn = get_db_connection()
+    oats = insert_meal(conn, "Breakfast", "Oats", "oat", "lose_weight; vegan")
+    salad = insert_meal(conn, "lunch/dinner", "Salad", "sal", "Lose Weight")
+    steak = insert_meal(conn, "lunch/dinner", "Steak", "stk", "gain_muscle")
+    catalog = get_catalog(conn, temp_db.app.config["DATABASE"])
+    conn.close()
+
+    assert catalog.candidate_ids(["lose_weight"]) == [oats, salad]
+    assert catalog.candidate_ids(["lose_weight"], "breakfast") == [oats]
+    assert catalog.candidate_ids(["lose_weight", "gain_muscle"], "lunch/dinner") == [salad, steak]
+    assert catalog.by_type["breakfast"] == [oats]
+
+def test_catalog_reloads_after_meals_change(temp_db):
+    """
+    Inserting into 'meals' bumps the catalog version, so the cached catalog is rebuilt.
+    """
+    from catalog import get_catalog
+    conn = get_db_connection()
+    insert_meal(conn, "Breakfast", "Oats", "oat", "vegan")
+    first = get_catalog(conn, temp_db.app.config["DATABASE"])
+    assert get_catalog(conn, temp_db.app.config["DATABASE"]) is first
+
+    insert_meal(conn, "Breakfast", "Tofu Scramble", "tof", "vegan")
+    second = get_catalog(conn, temp_db.app.config["DATABASE"])
+    conn.close()
+    assert second is not first
+    assert len(second.candidate_ids(["vegan"])) == 2
+
+def test_catalog_snapshot_is_shared_and_replaced_atomically(temp_db):
+    """
+    The catalog is compiled into a snapshot file next to the database that
+    workers map read-only; a newer snapshot replaces it without disturbing
+    catalogs still mapped from the old file, and stale snapshots are ignored.
+    """
+    from catalog import get_catalog, invalidate_catalog, load_catalog, open_snapshot, snapshot_path
+    database = temp_db.app.config["DATABASE"]
+    path = snapshot_path(database)
+    conn = get_db_connection()
+    oats = insert_meal(conn, "Breakfast", "Oats", "oat", "vegan", ingredients="oats; peanut butter")
+    catalog = get_catalog(conn, database)
+    assert catalog.snapshot_path == path and os.path.exists(path)
+    assert not catalog.feature_bits.flags.writeable  # pages of the mapped file
+    assert catalog.get(oats)["name"] == "Oats" and catalog.by_type["breakfast"] == [oats]
+    assert catalog.safe_ids([oats], catalog.exclusions("peanuts")) == []
+
+    # Another worker maps the same file instead of reading the tables
+    other = open_snapshot(path, database)
+    assert other.stamp == catalog.stamp and other.ids == [oats]
+
+    # An import writes the new snapshot; workers switch to it on their next lookup
+    tofu = insert_meal(conn, "Breakfast", "Tofu Scramble", "tof", "vegan")
+    written = load_catalog(conn, database)
+    assert written.snapshot_path == path and written.ids == [oats, tofu]
+    assert get_catalog(conn, database).ids == [oats, tofu]
+    assert catalog.get(oats)["name"] == "Oats" and catalog.ids == [oats]
+
+    # A snapshot of other catalog data (e.g. a recreated database) is not used
+    conn.execute("UPDATE catalog_version SET updated_at = updated_at + 1")
+    conn.commit()
+    invalidate_catalog()
+    reloaded = get_catalog(conn, database)
+    conn.close()
+    assert reloaded.stamp != written.stamp and reloaded.stamp == open_snapshot(path).stamp
+
+def test_generate_meal_plan_uses_goal_candidates(temp_db):
+    """
+    A generated plan only contains meals from the chosen goal, with no repeats in a day.
+    """
+    conn = get_db_connection()
+    for i in range(3):
+        insert_meal(conn, "Breakfast", f"Breakfast {i}", f"b{i}", "keto")
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "keto")
+    insert_meal(conn, "lunch/dinner", "Pasta", "pas", "gain_weight")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('plan', 'x')").lastrowid
+    conn.commit()
+
+    assert temp_db.generate_meal_plan(["keto"], "All 3", 2, user_id) is True
+    rows = conn.execute('''
+        SELECT um.day, m.identifier, m.categories FROM user_meals um
+        JOIN meals m ON um.meal_id = m.id WHERE um.user_id = ?
+    ''', (user_id,)).fetchall()
+    conn.close()
+    assert len(rows) == 6
+    assert all(r['categories'] == "keto" for r in rows)
+    for day in (1, 2):
+        day_ids = [r['identifier'] for r in rows if r['day'] == day]
+        assert len(day_ids) == len(set(day_ids))
+
+def test_meal_categories_backfill_and_select(temp_db):
+    """
+    Meals inserted without join rows are backfilled, and select_candidate_ids
+    filters by category and type with the join table.
+    """
+    from catalog import backfill_meal_categories, select_candidate_ids
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT INTO meals (type, name, identifier, categories)
+        VALUES ('Breakfast', 'Oats', 'oat', 'Low Carb; vegan; not_a_category')
+    ''')
+    conn.execute('''
+        INSERT INTO meals (type, name, identifier, categories)
+        VALUES ('lunch/dinner', 'Curry', 'cur', 'vegan')
+    ''')
+    assert backfill_meal_categories(conn.cursor()) == 2
+    conn.commit()
+
+    rows = conn.execute("SELECT category FROM meal_categories ORDER BY category").fetchall()
+    assert [r['category'] for r in rows] == ["low_carb", "vegan", "vegan"]
+    assert len(select_candidate_ids(conn, ["vegan"])) == 2
+    assert len(select_candidate_ids(conn, ["vegan"], "lunch/dinner")) == 1
+    assert select_candidate_ids(conn, ["keto"]) == []
+    conn.close()
+
+def write_meals_xlsx(path, rows):
+    """Helper that writes meal rows to an Excel file with the importer's headers."""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["type", "meal name", "identifier", "categories", "preptime",
+                  "overnight", "equipment", "ingredients", "instructions"])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+def test_import_meals_populates_meal_categories(temp_db, tmp_path, monkeypatch):
+    """
+    The importer writes meal_categories rows for every imported meal.
+    """
+    import import_meals
+    monkeypatch.setattr(import_meals, "DATABASE", temp_db.app.config["DATABASE"])
+    xlsx = tmp_path / "meals.xlsx"
+    write_meals_xlsx(xlsx, [
+        ["breakfast", "oats", "oat", "vegan; save_time", 5, True, "bowl", "50 g oats", "1. mix."],
+    ])
+    import_meals.import_meals_from_excel(str(xlsx))
+
+    conn = get_db_connection()
+    rows = conn.execute("SELECT category FROM meal_categories ORDER BY category").fetchall()
+    conn.close()
+    assert [r['category'] for r in rows] == ["save_time", "vegan"]
+
+def test_import_meals_upserts_only_changed_rows(temp_db, tmp_path, monkeypatch):
+    """
+    Re-importing updates edited meals in place, skips unchanged ones, and
+    leaves the catalog version alone when nothing changed.
+    """
+    import import_meals
+    from catalog import get_catalog_version
+    monkeypatch.setattr(import_meals, "DATABASE", temp_db.app.config["DATABASE"])
+    xlsx = tmp_path / "meals.xlsx"
+    oats = ["breakfast", "oats", "oat", "vegan", 5, False, "bowl", "50 g oats", "1. mix."]
+    curry = ["lunch/dinner", "curry", "cur", "keto", 30, False, "pot", "rice", "1. cook."]
+    write_meals_xlsx(xlsx, [oats, curry])
+    stats = import_meals.import_meals_from_excel(str(xlsx), batch_size=1)
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (2, 0, 0)
+
+    conn = get_db_connection()
+    version = get_catalog_version(conn)
+    stats = import_meals.import_meals_from_excel(str(xlsx))
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (0, 0, 2)
+    assert get_catalog_version(conn) == version
+
+    curry[1], curry[3] = "green curry", "vegan"
+    write_meals_xlsx(xlsx, [oats, curry, ["breakfast", "bad", "bad", "vegan", "n/a"]])
+    stats = import_meals.import_meals_from_excel(str(xlsx))
+    assert (stats["inserted"], stats["updated"], stats["unchanged"], stats["invalid"]) == (0, 1, 1, 1)
+    row = conn.execute("SELECT id, name FROM meals WHERE identifier = 'cur'").fetchone()
+    assert row["name"] == "green curry"
+    categories = conn.execute("SELECT category FROM meal_categories WHERE meal_id = ?", (row["id"],)).fetchall()
+    assert [c["category"] for c in categories] == ["vegan"]
+    assert conn.execute("SELECT COUNT(*) FROM meals").fetchone()[0] == 2
+    conn.close()
+
+def test_connection_reused_per_request_with_wal(temp_db):
+    """
+    Within one request every helper shares a single WAL-mode connection,
+    and the connection is closed when the request ends.
+    """
+    with temp_db.app.test_request_context():
+        conn = temp_db.get_db()
+        assert temp_db.get_db() is conn
+        assert register_user("pooled", "pw") is True
+        assert verify_user("pooled", "pw") is not None
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+def test_generate_meal_plan_seed_is_reproducible(temp_db):
+    """
+    Regenerating with the same seed stores exactly the same plan.
+    """
+    conn = get_db_connection()
+    for i in range(20):
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('seed', 'x')").lastrowid
+    conn.commit()
+
+    def stored_plan():
+        return conn.execute(
+            "SELECT day, slot, meal_id FROM user_meals WHERE user_id = ? ORDER BY day, slot",
+            (user_id,)).fetchall()
+
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 30, user_id, seed=3)
+    first = [tuple(r) for r in stored_plan()]
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 30, user_id, seed=3)
+    assert [tuple(r) for r in stored_plan()] == first
+    assert len(first) == 60
+
+    # A plan that cannot be filled leaves the existing plan untouched
+    assert temp_db.generate_meal_plan(["keto"], "Lunch & Dinner", 30, user_id) is False
+    assert [tuple(r) for r in stored_plan()] == first
+    conn.close()
+
+def test_migrations_upgrade_old_user_meals(tmp_path, monkeypatch):
+    """
+    An existing database with the original schema is upgraded in place:
+    user_meals is keyed by (user_id, day, slot) with integer slot and status codes.
+    """
+    import project
+    from migrations import get_schema_version, latest_schema_version
+    db_path = str(tmp_path / "old.db")
+    old = sqlite3.connect(db_path)
+    old.executescript('''
+        CREATE TABLE meals (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, name TEXT NOT NULL,
+                            identifier TEXT UNIQUE, categories TEXT, prep_time INTEGER,
+                            overnight INTEGER, equipment TEXT, ingredients TEXT,
+                            instructions TEXT, image TEXT);
+        CREATE TABLE favorites (user_id INTEGER, meal_id INTEGER, PRIMARY KEY (user_id, meal_id));
+        CREATE TABLE user_meals (user_id INTEGER, day INTEGER, meal_type TEXT,
+                                 meal_id INTEGER, status TEXT DEFAULT 'pending');
+        INSERT INTO meals (type, name, identifier, categories) VALUES ('Breakfast', 'Oats', 'oat', 'vegan');
+        INSERT INTO user_meals VALUES (1, 1, 'Dinner', 1, 'done');
+        INSERT INTO user_meals VALUES (1, 1, 'Breakfast', 1, 'pending');
+    ''')
+    old.commit()
+    old.close()
+
+    monkeypatch.setitem(project.app.config, "DATABASE", db_path)
+    create_tables()
+    conn = project.get_db()
+    assert get_schema_version(conn) == latest_schema_version()
+    rows = conn.execute("SELECT day, slot, status FROM user_meals ORDER BY day, slot").fetchall()
+    assert [tuple(r) for r in rows] == [(1, 1, 0), (1, 3, 1)]
+    assert conn.execute("SELECT category FROM meal_categories").fetchone()['category'] == "vegan"
+    assert conn.execute("SELECT current_day FROM user_progress WHERE user_id = 1").fetchone()[0] == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO user_meals (user_id, day, slot, meal_id) VALUES (1, 1, 1, 1)")
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM user_meals WHERE user_id = 1 ORDER BY day, slot").fetchall()
+    assert "TEMP B-TREE" not in " ".join(r['detail'] for r in plan)
+
+    # Running again is a no-op
+    create_tables()
+    project.close_thread_connections()
+
+def test_dashboard_progress_follows_done_and_skip(temp_db):
+    """
+    done/skip keep user_progress in sync, so the dashboard day advances once
+    every meal of the current day is done or skipped.
+    """
+    conn = get_db_connection()
+    for i in range(4):
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('prog', 'x')").lastrowid
+    conn.commit()
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 2, user_id, seed=1)
+
+    day, meals = temp_db.get_earliest_incomplete_day_meals(user_id)
+    assert day == 1 and [m['meal_type'] for m in meals] == ["Lunch", "Dinner"]
+
+    assert temp_db.set_meal_status(user_id, 1, "Lunch", meals[0]['id'], "done")
+    assert temp_db.get_earliest_incomplete_day_meals(user_id)[0] == 1
+    # Switching a finished meal between done and skipped does not change the count
+    assert temp_db.set_meal_status(user_id, 1, "Lunch", meals[0]['id'], "skipped")
+    assert temp_db.get_earliest_incomplete_day_meals(user_id)[0] == 1
+    assert temp_db.set_meal_status(user_id, 1, "Dinner", meals[1]['id'], "skipped")
+
+    day, meals = temp_db.get_earliest_incomplete_day_meals(user_id)
+    assert day == 2
+    for meal in meals:
+        temp_db.set_meal_status(user_id, 2, meal['meal_type'], meal['id'], "done")
+    assert temp_db.get_earliest_incomplete_day_meals(user_id) == (None, None)
+    # Unknown meals are ignored
+    assert temp_db.set_meal_status(user_id, 2, "Lunch", 999, "done") is False
+    conn.close()
+
+def test_parse_meal_details_lists():
+    """
+    Instructions lose their step numbers; ingredients and equipment lose '(...)' notes.
+    """
+    from recipes import parse_meal_details
+    meal = parse_meal_details({
+        "instructions": "1. toast bread. 2. poach eggs (3 min).\n3",
+        "ingredients": "2 slices bread (60 g); 1 avocado; ",
+        "equipment": "toaster, pot (small)",
+    })
+    assert meal["instructions_list"] == ["Toast bread", "Poach eggs (3 min)"]
+    assert meal["ingredients_list"] == ["2 slices bread", "1 avocado"]
+    assert meal["equipment_list"] == ["Toaster", "Pot"]
+
+def test_meal_details_cache_hits_and_invalidation(temp_db):
+    """
+    Repeated lookups are served from the cache until the meal is re-imported.
+    """
+    conn = get_db_connection()
+    meal_id = insert_meal(conn, "Breakfast", "Oats", "oat", "vegan")
+    conn.execute("UPDATE meals SET ingredients = '50 g oats' WHERE id = ?", (meal_id,))
+    conn.commit()
+
+    before = temp_db.meal_details_cache_stats()
+    assert temp_db.get_meal_details(meal_id)["ingredients_list"] == ["50 g oats"]
+    assert temp_db.get_meal_details(meal_id)["ingredients_list"] == ["50 g oats"]
+    after = temp_db.meal_details_cache_stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    conn.execute("UPDATE meals SET ingredients = '60 g oats' WHERE id = ?", (meal_id,))
+    conn.commit()
+    conn.close()
+    assert temp_db.get_meal_details(meal_id)["ingredients_list"] == ["60 g oats"]
+    assert temp_db.get_meal_details(12345) is None
+
+def test_configure_app_reads_env_and_warms_up(tmp_path, monkeypatch):
+    """
+    configure_app() takes settings from FITMATE_* variables, warms the worker up
+    (schema, catalog, templates) and records startup timings.
+    """
+    import project
+    saved_config = dict(project.app.config)
+    db_path = str(tmp_path / "factory.db")
+    monkeypatch.setenv("FITMATE_DATABASE", db_path)
+    monkeypatch.setenv("FITMATE_SECRET_KEY", "from-env")
+    try:
+        app = project.configure_app()
+        assert app.config["DATABASE"] == db_path
+        assert app.secret_key == "from-env"
+        assert project.startup_timings["warm_up_seconds"] is not None
+        assert len(app.jinja_env.cache) >= len(app.jinja_env.list_templates())
+
+        project.mark_worker_started()
+        response = app.test_client().get("/server_stats")
+        assert response.status_code == 200
+        assert response.get_json()["startup"]["time_to_first_request_seconds"] >= 0
+
+        conn = sqlite3.connect(db_path)
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        conn.close()
+        assert {"users", "meals", "user_meals", "meal_categories"} <= tables
+    finally:
+        project.app.config.clear()
+        project.app.config.update(saved_config)
+
+def test_metrics_endpoint_counts_requests_and_sql(temp_db):
+    """
+    /metrics reports per-route latency histograms and per-request SQL counts,
+    and slow statements are counted when a threshold is set.
+    """
+    import metrics
+    client = temp_db.app.test_client()
+    assert client.post('/signup', data={'username': 'metrics', 'password': 'pw',
+                                        'confirm_password': 'pw'}).status_code == 302
+    assert client.get('/dashboard').status_code == 200
+
+    slow_before = sum(metrics.SLOW_QUERIES.series.values())
+    metrics.settings['slow_query_seconds'] = 0.0
+    try:
+        client.get('/dashboard')
+    finally:
+        metrics.settings['slow_query_seconds'] = None
+    assert sum(metrics.SLOW_QUERIES.series.values()) > slow_before
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'fitmate_request_duration_seconds_count{endpoint="dashboard",method="GET",status="200"}' in body
+    assert 'fitmate_request_sql_statements_count{endpoint="signup"}' in body
+    assert 'fitmate_sql_statements_total{operation="INSERT"}' in body
+    assert 'fitmate_cache_events{cache="meal_details",result="hit"}' in body
+
+def test_profiling_sampled_routes(temp_db, tmp_path):
+    """
+    Requests to a profiled route write a .prof file when sampled.
+    """
+    import metrics
+    saved = dict(metrics.settings)
+    metrics.settings.update(profile_routes={'index'}, profile_sample_rate=1.0,
+                            profile_dir=str(tmp_path / "profiles"))
+    try:
+        temp_db.app.test_client().get('/')
+        temp_db.app.test_client().get('/login')
+    finally:
+        metrics.settings.update(saved)
+    files = list((tmp_path / "profiles").iterdir())
+    assert len(files) == 1 and files[0].name.startswith("index-")
+
+def test_failed_requests_are_recorded_and_stop_profiling(temp_db, tmp_path, monkeypatch):
+    """
+    A view that raises is still timed (as a 500) and its profiler is disabled.
+    """
+    import metrics
+    from flask import g
+    app = temp_db.app
+    seen = {}
+    def failing_render(*args, **kwargs):
+        seen['profiler'] = g.get('profiler')
+        raise RuntimeError("template failed")
+    monkeypatch.setattr(temp_db, 'render_template', failing_render)
+    # Propagated exceptions (testing/debug mode) skip after_request hooks entirely
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', True)
+    saved = dict(metrics.settings)
+    metrics.settings.update(profile_routes={'index'}, profile_sample_rate=1.0,
+                            profile_dir=str(tmp_path / "profiles"))
+    labels = ('index', 'GET', '500')
+    before = metrics.REQUEST_LATENCY.series.get(labels, [None, 0])[1]
+    try:
+        with pytest.raises(RuntimeError):
+            app.test_client().get('/')
+    finally:
+        metrics.settings.update(saved)
+    assert metrics.REQUEST_LATENCY.series[labels][1] == before + 1
+    assert seen['profiler'] is not None and sys.getprofile() is None
+    assert len(list((tmp_path / "profiles").iterdir())) == 1
+
+def test_conditional_get_for_meal_and_favorites_pages(temp_db):
+    """
+    Pages carry ETags built from data versions: a matching If-None-Match gets a
+    304, and a write to the user's favorites (or a catalog change) changes the tag.
+    """
+    conn = get_db_connection()
+    meal_id = insert_meal(conn, "Breakfast", "Oats", "oat", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('etag', 'x')").lastrowid
+    conn.commit()
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    first = client.get(f'/meal_details/{meal_id}')
+    assert first.status_code == 200 and first.headers['ETag'].startswith('W/')
+    assert 'no-cache' in first.headers['Cache-Control']
+    cached = client.get(f'/meal_details/{meal_id}', headers={'If-None-Match': first.headers['ETag']})
+    assert cached.status_code == 304 and cached.headers['ETag'] == first.headers['ETag']
+
+    favorites = client.get('/favorites')
+    etag = favorites.headers['ETag']
+    assert client.get('/favorites', headers={'If-None-Match': etag}).status_code == 304
+    temp_db.add_favorite(user_id, meal_id)
+    changed = client.get('/favorites', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and b'Oats' in changed.data
+    assert changed.headers['ETag'] != etag
+
+    conn.execute("UPDATE meals SET name = 'Porridge' WHERE id = ?", (meal_id,))
+    conn.commit()
+    conn.close()
+    assert client.get(f'/meal_details/{meal_id}',
+                      headers={'If-None-Match': first.headers['ETag']}).status_code == 200
+
+def test_static_urls_are_versioned_and_long_cached(temp_db, monkeypatch):
+    """
+    url_for('static', ...) adds the file's mtime, and static responses get a long
+    max-age; unversioned static URLs only a short one.
+    """
+    monkeypatch.setitem(temp_db.app.config, 'SEND_FILE_MAX_AGE_DEFAULT',
+                        temp_db.DEFAULT_CONFIG['SEND_FILE_MAX_AGE_DEFAULT'])
+    with temp_db.app.test_request_context():
+        url = temp_db.url_for('static', filename='css/style.css')
+    assert '?v=' in url
+    response = temp_db.app.test_client().get(url)
+    assert response.cache_control.max_age == 365 * 24 * 3600
+    response.close()
+    # Files referenced without a version (url() in style.css) are revalidated soon
+    response = temp_db.app.test_client().get('/static/icons/favorites.png')
+    assert response.cache_control.max_age == temp_db.DEFAULT_CONFIG['STATIC_UNVERSIONED_MAX_AGE']
+    response.close()
+
+def test_meal_image_derivatives_and_srcset(temp_db, tmp_path):
+    """
+    The image pipeline writes WebP/JPEG copies per width, records them in
+    meal_images (bumping the catalog), and templates get srcset URLs; meals
+    without derivatives keep the original URL.
+    """
+    Image = pytest.importorskip("PIL.Image")
+    import images
+    from catalog import get_catalog_version
+    static = tmp_path / "static"
+    (static / "images" / "meals").mkdir(parents=True)
+    Image.new("RGB", (800, 600), "green").save(static / "images" / "meals" / "oat.png")
+    conn = get_db_connection()
+    meal_id = insert_meal(conn, "Breakfast", "Oats", "oat", "vegan")
+    other_id = insert_meal(conn, "Breakfast", "Toast", "toast", "vegan")
+    version = get_catalog_version(conn)
+
+    stats = images.generate_meal_images(conn, str(static))
+    assert stats["files_written"] == 6 and stats["missing"] == 1
+    assert (static / "images" / "derived" / "images" / "meals" / "oat-320.webp").exists()
+    assert get_catalog_version(conn) > version
+    # A second run finds everything up to date and writes nothing
+    version = get_catalog_version(conn)
+    assert images.generate_meal_images(conn, str(static))["files_written"] == 0
+    assert get_catalog_version(conn) == version
+    conn.close()
+
+    with temp_db.app.test_request_context():
+        image = temp_db.meal_image({"id": meal_id, "identifier": "oat"})
+        plain = temp_db.meal_image({"id": other_id, "identifier": "toast"})
+    assert "images/derived/images/meals/oat-160.webp 160w" in image["webp_srcset"]
+    assert "oat-640.jpg" in image["src"] and "320w" in image["srcset"]
+    assert "images/meals/toast.png" in plain["src"] and plain["srcset"] == ""
+
+def test_json_api_plan_status_favorites_and_catalog(temp_db):
+    """
+    The JSON API serves plan ranges and the dashboard day with meals sent once,
+    updates statuses and favorites in place, and pages the catalog by id.
+    """
+    conn = get_db_connection()
+    ids = [insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan") for i in range(5)]
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('api', 'x')").lastrowid
+    conn.commit()
+    conn.close()
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 3, user_id, seed=2)
+    client = temp_db.app.test_client()
+    assert client.get('/api/dashboard').status_code == 401
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    plan = client.get('/api/plan?from=2&to=3').get_json()
+    assert [d['day'] for d in plan['days']] == [2, 3]
+    assert all(str(item['meal']) in plan['meals'] for d in plan['days'] for item in d['items'])
+    assert client.get('/api/plan?from=x').status_code == 400
+
+    dashboard = client.get('/api/dashboard').get_json()
+    assert dashboard['day'] == 1 and len(dashboard['items']) == 2
+    for item in dashboard['items']:
+        response = client.post(f"/api/plan/1/{item['type']}/status",
+                               json={'meal': item['meal'], 'status': 'done'})
+        assert response.status_code == 200
+    assert response.get_json()['current_day'] == 2
+    assert client.post('/api/plan/1/Lunch/status', json={'meal': 999, 'status': 'done'}).status_code == 404
+    assert client.post('/api/plan/1/Lunch/status', json={'status': 'eaten'}).status_code == 400
+
+    assert client.put(f'/api/favorites/{ids[0]}').get_json() == {'meal': ids[0], 'favorite': True}
+    assert client.put(f'/api/favorites/{ids[0]}').status_code == 200
+    assert client.put('/api/favorites/999').status_code == 404
+    assert client.get('/api/favorites').get_json()['favorites'] == [ids[0]]
+    client.delete(f'/api/favorites/{ids[0]}')
+    assert client.get('/api/favorites').get_json()['favorites'] == []
+
+    seen, after = [], 0
+    while after is not None:
+        page = client.get(f'/api/meals?category=vegan&type=Lunch/Dinner&limit=2&after={after}').get_json()
+        seen += [meal['id'] for meal in page['meals']]
+        after = page['next']
+    assert seen == ids
+    assert client.get('/api/meals?category=keto').get_json() == {'meals': [], 'next': None}
+
+def test_meal_search_ranked_prefix_and_filters(temp_db):
+    """
+    The FTS index follows inserts, updates and deletes on meals; search matches
+    word prefixes, ranks name matches first, and filters by type and category.
+    """
+    from search import build_match_query, search_meal_ids
+    conn = get_db_connection()
+    chicken = insert_meal(conn, "lunch/dinner", "Chicken rice bowl", "crb", "high_protein")
+    salad = insert_meal(conn, "lunch/dinner", "Green salad", "gs", "vegan")
+    oats = insert_meal(conn, "breakfast", "Overnight oats", "oo", "vegan")
+    conn.execute("UPDATE meals SET ingredients = '100 g chicken; lettuce' WHERE id = ?", (salad,))
+    conn.execute("UPDATE meals SET ingredients = 'oats; milk', equipment = 'jar' WHERE id = ?", (oats,))
+    conn.commit()
+
+    assert build_match_query('chick "OR" ric-') == '"chick"* "OR"* "ric"*'
+    assert build_match_query(' +* ') is None
+    assert search_meal_ids(conn, "chick") == [chicken, salad]
+    assert search_meal_ids(conn, "chick ric") == [chicken]
+    assert search_meal_ids(conn, "chick", category="Vegan") == [salad]
+    assert search_meal_ids(conn, "ja", meal_type="Breakfast") == [oats]
+    assert search_meal_ids(conn, "chick", limit=1, offset=1) == [salad]
+
+    conn.execute("DELETE FROM meals WHERE id = ?", (chicken,))
+    conn.commit()
+    assert search_meal_ids(conn, "rice") == []
+    conn.close()
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    page = client.get('/api/search?q=oat&limit=1').get_json()
+    assert [m['id'] for m in page['meals']] == [oats] and page['next'] is None
+
+def test_allergies_and_diet_filter_plans_and_swaps(temp_db):
+    """
+    Ingredients compile to allergen groups and words; a user's allergies and
+    diet exclude matching meals (and meals without features) from generated
+    plans and from swap listings.
+    """
+    from allergens import exclusion_terms, extract_features, unmatched_preferences
+    assert {'group:dairy', 'group:tree_nut'} <= extract_features("200 ml milk; 30 g almonds")
+    assert 'group:dairy' not in extract_features("250 ml unsweetened almond milk")
+    assert 'word:mushroom' in extract_features("100 g sliced mushrooms (any kind)")
+    assert exclusion_terms("Peanuts, mushrooms", "vegetarian") == {
+        'group:peanut', 'word:mushroom', 'group:meat', 'group:fish', 'group:shellfish'}
+    assert exclusion_terms("none", "") == set()
+    # Diet wording that is not a known diet excludes nothing (only allergies match words)
+    assert exclusion_terms("", "high protein, low carb") == set()
+    assert exclusion_terms("", "chicken lover; no red meat") == set()
+    assert exclusion_terms("", "Vegan, high protein") == exclusion_terms("", "vegan")
+    assert exclusion_terms("red meat", "") == {'word:red', 'word:meat'}
+    # Common "... free" wording maps to its group, in either field
+    assert exclusion_terms("", "lactose free, nut-free; egg free") == {
+        'group:dairy', 'group:peanut', 'group:tree_nut', 'group:egg'}
+    assert unmatched_preferences("Vegan, high protein; no red meat") == ['high protein', 'red meat']
+
+    conn = get_db_connection()
+    soup = insert_meal(conn, "lunch/dinner", "Lentil soup", "ls", "keto", ingredients="lentils; carrots")
+    insert_meal(conn, "lunch/dinner", "Satay", "sat", "keto", ingredients="chicken; 2 tbsp peanut butter")
+    risotto = insert_meal(conn, "lunch/dinner", "Risotto", "ris", "keto", ingredients="rice; mushrooms")
+    unknown = insert_meal(conn, "lunch/dinner", "Unknown", "unk", "keto")
+    conn.execute("DELETE FROM meal_features WHERE meal_id = ?", (unknown,))
+    user_id = conn.execute(
+        "INSERT INTO users (username, password, allergies) VALUES ('allergic', 'x', 'peanuts, mushrooms')"
+    ).lastrowid
+    conn.commit()
+
+    # Only the soup is left, and a day needs two different meals
+    assert temp_db.generate_meal_plan(["keto"], "Lunch & Dinner", 1, user_id, seed=1) is False
+    conn.execute("UPDATE users SET allergies = 'peanuts' WHERE id = ?", (user_id,))
+    conn.commit()
+    assert temp_db.generate_meal_plan(["keto"], "Lunch & Dinner", 5, user_id, seed=1) is True
+    planned = {r[0] for r in conn.execute("SELECT meal_id FROM user_meals WHERE user_id = ?", (user_id,))}
+    conn.close()
+    assert planned == {soup, risotto}
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    page = client.post('/change_meal/1/Lunch', data={'step': 'pick_category', 'chosen_category': 'keto'})
+    offered = {int(i) for i in re.findall(rb'<option value="(\d+)"', page.data)}
+    assert offered == {soup, risotto}
+
+    # Saving a diet that filters nothing says so instead of dropping it silently
+    form = {'name': 'A', 'lastname': 'B', 'age': '30', 'gender': 'Other', 'height': '170',
+            'height_unit': 'cm', 'weight': '70', 'weight_unit': 'kg', 'allergies': 'peanuts'}
+    page = client.post('/my_account', data=dict(form, dietary_preferences='vegan, paleo'),
+                       follow_redirects=True).get_data(as_text=True)
+    assert "paleo" in page and "does not" in page
+    page = client.post('/my_account', data=dict(form, dietary_preferences='lactose free'),
+                       follow_redirects=True).get_data(as_text=True)
+    assert "does not" not in page
+
+def test_shopping_list_aggregates_parsed_ingredients(temp_db):
+    """
+    Ingredient entries are parsed once into name/quantity/unit; the shopping
+    list sums them over a day range (skipped meals left out) and streams as CSV.
+    """
+    from recipes import parse_ingredient_entries
+    assert parse_ingredient_entries("2 garlic cloves (minced); 1 kg potatoes; salt and pepper") == [
+        ('garlic', 2.0, 'clove'), ('potato', 1000.0, 'g'), ('salt and pepper', None, '')]
+    assert parse_ingredient_entries("2 egg whites + 1 whole egg") == [('egg white', 2.0, ''), ('egg', 1.0, '')]
+
+    conn = get_db_connection()
+    soup = insert_meal(conn, "lunch/dinner", "Soup", "sp", "keto",
+                       ingredients="150 g diced onions; 1 garlic clove; salt and pepper")
+    stew = insert_meal(conn, "lunch/dinner", "Stew", "st", "keto",
+                       ingredients="50 g onion; 2 garlic cloves (minced)")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('shop', 'x')").lastrowid
+    conn.executemany("INSERT INTO user_meals (user_id, day, slot, meal_id) VALUES (?, ?, ?, ?)",
+                     [(user_id, 1, 2, soup), (user_id, 1, 3, stew),
+                      (user_id, 2, 2, soup), (user_id, 9, 2, stew)])
+    conn.commit()
+    conn.close()
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    page = client.get('/shopping_list?first=1&last=7')
+    assert page.status_code == 200 and b'Onion' in page.data
+
+    response = client.get('/shopping_list.csv?first=1&last=7')
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert response.get_data(as_text=True).splitlines() == [
+        'ingredient,quantity,unit,meals', 'garlic,4,clove,3', 'onion,350,g,3', 'salt and pepper,,,2']
+
+    # Skipping a meal changes the plan version, so the cached list is rebuilt
+    client.post(f'/skip_meal/{soup}/2/Lunch')
+    text = client.get('/shopping_list.txt?first=1&last=7').get_data(as_text=True)
+    assert '- onion (200 g)' in text and '- garlic (3 clove)' in text
+
+def test_bulk_status_updates_and_batched_clicks(temp_db, monkeypatch):
+    """
+    Many statuses are set in one request with progress kept in sync, and
+    single clicks arriving while another is being written share one transaction.
+    """
+    import threading
+    import time
+    conn = get_db_connection()
+    for i in range(6):
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('bulk', 'x')").lastrowid
+    conn.commit()
+    conn.close()
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 3, user_id, seed=3)
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    updates = [{'day': day, 'type': slot, 'status': 'done'} for day in (1, 2) for slot in ("Lunch", "Dinner")]
+    response = client.post('/api/plan/status', json={'updates': updates + [{'day': 9, 'type': 'Lunch', 'status': 'done'}]})
+    assert response.get_json() == {'found': [True] * 4 + [False], 'current_day': 3}
+    assert client.post('/api/plan/status', json={'updates': [{'day': 3, 'type': 'Lunch', 'status': 'eaten'}]}).status_code == 400
+    assert client.post('/api/plan/status', json={'updates': []}).status_code == 400
+    # Back to pending: day 2 is the current day again
+    response = client.post('/api/plan/status', json={'updates': [{'day': 2, 'type': 'Dinner', 'status': 'pending'}]})
+    assert response.get_json()['current_day'] == 2
+
+    day, meals = temp_db.get_earliest_incomplete_day_meals(user_id)
+    dinner = next(m for m in meals if m['meal_type'] == "Dinner")
+    form = {'status': 'skipped', 'meal': [f"2:Dinner:{dinner['id']}"]}
+    assert client.post('/plan_status', data=form).status_code == 302
+    assert temp_db.get_earliest_incomplete_day_meals(user_id)[0] == 3
+
+    monkeypatch.setitem(temp_db.app.config, "STATUS_BATCH_MS", 200)
+    batcher = temp_db.status_batcher
+    database = temp_db.app.config['DATABASE']
+    # A lone click is written at once, without waiting for the window
+    started = time.perf_counter()
+    with temp_db.app.test_request_context():
+        assert temp_db.set_meal_status(user_id, 3, "Lunch", None, "done")
+    assert time.perf_counter() - started < 0.1 and database not in batcher.writing
+
+    # Clicks arriving during a write share one batch; a bad one fails alone
+    batches = batcher.batches
+    in_progress = batcher.writing[database] = threading.Event()
+    results = {}
+
+    def click(day, slot, status):
+        with temp_db.app.test_request_context():
+            try:
+                results[day, slot] = temp_db.set_meal_status(user_id, day, slot, None, status)
+            except KeyError:
+                results[day, slot] = 'error'
+
+    threads = [threading.Thread(target=click, args=args)
+               for args in ((2, "Dinner", "done"), (1, "Lunch", "skipped"), (3, "Lunch", "eaten"))]
+    for thread in threads:
+        thread.start()
+    while len(batcher.queues.get(database, ())) < 3:
+        time.sleep(0.001)
+    del batcher.writing[database]
+    in_progress.set()
+    for thread in threads:
+        thread.join()
+    assert results == {(2, "Dinner"): True, (1, "Lunch"): True, (3, "Lunch"): 'error'}
+    assert batcher.batches == batches + 1
+    statuses = {(m['day'], m['meal_type']): m['status'] for m in temp_db.get_user_meal_plan(user_id)}
+    assert statuses[2, "Dinner"] == "done" and statuses[1, "Lunch"] == "skipped"
+    assert temp_db.get_earliest_incomplete_day_meals(user_id)[0] == 3
+
+def test_meal_plan_form_queues_a_background_job(temp_db):
+    """
+    Submitting the plan form queues a job and returns at once; repeated submissions
+    share the job, only jobs whose heartbeat stopped are requeued, its progress can
+    be polled, and the review page shows the plan.
+    """
+    import time
+    from jobs import claim_job, get_job, set_job_progress, submit_job
+    conn = get_db_connection()
+    for i in range(4):
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('jobs', 'x')").lastrowid
+    conn.commit()
+
+    # Deduplication: same params share a job, new params replace a queued one
+    first = submit_job(conn, 'test', user_id, {'days': 3})
+    assert submit_job(conn, 'test', user_id, {'days': 3}) == first
+    assert submit_job(conn, 'test', user_id, {'days': 5}) == first
+    assert claim_job(conn, 'test')['params'] == {'days': 5}
+    assert submit_job(conn, 'test', user_id, {'days': 5}) == first
+    second = submit_job(conn, 'test', user_id, {'days': 7})
+    assert second != first
+
+    # A long-running job that still reports progress keeps running; a silent one is requeued
+    conn.execute("UPDATE jobs SET started_at = 0 WHERE id = ?", (first,))
+    conn.commit()
+    set_job_progress(conn, first, 0.5)
+    assert claim_job(conn, 'test')['id'] == second
+    assert get_job(conn, first)['state'] == 'running'
+    conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (first,))
+    conn.commit()
+    assert claim_job(conn, 'test')['id'] == first
+
+    # Progress follows the days being built
+    fractions = []
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 40, user_id, progress=fractions.append)
+    assert len(fractions) > 10 and fractions == sorted(fractions)
+    assert fractions[0] == temp_db.PLAN_PROGRESS_CANDIDATES and fractions[-1] == temp_db.PLAN_PROGRESS_BUILT
+    conn.close()
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    form = {'goal': 'vegan', 'meals_per_day': 'Lunch & Dinner', 'duration': '3'}
+    response = client.post('/meal_plan', data=form)
+    job_id = int(response.headers['Location'].rsplit('job=', 1)[1])
+    for _ in range(200):
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['state'] in ('done', 'failed'):
+            break
+        time.sleep(0.01)
+    assert job['state'] == 'done' and job['progress'] == 1
+    page = client.get(f'/review_meal_plan?job={job_id}')
+    assert b"Day 3" in page.data
+    assert len(temp_db.get_user_meal_plan(user_id)) == 6
+
+    # A plan that cannot be filled fails the job and sends the user back to the form
+    response = client.post('/meal_plan', data=dict(form, goal='keto'))
+    job_id = int(response.headers['Location'].rsplit('job=', 1)[1])
+    for _ in range(200):
+        if client.get(f'/api/jobs/{job_id}').get_json()['state'] == 'failed':
+            break
+        time.sleep(0.01)
+    assert client.get(f'/review_meal_plan?job={job_id}').headers['Location'].endswith('/meal_plan')
+    assert client.get('/api/jobs/999').status_code == 404
+
+def test_review_meal_plan_shows_one_cached_week(temp_db):
+    """
+    The review page shows a week at a time with keyset links to its neighbours;
+    each week is rendered once, and a swap re-renders only the week it touched.
+    """
+    conn = get_db_connection()
+    ids = [insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan") for i in range(4)]
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('weeks', 'x')").lastrowid
+    conn.commit()
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 10, user_id, seed=4)
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+
+    page = client.get('/review_meal_plan').get_data(as_text=True)
+    assert "Day 7<" in page and "Day 8<" not in page
+    assert "from=8" in page and "Previous Week" not in page
+    page = client.get('/review_meal_plan?from=8').get_data(as_text=True)
+    assert "Day 10<" in page and "Day 7<" not in page and "Next Week" not in page
+
+    rows, prev_first_day, next_first_day = temp_db.get_plan_week(user_id, 8)
+    assert [row[0] for row in rows] == [8, 8, 9, 9, 10, 10]
+    assert (prev_first_day, next_first_day) == (1, None)
+
+    old_meal = rows[2][2]
+    new_meal = next(i for i in ids if i not in (rows[2][2], rows[3][2]))
+    hits = temp_db._cached_review_week.cache_info().hits
+    response = client.post('/change_meal/9/Lunch', data={'step': 'update_meal', 'new_meal_id': new_meal})
+    assert response.headers['Location'].endswith('/review_meal_plan?from=8')
+    client.get('/review_meal_plan')
+    assert temp_db._cached_review_week.cache_info().hits == hits + 1
+    # The cached week carries no URLs of another request, e.g. under a URL prefix
+    page = client.get('/review_meal_plan', base_url='http://localhost/fitmate').get_data(as_text=True)
+    assert 'href="/fitmate/change_meal/1/' in page
+    assert temp_db.get_plan_week(user_id, 8)[0][2] == (9, "Lunch", new_meal) != (9, "Lunch", old_meal)
+    conn.close()
+
+def test_replaced_and_finished_plans_move_to_the_archive(temp_db):
+    """
+    Regenerating a plan archives the old one as a compressed blob, a plan is
+    archived when its last meal is done or skipped (or in bulk, for plans
+    finished some other way), and the history streams back as JSON lines.
+    """
+    import json
+    from plan_archive import archive_finished_plans, iter_archived_plans
+    conn = get_db_connection()
+    for i in range(4):
+        insert_meal(conn, "lunch/dinner", f"Main {i}", f"m{i}", "vegan")
+    user_id = conn.execute("INSERT INTO users (username, password) VALUES ('archive', 'x')").lastrowid
+    conn.commit()
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 2, user_id, seed=5)
+    first_plan = [(row['day'], row['meal_type'], row['id']) for row in temp_db.get_user_meal_plan(user_id)]
+    temp_db.set_meal_statuses(user_id, [(1, "Lunch", "done"), (1, "Dinner", "skipped")])
+
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 1, user_id, seed=6)
+    row = conn.execute("SELECT days, meals, done, skipped, goals FROM plan_archive WHERE user_id = ?",
+                       (user_id,)).fetchone()
+    assert tuple(row) == (2, 4, 1, 1, "vegan")
+    archived = next(iter_archived_plans(conn, user_id))
+    assert [(item['day'], item['type'], item['meal']) for item in archived['items']] == first_plan
+    assert [item['status'] for item in archived['items']] == ['done', 'skipped', 'pending', 'pending']
+    assert conn.execute("SELECT MAX(day) FROM user_meals WHERE user_id = ?", (user_id,)).fetchone()[0] == 1
+
+    # Once every meal is done or skipped the plan leaves the hot table at once
+    temp_db.set_meal_statuses(user_id, [(1, "Lunch", "done")])
+    assert conn.execute("SELECT COUNT(*) FROM plan_archive WHERE user_id = ?", (user_id,)).fetchone()[0] == 1
+    with temp_db.app.test_request_context():
+        assert temp_db.set_meal_status(user_id, 1, "Dinner", None, "skipped")
+    assert conn.execute("SELECT COUNT(*) FROM user_meals WHERE user_id = ?", (user_id,)).fetchone()[0] == 0
+    assert temp_db.get_earliest_incomplete_day_meals(user_id) == (None, None)
+    assert archive_finished_plans(conn) == 0
+
+    # Finished plans written some other way are archived in bulk
+    assert temp_db.generate_meal_plan(["vegan"], "Lunch & Dinner", 1, user_id, seed=7)
+    with conn:
+        conn.execute("UPDATE user_meals SET status = ? WHERE user_id = ?",
+                     (temp_db.STATUS_CODES['done'], user_id))
+        temp_db.reset_plan_progress(conn, user_id)
+    assert archive_finished_plans(conn) == 1
+    conn.close()
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    lines = client.get('/api/plan/history').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['days'] for line in lines] == [2, 1, 1]
+
+def test_similar_meals_index_panel_and_favorite_affinity(temp_db, tmp_path, monkeypatch):
+    """
+    The importer keeps the top-k similar meals of each meal up to date (an
+    incremental update matches a full rebuild); meal pages show similar meals
+    the user can eat, and favorites lend their neighbours plan affinity.
+    """
+    import import_meals
+    from similarity import favorite_affinity, get_neighbors, refresh_meal_neighbors
+    monkeypatch.setattr(import_meals, "DATABASE", temp_db.app.config["DATABASE"])
+    xlsx = tmp_path / "meals.xlsx"
+    rows = [
+        ["breakfast", "berry oats", "bo", "vegan", 5, False, "bowl", "oats; blueberries; almond milk", "1. mix."],
+        ["breakfast", "berry oat bowl", "bb", "vegan", 5, False, "bowl", "oats; blueberries; chia seeds", "1. mix."],
+        ["breakfast", "peanut oats", "po", "vegan", 5, False, "bowl", "oats; peanut butter; banana", "1. mix."],
+        ["breakfast", "egg scramble", "es", "keto", 10, False, "pan", "eggs; butter; chives", "1. cook."],
+        ["lunch/dinner", "oat risotto", "or", "vegan", 30, False, "pot", "oats; blueberries; almond milk", "1. cook."],
+    ]
+    write_meals_xlsx(xlsx, rows)
+    import_meals.import_meals_from_excel(str(xlsx))
+
+    conn = get_db_connection()
+    ids = dict(conn.execute("SELECT identifier, id FROM meals").fetchall())
+    names = {meal_id: identifier for identifier, meal_id in ids.items()}
+    neighbors = [names[n] for n, _ in get_neighbors(conn, ids["bo"])]
+    assert neighbors[:2] == ["bb", "po"] and "or" not in neighbors  # same meal type only
+
+    # Editing one meal re-ranks the lists it enters or leaves, as a full rebuild would
+    rows[3][7] = "oats; blueberries; almond milk; chia seeds"
+    rows[3][3] = "vegan"
+    write_meals_xlsx(xlsx, rows)
+    import_meals.import_meals_from_excel(str(xlsx))
+    incremental = {m: get_neighbors(conn, m) for m in ids.values()}
+    assert names[incremental[ids["bo"]][0][0]] == "es"
+    with conn:
+        refresh_meal_neighbors(conn.cursor())
+    assert {m: get_neighbors(conn, m) for m in ids.values()} == incremental
+
+    user_id = conn.execute(
+        "INSERT INTO users (username, password, allergies) VALUES ('similar', 'x', 'peanuts')").lastrowid
+    conn.execute("INSERT INTO favorites (user_id, meal_id) VALUES (?, ?)", (user_id, ids["bb"]))
+    conn.commit()
+    affinity = favorite_affinity(conn, user_id)
+    assert affinity[ids["bb"]] == 1.0 and 0 < affinity[ids["bo"]] < 1.0
+    conn.close()
+
+    client = temp_db.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    response = client.get(f'/meal_details/{ids["bo"]}')
+    page = response.get_data(as_text=True)
+    assert "Similar Meals" in page and "Egg Scramble" in page and "Berry Oat Bowl" in page
+    assert "Peanut Oats" not in page  # excluded by the user's allergy
+    # Revalidation is answered from the version stamps, without loading the
+    # exclusions; changing the allergies changes the ETag
+    etag = response.headers["ETag"]
+    assert f"u{user_id}" in etag
+    def no_exclusions(*args):
+        raise AssertionError("exclusions loaded for a 304")
+    monkeypatch.setattr(temp_db, "get_user_exclusions", no_exclusions)
+    assert client.get(f'/meal_details/{ids["bo"]}', headers={'If-None-Match': etag}).status_code == 304
+    monkeypatch.undo()
+    conn = get_db_connection()
+    conn.execute("UPDATE users SET allergies = '' WHERE id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+    response = client.get(f'/meal_details/{ids["bo"]}', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+
+def test_similarity_scores_packed_bits_in_bounded_blocks(monkeypatch):
+    """
+    Neighbour scores are Jaccard indexes computed on the packed bitsets, and a
+    full build never holds more than about one block of pairs at a time.
+    """
+    import tracemalloc
+    import numpy as np
+    import similarity
+    monkeypatch.setattr(similarity, 'BLOCK_ROWS', 64)
+    monkeypatch.setattr(similarity, 'BLOCK_COLUMNS', 512)
+    rng = np.random.default_rng(3)
+    ids = list(range(1, 3001))
+    bits = rng.random((len(ids), 256)) < 0.05
+    features = {meal_id: np.packbits(row, bitorder='little').tobytes() for meal_id, row in zip(ids, bits)}
+    categories = {meal_id: {'vegan', 'keto', 'low_fat'} - {['vegan', 'keto', 'low_fat'][meal_id % 3]}
+                  for meal_id in ids}
+    vectors = similarity._TypeVectors(ids, categories, features)
+
+    # Scores of one row match the dense computation
+    overlap = (bits[:1] & bits).sum(axis=1)
+    dense = (1 - similarity.CATEGORY_SHARE) * overlap / np.maximum((bits[:1] | bits).sum(axis=1), 1)
+    dense += similarity.CATEGORY_SHARE * np.where(np.array(ids) % 3 == 1, 1.0, 1 / 3)
+    dense[0] = 0.0
+    scores = np.concatenate([block for _, block in vectors.score_blocks([0])], axis=1)[0]
+    assert np.allclose(scores, dense, atol=1e-6)
+
+    tracemalloc.start()
+    for _ in vectors.top_neighbors(np.arange(len(ids))):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # About 40 bytes per pair of a 64 x 512 block; the unpacked 0/1 matrix alone took 3 MB
+    assert peak < 64 * 512 * 64
@@ -0,0 +1,135 @@
+"""
+test_regenerate_plans.py
+Uses pytest to test the bulk plan tool in regenerate_plans.py:
+- plans are rebuilt from saved settings across worker processes
+- dry runs write nothing, and runs resume from their checkpoints
+- plans can be extended, following on from the existing plan
+- plans lean towards users' favorites
+"""
+
+import os
+import sqlite3
+import pytest
+from benchmark import generate_synthetic_data
+from regenerate_plans import parse_user_ids, regenerate_plans
+
+@pytest.fixture
+def synthetic_db(tmp_path):
+    import project
+    saved_database = project.app.config['DATABASE']
+    database = str(tmp_path / "regen.db")
+    generate_synthetic_data(database, meals=80, users=12, plan_days=4)
+    yield database
+    project.close_thread_connections()
+    project.app.config['DATABASE'] = saved_database
+
+def plan_rows(database):
+    conn = sqlite3.connect(database)
+    rows = conn.execute("SELECT user_id, day, slot, meal_id, status FROM user_meals "
+                        "ORDER BY user_id, day, slot").fetchall()
+    conn.close()
+    return rows
+
+def test_parse_user_ids():
+    assert parse_user_ids("3, 1-2,7-8") == [1, 2, 3, 7, 8]
+
+def test_regenerate_with_pool_is_reproducible(synthetic_db):
+    """
+    Regenerated plans replace the old ones (statuses reset), and the same seed
+    gives the same plans whatever the number of workers.
+    """
+    before = plan_rows(synthetic_db)
+    dry = regenerate_plans(synthetic_db, seed=1, dry_run=True, chunk_size=5, progress=lambda m: None)
+    assert dry['planned'] == 12 and dry['rows'] == 12 * 4 * 3
+    assert plan_rows(synthetic_db) == before
+
+    stats = regenerate_plans(synthetic_db, seed=1, workers=2, chunk_size=5, progress=lambda m: None)
+    assert stats['planned'] == 12 and stats['unfillable'] == 0
+    first = plan_rows(synthetic_db)
+    assert first != before and {row[4] for row in first} == {0}
+
+    regenerate_plans(synthetic_db, seed=1, workers=1, progress=lambda m: None)
+    assert plan_rows(synthetic_db) == first
+
+def test_dry_run_does_not_upgrade_the_schema(synthetic_db):
+    """
+    A dry run refuses an out-of-date schema instead of migrating it.
+    """
+    conn = sqlite3.connect(synthetic_db)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.execute(f"PRAGMA user_version = {version - 1}")
+    conn.close()
+    with pytest.raises(RuntimeError, match="schema"):
+        regenerate_plans(synthetic_db, dry_run=True, progress=lambda m: None)
+    conn = sqlite3.connect(synthetic_db)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == version - 1
+    conn.close()
+    assert not os.path.exists(synthetic_db + '.catalog')
+
+def test_resume_and_extend(synthetic_db):
+    """
+    A run skips the users its checkpoints say are done; --extend appends days.
+    """
+    conn = sqlite3.connect(synthetic_db)
+    conn.executemany("INSERT INTO plan_regeneration_progress (run_id, user_id) VALUES ('r1', ?)",
+                     [(user_id,) for user_id in range(1, 8)])
+    conn.commit()
+    conn.close()
+    stats = regenerate_plans(synthetic_db, run_id='r1', progress=lambda m: None)
+    assert stats['already_done'] == 7 and stats['planned'] == 5
+
+    stats = regenerate_plans(synthetic_db, user_ids=[1, 2], extend=2, progress=lambda m: None)
+    assert stats['rows'] == 2 * 2 * 3
+    conn = sqlite3.connect(synthetic_db)
+    assert conn.execute("SELECT MAX(day) FROM user_meals WHERE user_id = 1").fetchone()[0] == 6
+    assert conn.execute("SELECT duration FROM user_plan_settings WHERE user_id = 1").fetchone()[0] == 6
+    assert conn.execute("SELECT COUNT(*) FROM plan_regeneration_progress").fetchone()[0] == 0
+    conn.close()
+
+def test_regenerated_plans_lean_towards_favorites(synthetic_db):
+    """
+    Favorites (and meals similar to them) carry their affinity into the tasks,
+    and the workers draw a favorite more often than without it.
+    """
+    from catalog import get_catalog
+    from regenerate_plans import _init_worker, load_tasks, plan_chunk
+    conn = sqlite3.connect(synthetic_db)
+    conn.row_factory = sqlite3.Row
+    favorite = conn.execute("SELECT meal_id FROM user_meals WHERE user_id = 1 AND slot = 2 "
+                            "ORDER BY day LIMIT 1").fetchone()[0]
+    conn.execute("INSERT INTO favorites (user_id, meal_id) VALUES (1, ?)", (favorite,))
+    conn.commit()
+    catalog = get_catalog(conn, synthetic_db)
+    (task,), _ = load_tasks(conn, user_ids=[1], duration=1, catalog=catalog)
+    conn.close()
+    affinity = dict(task[7])
+    assert affinity[favorite] == 1.0 and len(affinity) > 1
+
+    _init_worker(catalog.plan_arrays, catalog.feature_bits, catalog.has_features)
+    def favorite_days(affinity):
+        tasks = [task[:5] + (seed,) + task[6:7] + (affinity,) + task[8:] for seed in range(200)]
+        return sum(any(meal_id == favorite for _, _, meal_id in plan) for _, plan in plan_chunk(tasks))
+    assert favorite_days(task[7]) > 1.25 * favorite_days(())
+
+def test_extended_days_follow_on_from_the_plan(synthetic_db):
+    """
+    Days appended by --extend do not repeat the previous day's meals when
+    other candidates are left.
+    """
+    from regenerate_plans import load_tasks
+    conn = sqlite3.connect(synthetic_db)
+    conn.row_factory = sqlite3.Row
+    (task,), _ = load_tasks(conn, user_ids=[1], extend=1)
+    assert task[4] == 5 and task[8] == tuple(tuple(row) for row in conn.execute(
+        "SELECT day, meal_id FROM user_meals WHERE user_id = 1 ORDER BY day, slot"))
+    conn.close()
+
+    regenerate_plans(synthetic_db, extend=1, seed=2, progress=lambda m: None)
+    conn = sqlite3.connect(synthetic_db)
+    rows = conn.execute("SELECT user_id, day, meal_id FROM user_meals WHERE day IN (4, 5)").fetchall()
+    conn.close()
+    days = {}
+    for user_id, day, meal_id in rows:
+        days.setdefault((user_id, day), set()).add(meal_id)
+    assert len(days) == 2 * 12
+    assert all(not days[user_id, 5] & days[user_id, 4] for user_id in range(1, 13))
@@ -0,0 +1,7 @@
+# wsgi.py
+# WSGI entry point for production servers, e.g.:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# The app is configured from FITMATE_* environment variables (see configure_app in project.py).
+from project import configure_app
+
+app = configure_app()